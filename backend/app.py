@@ -1,44 +1,76 @@
+from dotenv import load_dotenv
+
+# before the backend imports below: several read their settings at import time
+load_dotenv()
+
 import os
+import json
+import math
 import datetime
-from flask import Flask, jsonify, request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import Blueprint, Flask, current_app, jsonify, request, Response, stream_with_context
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from model import db, User, Transaction, Document
+from flask_jwt_extended import jwt_required, get_jwt_identity, verify_jwt_in_request
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from model import db, User, Transaction, Document, ItrBatch
 from sqlalchemy import func
 from auth import auth_bp
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask import send_file
-from itr_generator import generate_itr_pdf
-from dotenv import load_dotenv
+from income import income_details
+from itr_generator import format_form_data, render_itr_pdf
 from transactions import transactions_bp
 from document import document_bp
-from gst_check import lookup_gstin_using_keys, api_keys, AllKeysExhausted
-from flask import send_from_directory
+import itr_batch
+import jobs
+import migrations
+import storage
+from gst_check import api_keys, InvalidGSTIN, key_pool, validate_gstin
+import gst_cache
+from pipeline import content_etag, upload_folder
+from werkzeug.security import safe_join
 
 
-load_dotenv()
+basedir = os.path.abspath(os.path.dirname(__file__))
 
-app = Flask(__name__)
-CORS(app, supports_credentials=True, resources={r"/*": {"origins": ["http://localhost:5173", "http://localhost:3000"]}})
+app_bp = Blueprint("app", __name__)
 
 
-basedir = os.path.abspath(os.path.dirname(__file__))
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + os.path.join(basedir, "database.db")
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+def create_app():
+    """
+    Build the Flask app. Used by `flask run`, `python app.py` and serve.py;
+    it does not touch the schema, call init_db(app) once per deployment for that.
+    """
+    app = Flask(__name__)
+    CORS(app, supports_credentials=True, resources={r"/*": {"origins": ["http://localhost:5173", "http://localhost:3000"]}})
+
+    app.config["SQLALCHEMY_DATABASE_URI"] = storage.database_uri(basedir)
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+
+    app.config["JWT_SECRET_KEY"] = os.getenv("JWT_SECRET_KEY")
+    app.config["JWT_ACCESS_TOKEN_EXPIRES"] = datetime.timedelta(minutes=2000)
+    app.config["JWT_REFRESH_TOKEN_EXPIRES"] = datetime.timedelta(days=7)
 
-app.config["JWT_SECRET_KEY"] = os.getenv("JWT_SECRET_KEY")
-app.config["JWT_ACCESS_TOKEN_EXPIRES"] = datetime.timedelta(minutes=2000)
-app.config["JWT_REFRESH_TOKEN_EXPIRES"] = datetime.timedelta(days=7)
+    storage.init_app(app)
+    JWTManager(app)
 
-db.init_app(app)
-JWTManager(app)
+    app.register_blueprint(auth_bp)
+    app.register_blueprint(transactions_bp)
+    app.register_blueprint(document_bp)
+    app.register_blueprint(app_bp)
 
-app.register_blueprint(auth_bp)
-app.register_blueprint(transactions_bp)
-app.register_blueprint(document_bp)
+    jobs.init_app(app)
+    return app
+
+
+def init_db(app):
+    """Create missing tables and apply migrations; run once, not in every worker."""
+    with app.app_context():
+        db.create_all()
+        return migrations.upgrade()
 
-@app.post("/gst/check_public")
+@app_bp.post("/gst/check_public")
 @jwt_required()
 def gst_check():
     data = request.get_json() or {}
@@ -47,7 +79,7 @@ def gst_check():
         return jsonify({"success": False, "error": "Please provide a GSTIN"}), 400
 
     try:
-        result = lookup_gstin_using_keys(api_keys, gstin)
+        result = gst_cache.lookup(gstin)
         resp_payload = {
             "success": True,
             "data": result.get("result", {}),
@@ -58,15 +90,98 @@ def gst_check():
             "raw_wrapper": result,
         }
         return jsonify(resp_payload), 200
-    except:
+    except Exception as e:
+        retry_after = getattr(e, "retry_after", None)
+        if retry_after is not None:
+            # every usable key is backing off; the lookup does not sleep on this thread
+            return (jsonify({"success": False, "error": "GST lookup is busy, try again shortly",
+                             "retry_after": round(retry_after, 2)}),
+                    503, {"Retry-After": str(math.ceil(retry_after))})
         return jsonify({"success": False, "error": "Invalid GSTIN was given"}), 200
 
-@app.post("/itr/generate")
+GST_BATCH_MAX = int(os.getenv("GST_BATCH_MAX", 500))
+GST_BATCH_CONCURRENCY = int(os.getenv("GST_BATCH_CONCURRENCY", 4))
+
+@app_bp.post("/gst/check_batch")
+@jwt_required()
+def gst_check_batch():
+    """
+    Verify many GSTINs. Malformed IDs and bad check digits are rejected locally
+    without an API call; the rest are deduped and looked up GST_BATCH_CONCURRENCY
+    at a time. One JSON line per unique GSTIN is streamed back as each finishes.
+    """
+    data = request.get_json() or {}
+    gstins = data.get("gstins")
+    if not isinstance(gstins, list) or not gstins:
+        return jsonify({"success": False, "error": "Please provide a list of GSTINs"}), 400
+    if len(gstins) > GST_BATCH_MAX:
+        return jsonify({"success": False, "error": f"At most {GST_BATCH_MAX} GSTINs per batch"}), 400
+
+    positions = {}  # normalised GSTIN -> input indexes
+    for i, g in enumerate(gstins):
+        positions.setdefault(str(g or "").strip().upper(), []).append(i)
+
+    app_obj = current_app._get_current_object()
+
+    def check(gstin):
+        with app_obj.app_context():
+            try:
+                result = gst_cache.lookup(gstin)
+                return {"valid": True, "data": result.get("result", {}), "source": result.get("used_key_label")}
+            except InvalidGSTIN:
+                return {"valid": False, "error": "Invalid GSTIN was given"}
+            except Exception as e:
+                line = {"valid": None, "error": "Lookup failed, try again later"}
+                if getattr(e, "retry_after", None) is not None:
+                    line["retry_after"] = round(e.retry_after, 2)
+                return line
+
+    def generate():
+        counts = {"valid": 0, "invalid": 0, "failed": 0}
+        to_lookup = []
+        for gstin, idxs in positions.items():
+            error = validate_gstin(gstin)
+            if error is None:
+                to_lookup.append(gstin)
+                continue
+            counts["invalid"] += 1
+            yield json.dumps({"gstin": gstin, "indexes": idxs, "valid": False, "error": error, "source": "local"}) + "\n"
+
+        executor = ThreadPoolExecutor(max_workers=GST_BATCH_CONCURRENCY)
+        try:
+            futures = {executor.submit(check, g): g for g in to_lookup}
+            for fut in as_completed(futures):
+                gstin = futures[fut]
+                line = {"gstin": gstin, "indexes": positions[gstin], **fut.result()}
+                counts["valid" if line["valid"] else "invalid" if line["valid"] is False else "failed"] += 1
+                yield json.dumps(line) + "\n"
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        yield json.dumps({"done": True, "total": len(gstins), "unique": len(positions), **counts}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+@app_bp.get("/gst/cache_stats")
+@jwt_required()
+def gst_cache_stats():
+    return jsonify(gst_cache.stats()), 200
+
+@app_bp.get("/gst/key_stats")
+@jwt_required()
+def gst_key_stats():
+    pool = key_pool(api_keys)
+    return jsonify({"p95_latency": round(pool.p95(), 3), "keys": pool.stats()}), 200
+
+@app_bp.post("/itr/generate")
 @jwt_required()
 def generate_itr():
     # try:
     user_id = int(get_jwt_identity())
     data = request.get_json() or {}
+    assessment_year = data.get("assessment_year")
+    if assessment_year is not None and not isinstance(assessment_year, int):
+        return jsonify({"error": "assessment_year must be a year such as 2025 (AY 2025-26)"}), 400
     data = data.get("form_data",{})
 
     user = User.query.filter_by(id=user_id).first()
@@ -78,44 +193,15 @@ def generate_itr():
     user.annual_salary = data.get("salary", 0)
 
     db.session.commit()
-    form_data = data
-    st3 = user
-    form_data['name'] = st3.first_name+' '+st3.last_name
-
-    st = form_data['dob']
-    # print(st)
-    form_data['dob'] = st[8]+'  '+st[9]+'  '+st[5]+'  '+st[6]+'  '+st[0]+'  '+st[1]+'  '+st[2]+'  '+st[3]
-    st = form_data['pan']
-    form_data['pan'] = st[0]+'  '+st[1]+'  '+st[2]+'    '+st[3]+'  '+st[4]+'  '+st[5]+'  '+st[6]+'   '+st[7]+'   '+st[8]+'   '+st[9]
-    st = form_data['aadhaar']
-    form_data['aadhaar'] = st[0]+'  '+st[1]+'  '+st[2]+'  '+st[3]+'  '+st[4]+'  '+st[5]+'  '+st[6]+'  '+st[7]+'  '+st[8]+'  '+st[9]+'  '+st[10]+'   '+st[11]
-    form_data['email'] = st3.email
-    form_data['mobile'] = st3.phone_number
-    form_data['salary'] = st3.annual_salary
-    # print(st3.email,st3.annual_salary)
-    st = form_data['address']
-    st = st.split('\n')
-    form_data['address'] = "Address: (A8)"+"         "+st[0]+("\n                               "+st[1] if len(st)>1 else "")
+    form_data = format_form_data(data, user)
     if not form_data:
         return jsonify({"error": "form_data is required"}), 400
 
-    user_transactions = Transaction.query.filter_by(user_id=user_id).all()
-    transactions = [
-        {
-            "amount": t.amount,
-            "category": t.category,
-        }
-        for t in user_transactions
-    ]
-
-    if len(transactions) == 0:
+    computed = income_details(user_id, form_data["employment"], form_data["salary"], assessment_year)
+    if computed is None:
         return jsonify({"error": "No transactions found for user"}), 404
 
-    pdf_stream = generate_itr_pdf(
-        form_data=form_data,
-        transactions=transactions,
-        template_path="ITR_TEMPLATE.pdf",
-    )
+    pdf_stream = render_itr_pdf(form_data | computed, template_path="ITR_TEMPLATE.pdf")
 
     return send_file(
         pdf_stream,
@@ -127,14 +213,119 @@ def generate_itr():
     #     print("ITR generation error:", e)
     #     return jsonify({"error": "Failed to generate PDF"}), 500
 
-@app.get("/documents/<filename>")
+@app_bp.post("/itr/batch")
+@jwt_required()
+def generate_itr_batch():
+    """
+    Queue ITR PDFs for many users (yourself and users of your organization)
+    into one ZIP. Poll /itr/batch/<batch_id>, then GET /itr/batch/<batch_id>/download.
+    """
+    data = request.get_json() or {}
+    user_ids = data.get("user_ids") or []
+    if not isinstance(user_ids, list) or not all(isinstance(u, int) for u in user_ids):
+        return jsonify({"error": "user_ids must be a list of user ids"}), 400
+    assessment_year = data.get("assessment_year")
+    if assessment_year is not None and not isinstance(assessment_year, int):
+        return jsonify({"error": "assessment_year must be a year such as 2025 (AY 2025-26)"}), 400
+    user_ids = list(dict.fromkeys(user_ids))
+    if not user_ids:
+        return jsonify({"error": "user_ids is required"}), 400
+    if len(user_ids) > itr_batch.ITR_BATCH_MAX_USERS:
+        return jsonify({"error": f"At most {itr_batch.ITR_BATCH_MAX_USERS} users per batch"}), 400
+
+    requester = db.session.get(User, int(get_jwt_identity()))
+    allowed = set(itr_batch.allowed_user_ids(requester, user_ids))
+    forbidden = [uid for uid in user_ids if uid not in allowed]
+    if forbidden:
+        return jsonify({"error": "Not allowed to file for these users", "user_ids": forbidden}), 403
+
+    batch = itr_batch.start(current_app._get_current_object(), requester.id, user_ids, assessment_year)
+    return jsonify({"batch_id": batch.id, "status": batch.status, "total": batch.total}), 202
+
+def _own_batch(batch_id):
+    batch = db.session.get(ItrBatch, batch_id)
+    if batch is None or batch.user_id != int(get_jwt_identity()):
+        return None
+    return batch
+
+@app_bp.get("/itr/batch/<batch_id>")
+@jwt_required()
+def itr_batch_status(batch_id):
+    batch = _own_batch(batch_id)
+    if batch is None:
+        return jsonify({"error": "Batch not found"}), 404
+    return jsonify(itr_batch.serialize(batch)), 200
+
+@app_bp.get("/itr/batch/<batch_id>/download")
+@jwt_required()
+def itr_batch_download(batch_id):
+    batch = _own_batch(batch_id)
+    if batch is None:
+        return jsonify({"error": "Batch not found"}), 404
+    if batch.status != "done":
+        return jsonify({"error": f"Batch is {batch.status}"}), 409
+    return send_file(batch.zip_path, as_attachment=True, download_name="ITR_batch.zip", mimetype="application/zip")
+
+DOCUMENT_MAX_AGE = int(os.getenv("DOCUMENT_MAX_AGE", 365 * 24 * 3600))
+DOCUMENT_TOKEN_TTL = int(os.getenv("DOCUMENT_TOKEN_TTL", 300))
+
+def _document_signer():
+    return URLSafeTimedSerializer(current_app.config["JWT_SECRET_KEY"], salt="document-download")
+
+def _owns_document(user_id, filename):
+    return db.session.query(Document.id).filter_by(user_id=user_id, file_name=filename).first() is not None
+
+@app_bp.post("/documents/<filename>/token")
+@jwt_required()
+def document_download_token(filename):
+    """
+    A link to one stored bill that works without the Authorization header,
+    for <img> and window.open. It is signed for this file and user only and
+    expires after DOCUMENT_TOKEN_TTL seconds.
+    """
+    user_id = int(get_jwt_identity())
+    if not _owns_document(user_id, filename):
+        return jsonify({"error": "Document not found"}), 404
+    token = _document_signer().dumps({"file": filename, "user": user_id})
+    return jsonify({"url": f"/documents/{filename}?token={token}", "expires_in": DOCUMENT_TOKEN_TTL}), 200
+
+@app_bp.get("/documents/<filename>")
 def download_file(filename):
-    return send_from_directory("documents", filename, as_attachment=True)
+    """
+    A stored bill, for a user who has a Document for it. Stored files never
+    change under their name, so the content hash is a strong ETag and the
+    browser may keep them for DOCUMENT_MAX_AGE. send_file answers
+    If-None-Match with 304 and Range with 206, streaming from disk.
+    Authenticated by the Authorization header, or by a ?token= from
+    /documents/<filename>/token for this exact file.
+    """
+    verify_jwt_in_request(optional=True)
+    user_id = get_jwt_identity()
+    if user_id is None:
+        try:
+            grant = _document_signer().loads(request.args.get("token", ""), max_age=DOCUMENT_TOKEN_TTL)
+        except BadSignature:  # also SignatureExpired
+            return jsonify({"error": "Missing or expired document token"}), 401
+        if grant.get("file") != filename:
+            return jsonify({"error": "Token is for another document"}), 403
+        user_id = grant["user"]
+
+    file_path = safe_join(upload_folder(), filename)
+    if not _owns_document(int(user_id), filename) or file_path is None or not os.path.isfile(file_path):
+        return jsonify({"error": "Document not found"}), 404
+
+    response = send_file(file_path, as_attachment=True, etag=content_etag(file_path),
+                         max_age=DOCUMENT_MAX_AGE, conditional=True)
+    response.cache_control.public = False  # per-user content
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
 
 if __name__ == "__main__":
-    with app.app_context():
-        db.create_all()
-        # add base users here if i need to.
+    # development server with the reloader; serve.py is the production entry point
+    app = create_app()
+    init_db(app)
+    # add base users here if i need to.
 
     port = int(os.environ.get("PORT", 5000))
     app.run(host="0.0.0.0", port=port,debug=True)
\ No newline at end of file
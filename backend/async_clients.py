@@ -0,0 +1,320 @@
+# async_clients.py
+"""
+asyncio variants of the Perplexity and KnowYourGST clients, built on httpx.
+
+AsyncLLM.extract_bill_info / extract_bills_info and async_lookup_gstin_using_keys
+return exactly what their LLM and gst_check counterparts return, so a
+background worker can run many bill extractions on one event loop instead of
+one thread per call:
+
+    results = run(extract_many([(text, hints), ...]))
+
+- One httpx.AsyncClient per upstream service per event loop, each limited to
+  HTTP_POOL_SIZE connections; extra requests wait for a free connection.
+- Every call takes a `deadline` (seconds for the whole call, retries included)
+  on top of the per-request connect/read timeouts.
+- Cancelling a call closes its in-flight request. GST keys held by a cancelled
+  attempt go back to the shared KeyPool without being marked unhealthy.
+
+GST lookups here go straight to KnowYourGST; gst_cache needs an app context
+and a DB session, so cache lookups stay on the synchronous path.
+
+    python async_clients.py  # concurrent vs sequential extractions against a stub server
+"""
+import asyncio
+import os
+import time
+import weakref
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+import gst_check
+import receipt_rules
+from gst_check import KeyPool, KeyState, Lookup, classify_response, key_pool
+from http_client import HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_POOL_SIZE
+from llm import BATCH_SCHEMA, LLM
+from pipeline import hinted_text, gst_details
+
+ASYNC_EXTRACT_CONCURRENCY = int(os.getenv("ASYNC_EXTRACT_CONCURRENCY", 10))
+ASYNC_EXTRACT_DEADLINE = float(os.getenv("ASYNC_EXTRACT_DEADLINE", 60))
+
+# loop -> {name: httpx.AsyncClient}; weak, so a finished loop's entry goes with it and a
+# new loop can never pick up a dead loop's closed client
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, httpx.AsyncClient]]" = \
+    weakref.WeakKeyDictionary()
+
+
+def get_client(name):
+    """The AsyncClient for one upstream service on the running loop, created on first use."""
+    clients = _clients.setdefault(asyncio.get_running_loop(), {})
+    client = clients.get(name)
+    if client is None or client.is_closed:
+        client = clients[name] = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=HTTP_POOL_SIZE, max_keepalive_connections=HTTP_POOL_SIZE),
+            timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        )
+    return client
+
+
+async def aclose():
+    """Close the clients opened on the running loop."""
+    for client in _clients.pop(asyncio.get_running_loop(), {}).values():
+        await client.aclose()
+
+
+def run(coro):
+    """Run a coroutine on a fresh event loop from sync code (e.g. a worker thread) and close its clients."""
+    async def main():
+        try:
+            return await coro
+        finally:
+            await aclose()
+    return asyncio.run(main())
+
+
+def _timeout(read=None):
+    return httpx.Timeout(read if read is not None else HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+
+
+async def _with_deadline(coro, deadline):
+    if deadline is None:
+        return await coro
+    try:
+        return await asyncio.wait_for(coro, deadline)
+    except asyncio.TimeoutError:
+        raise TimeoutError(f"deadline of {deadline}s exceeded") from None
+
+
+class AsyncLLM(LLM):
+    """
+    LLM whose _call, extract_bill_info and extract_bills_info are coroutines;
+    prompts and normalisation are shared with LLM.
+    """
+
+    async def _call(self, prompt: str, **options):
+        resp = await get_client("llm").post(
+            self.endpoint, json=self._payload(prompt, **options), headers=self._headers(), timeout=_timeout()
+        )
+        resp.raise_for_status()
+        return self._content(resp.json())
+
+    async def extract_bill_info(self, bill_text: str, deadline: Optional[float] = None,
+                                usage: Optional[dict] = None) -> dict:
+        start = time.perf_counter()
+        raw, call_usage = await _with_deadline(self._call(self._bill_prompt(bill_text)), deadline)
+        return self._finish(raw, call_usage, start, usage)
+
+    async def extract_bills_info(self, bill_texts, deadline: Optional[float] = None,
+                                 usage: Optional[dict] = None) -> list:
+        start = time.perf_counter()
+        raw, call_usage = await _with_deadline(self._call(
+            self._bills_prompt(bill_texts), schema=BATCH_SCHEMA, max_tokens=self.max_tokens * len(bill_texts)
+        ), deadline)
+        return self._finish_bills(raw, call_usage, start, len(bill_texts), usage)
+
+
+async def query_gstin_with_key(key: str, gstin: str, timeout: int = 10) -> httpx.Response:
+    headers = {
+        "passthrough": key,
+        "User-Agent": "lumen-gstin-client/1.0"
+    }
+    return await get_client("gst").get(
+        gst_check.KNOWYOURGST_URL, headers=headers, params={"gstin": gstin}, timeout=_timeout(timeout)
+    )
+
+
+async def _attempt(pool: KeyPool, state: KeyState, gstin: str, timeout: int):
+    start = time.monotonic()
+    try:
+        resp = await query_gstin_with_key(state.key, gstin, timeout=timeout)
+        outcome, payload = classify_response(resp)
+    except httpx.TimeoutException:
+        outcome, payload = "timeout", "timeout"
+    except httpx.RequestError as e:
+        outcome, payload = "network", f"network error: {e}"
+    except asyncio.CancelledError:
+        # lost a hedge race or hit the deadline; says nothing about the key
+        pool.release(state, "cancelled")
+        raise
+    except Exception as e:
+        outcome, payload = "error", f"{type(e).__name__}: {e}"
+    pool.release(state, outcome, time.monotonic() - start)
+    return state, outcome, payload
+
+
+async def _race(pool: KeyPool, states: List[KeyState], gstin: str, timeout: int):
+    """Query several keys at once; the first success cancels the others."""
+    tasks = [asyncio.ensure_future(_attempt(pool, s, gstin, timeout)) for s in states]
+    results = []
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            result = await next_done
+            if result[1] == "ok":
+                return [result]
+            results.append(result)
+        return results
+    finally:
+        for t in tasks:
+            t.cancel()
+
+
+async def _lookup(api_keys, gstin, max_retries_per_key, initial_backoff, timeout, hedge):
+    pool = key_pool(api_keys, initial_backoff)
+    lookup = Lookup(pool, max_retries_per_key, hedge)
+    while True:
+        states, delay = lookup.next_keys()
+        if not states:
+            raise lookup.exhausted()
+        await asyncio.sleep(delay)
+        if len(states) == 1:
+            results = [await _attempt(pool, states[0], gstin, timeout)]
+        else:
+            results = await _race(pool, states, gstin, timeout)
+        found = lookup.record(results)
+        if found:
+            return found
+
+
+async def async_lookup_gstin_using_keys(
+    api_keys: List[str],
+    gstin: str,
+    max_retries_per_key: int = 2,
+    initial_backoff: float = 0.5,
+    timeout: int = 10,
+    hedge: Optional[bool] = None,
+    deadline: Optional[float] = None,
+) -> Dict[str, Any]:
+    """Coroutine version of gst_check.lookup_gstin_using_keys, sharing its KeyPool."""
+    return await _with_deadline(
+        _lookup(api_keys, gstin, max_retries_per_key, initial_backoff, timeout, hedge), deadline
+    )
+
+
+_llm_clients = {}
+
+
+def llm_client(index):
+    """One AsyncLLM per PERPLEX_API_<n> key."""
+    client = _llm_clients.get(index)
+    if client is None:
+        client = _llm_clients.setdefault(index, AsyncLLM(api_key=os.getenv(f"PERPLEX_API_{index+1}")))
+    return client
+
+
+async def _llm_extract(prompt_text: str, usage: dict) -> dict:
+    last_exception = None
+    for i in range(3):
+        try:
+            return await llm_client(i).extract_bill_info(prompt_text, usage=usage)
+        except (httpx.HTTPError, KeyError, ValueError) as e:
+            last_exception = e
+    raise RuntimeError(f"LLM extraction failed: {last_exception}")
+
+
+async def extract_bill(extracted_text: str, hints: Optional[dict] = None) -> Dict[str, Any]:
+    """
+    Rule-based or LLM extraction (trying up to 3 keys, like pipeline.run_llm)
+    then the GST lookup for one bill.
+    """
+    hints = hints or {}
+    usage = {}
+    llm_data = receipt_rules.confident_bill(extracted_text, hints, usage=usage)
+    if llm_data is None:
+        llm_data = await _llm_extract(hinted_text(extracted_text, hints), usage)
+
+    details = None
+    gstin = (llm_data.get("gst_number") or "").strip()
+    if gstin:
+        try:
+            details = gst_details(await async_lookup_gstin_using_keys(gst_check.api_keys, gstin))
+        except gst_check.AllKeysExhausted:
+            details = None
+    return {"llm": llm_data, "gst_details": details, "llm_usage": usage}
+
+
+async def extract_many(items, concurrency: int = ASYNC_EXTRACT_CONCURRENCY,
+                       deadline: Optional[float] = ASYNC_EXTRACT_DEADLINE) -> List[Dict[str, Any]]:
+    """
+    Run extract_bill for every (extracted_text, hints) pair, at most `concurrency`
+    at a time, each within `deadline` seconds. Returns one dict per item, in input
+    order: {"llm", "gst_details", "llm_usage", "seconds"} or {"error", "seconds"}.
+    Cancelling the caller cancels every extraction still running.
+    """
+    limit = asyncio.Semaphore(concurrency)
+
+    async def one(text, hints):
+        async with limit:
+            start = time.perf_counter()
+            try:
+                out = await _with_deadline(extract_bill(text, hints), deadline)
+            except Exception as e:
+                out = {"error": f"{type(e).__name__}: {e}"}
+            out["seconds"] = round(time.perf_counter() - start, 3)
+            return out
+
+    return await asyncio.gather(*(one(text, hints) for text, hints in items))
+
+
+if __name__ == "__main__":
+    import json
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    DELAY = 0.2  # simulated upstream latency per call
+
+    class Stub(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def _send(self, payload):
+            time.sleep(DELAY)
+            body = json.dumps(payload).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            try:
+                self.wfile.write(body)
+            except BrokenPipeError:
+                pass  # the client cancelled the call (deadline demo)
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            bill = {"item_name": "Tea", "amount": 120, "category": "food", "gst_number": "27AAPFU0939F1ZV"}
+            self._send({"choices": [{"message": {"content": json.dumps(bill)}}]})
+
+        def do_GET(self):
+            self._send({"lgnm": "Stub Traders", "sts": "Active"})
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Stub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}/"
+    gst_check.KNOWYOURGST_URL = base
+    gst_check.api_keys = ["stub-gst-key"]
+    for i in range(3):
+        llm_client(i).endpoint = base
+
+    bills = [(f"bill {n}", {}) for n in range(40)]
+
+    start = time.perf_counter()
+    run(extract_many(bills, concurrency=1))
+    sequential = time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = run(extract_many(bills))
+    concurrent = time.perf_counter() - start
+    errors = [r["error"] for r in results if "error" in r]
+
+    print(f"{len(bills)} bills, {DELAY * 1000:.0f} ms per upstream call (LLM + GST per bill)")
+    print(f"sequential       {sequential:.2f} s")
+    print(f"concurrency {ASYNC_EXTRACT_CONCURRENCY:<4} {concurrent:.2f} s ({sequential / concurrent:.1f}x)")
+    print(f"errors           {len(errors)} {errors[:1]}")
+
+    # A deadline shorter than one upstream call fails fast without stalling the batch
+    late = run(extract_many(bills[:5], deadline=DELAY / 2))
+    print(f"deadline {DELAY / 2:.2f} s   {sum('error' in r for r in late)}/5 timed out")
+    server.shutdown()
@@ -0,0 +1,71 @@
+# bill_text.py
+"""
+Trim raw Tesseract output to the lines the LLM needs before it is sent.
+
+A scanned receipt is often 5-10 KB of OCR text, most of it item rows, terms
+and noise. trim_ocr() keeps the vendor header, totals, dates, GSTINs and
+payment lines, then fills what is left of the token budget with the other
+lines, always in their original order.
+"""
+import os
+import re
+
+OCR_TOKEN_BUDGET = int(os.getenv("OCR_TOKEN_BUDGET", 600))
+HEADER_LINES = 5  # vendor name / address usually lead the receipt
+
+_GSTIN = re.compile(r"\b\d{2}[A-Z]{5}\d{4}[A-Z][A-Z\d]Z[A-Z\d]\b", re.I)
+_DATE = re.compile(
+    r"\b(\d{1,4}[-/.]\d{1,2}[-/.]\d{2,4}|\d{1,2}[-\s]*(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?[-\s,]*\d{2,4})\b",
+    re.I,
+)
+_KEYWORDS = re.compile(
+    r"total|amount|amt|net|grand|payable|paid|balance|subtotal|tax|gst|cgst|sgst|igst|"
+    r"invoice|bill|receipt|date|cash|card|upi|visa|master|rupay|wallet|netbanking|refund",
+    re.I,
+)
+_AMOUNT = re.compile(r"\d+[.,]\d{2}\b")
+
+
+def estimate_tokens(text):
+    """Rough token count for English/OCR text (~4 characters per token)."""
+    return (len(text) + 3) // 4
+
+
+def _clean(line):
+    line = re.sub(r"\s+", " ", line).strip()
+    # Tesseract noise: lines of mostly punctuation / box-drawing characters
+    if sum(ch.isalnum() for ch in line) < max(2, len(line) // 3):
+        return ""
+    return line
+
+
+def _score(index, line):
+    if _GSTIN.search(line):
+        return 4
+    if index < HEADER_LINES:
+        return 3
+    if _KEYWORDS.search(line) and (_AMOUNT.search(line) or _DATE.search(line)):
+        return 3
+    if _DATE.search(line) or _KEYWORDS.search(line):
+        return 2
+    if _AMOUNT.search(line):
+        return 1
+    return 0
+
+
+def trim_ocr(text, budget_tokens=OCR_TOKEN_BUDGET):
+    """Cleaned OCR text within `budget_tokens`, highest-value lines first, original order kept."""
+    lines = [l for l in (_clean(l) for l in (text or "").splitlines()) if l]
+    lines = [l for i, l in enumerate(lines) if i == 0 or l != lines[i - 1]]
+    if estimate_tokens("\n".join(lines)) <= budget_tokens:
+        return "\n".join(lines)
+
+    ranked = sorted(range(len(lines)), key=lambda i: (-_score(i, lines[i]), i))
+    keep, used = set(), 0
+    for i in ranked:
+        cost = estimate_tokens(lines[i]) + 1
+        if used + cost > budget_tokens:
+            continue
+        keep.add(i)
+        used += cost
+    return "\n".join(lines[i] for i in sorted(keep))
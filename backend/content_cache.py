@@ -0,0 +1,152 @@
+# content_cache.py
+"""
+Content-addressed cache of OCR text and normalised LLM output. Uploads are
+stored as documents/<sha256>.<ext>, so a re-uploaded receipt maps to the same
+entry and skips OCR. LLM output also depends on the uploader's hints, so it is
+stored under llm_key(): the same file with the same user and hints skips the
+paid LLM call too.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from model import db, ContentCache
+
+CACHE_TTL = timedelta(days=int(os.getenv("CONTENT_CACHE_TTL_DAYS", 30)))
+CACHE_MAX_ENTRIES = int(os.getenv("CONTENT_CACHE_MAX_ENTRIES", 5000))
+
+_SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+
+_stats = {"ocr_hits": 0, "ocr_misses": 0, "llm_hits": 0, "llm_misses": 0}
+_stats_lock = threading.Lock()
+
+
+def content_hash(file_name):
+    """The SHA-256 a stored file is named after, or None for legacy uuid names."""
+    stem = os.path.basename(file_name).rsplit(".", 1)[0]
+    return stem if _SHA256_RE.match(stem) else None
+
+
+def llm_key(digest, user_id, hints):
+    """
+    Cache key for LLM output: the file plus everything else that goes into the
+    prompt. None for files without a content hash.
+    """
+    if not digest:
+        return None
+    inputs = [digest, user_id] + [str(hints.get(k) or "") for k in ("vendor", "category", "notes")]
+    return hashlib.sha256(json.dumps(inputs).encode()).hexdigest()
+
+
+def _count(key):
+    with _stats_lock:
+        _stats[key] += 1
+
+
+def _entry(digest):
+    entry = db.session.get(ContentCache, digest)
+    if entry is None:
+        return None
+    if entry.created_at < datetime.utcnow() - CACHE_TTL:
+        db.session.delete(entry)
+        db.session.commit()
+        return None
+    return entry
+
+
+def _touch(entry):
+    entry.last_used_at = datetime.utcnow()
+    db.session.commit()
+
+
+def get_ocr(digest):
+    entry = _entry(digest) if digest else None
+    if entry is None or entry.ocr_text is None:
+        _count("ocr_misses")
+        return None
+    _count("ocr_hits")
+    _touch(entry)
+    return entry.ocr_text
+
+
+def get_llm(key):
+    """The cached LLM output for an llm_key(), or None."""
+    entry = _entry(key) if key else None
+    if entry is None or entry.llm_json is None:
+        _count("llm_misses")
+        return None
+    _count("llm_hits")
+    entry.llm_hits += 1
+    _touch(entry)
+    return json.loads(entry.llm_json)
+
+
+def has_llm(key):
+    """Whether get_llm would hit, without counting a hit or miss."""
+    entry = _entry(key) if key else None
+    return entry is not None and entry.llm_json is not None
+
+
+def _put(digest, **fields):
+    if not digest:
+        return
+    try:
+        entry = db.session.get(ContentCache, digest)
+        if entry is None:
+            entry = ContentCache(sha256=digest)
+            db.session.add(entry)
+        for k, v in fields.items():
+            setattr(entry, k, v)
+        # CACHE_TTL runs from the last write, so a re-stored entry gets its full lifetime
+        entry.created_at = entry.last_used_at = datetime.utcnow()
+        db.session.commit()
+    except IntegrityError:
+        # Another worker cached the same file first
+        db.session.rollback()
+        return
+    evict()
+
+
+def put_ocr(digest, text):
+    _put(digest, ocr_text=text)
+
+
+def put_llm(key, llm_data):
+    _put(key, llm_json=json.dumps(llm_data))
+
+
+def evict():
+    """Drop expired entries, then the least recently used ones above CACHE_MAX_ENTRIES."""
+    try:
+        ContentCache.query.filter(ContentCache.created_at < datetime.utcnow() - CACHE_TTL).delete()
+        overflow = ContentCache.query.count() - CACHE_MAX_ENTRIES
+        if overflow > 0:
+            oldest = (
+                db.session.query(ContentCache.sha256)
+                .order_by(ContentCache.last_used_at)
+                .limit(overflow)
+            )
+            ContentCache.query.filter(ContentCache.sha256.in_(oldest.scalar_subquery())).delete(
+                synchronize_session=False
+            )
+        db.session.commit()
+    except Exception:
+        current_app.logger.exception("Content cache eviction failed")
+        db.session.rollback()
+
+
+def stats():
+    with _stats_lock:
+        out = dict(_stats)
+    out["entries"] = ContentCache.query.count()
+    # every LLM hit is one paid extract_bill_info call that was not made;
+    # unlike the counters above this survives restarts (but not eviction)
+    out["llm_calls_saved"] = db.session.query(func.coalesce(func.sum(ContentCache.llm_hits), 0)).scalar()
+    return out
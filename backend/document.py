@@ -1,22 +1,35 @@
 # document_bp.py
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from model import db, Document, Transaction
+from model import db, Document, Job
+import json
 import os
-from llm import LLM
-from ocr import extract
-import uuid
-from gst_check import api_keys, lookup_gstin_using_keys
-from datetime import datetime
+import time
+import content_cache
+import jobs
+import receipt_rules
+from ocr import extract_many
+from pagination import InvalidCursor, keyset_page
+from llm_batch import LLM_BATCH_SIZE
+from pipeline import PipelineError, ocr_stop_when, prefetch_llm, prefetch_rules, process_document, save_upload
+
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", 200))
 
 document_bp = Blueprint("document", __name__, url_prefix="/document")
 
 
-def safe_float(v, default=0.0):
-    try:
-        return float(v)
-    except Exception:
-        return default
+def _serialize(d):
+    return {
+        "id": d.id,
+        "file_name": d.file_name,
+        "file_url": d.file_url,
+        "vendor_name": d.vendor_name,
+        "category": d.category,
+        "notes": d.notes,
+        "status": d.status,
+        "transaction_id": d.transaction_id,
+        "uploaded_at": d.uploaded_at.isoformat(),
+    }
 
 
 @document_bp.get("/")
@@ -28,23 +41,24 @@ def get_documents():
     page = int(request.args.get("page", 1))
     limit = int(request.args.get("limit", 20))
 
-    query = Document.query.filter_by(user_id=user_id).order_by(Document.uploaded_at.desc())
-    paginated = query.paginate(page=page, per_page=limit, error_out=False)
-
-    documents = [
-        {
-            "id": d.id,
-            "file_name": d.file_name,
-            "file_url": d.file_url,
-            "vendor_name": d.vendor_name,
-            "category": d.category,
-            "notes": d.notes,
-            "status": d.status,
-            "transaction_id": d.transaction_id,
-            "uploaded_at": d.uploaded_at.isoformat(),
-        }
-        for d in paginated.items
-    ]
+    query = Document.query.filter_by(user_id=user_id)
+
+    if "cursor" in request.args:
+        try:
+            items, next_cursor = keyset_page(
+                query, Document.uploaded_at, Document.id, True,
+                request.args.get("cursor"), limit,
+            )
+        except InvalidCursor as e:
+            return jsonify({"error": str(e)}), 400
+
+        payload = {"documents": [_serialize(d) for d in items], "next_cursor": next_cursor}
+        if request.args.get("include_total") in ("1", "true"):
+            payload["total"] = query.count()
+        return jsonify(payload), 200
+
+    paginated = query.order_by(Document.uploaded_at.desc()).paginate(page=page, per_page=limit, error_out=False)
+    documents = [_serialize(d) for d in paginated.items]
 
     return jsonify({
         "documents": documents,
@@ -66,171 +80,204 @@ def add_document():
     if "file" not in request.files:
         return jsonify({"error": "File is required"}), 400
 
-    file = request.files["file"]
-    if file.filename == "":
-        return jsonify({"error": "Invalid file name"}), 400
+    try:
+        new_filename, file_path = save_upload(request.files["file"])
+        payload = process_document(user_id, new_filename, file_path, _hints())
+    except PipelineError as e:
+        return jsonify(e.to_dict()), e.status
 
-    allowed_ext = {"pdf", "png", "jpg", "jpeg", "webp"}
-    ext = file.filename.rsplit(".", 1)[-1].lower()
-    if ext not in allowed_ext:
-        return jsonify({"error": "Unsupported file format"}), 400
+    return jsonify(payload), 201
 
-    # Save file
-    upload_folder = os.path.join(os.getcwd(), "documents")
-    os.makedirs(upload_folder, exist_ok=True)
-    new_filename = f"{uuid.uuid4()}.{ext}"
-    file_path = os.path.join(upload_folder, new_filename)
-    try:
-        file.save(file_path)
-    except Exception as e:
-        current_app.logger.exception("Failed to save uploaded file")
-        return jsonify({"error": "Failed to save file", "details": str(e)}), 500
 
-    # OCR
-    try:
-        extracted_text = extract(file_path)
-    except Exception as e:
-        current_app.logger.exception("OCR failed")
-        return jsonify({"error": "OCR failed", "details": str(e)}), 500
-
-    # user hints
-    user_vendor = request.form.get("vendor", "") or ""
-    user_category = request.form.get("category", "") or ""
-    user_notes = request.form.get("notes", "") or ""
-
-    combined_prompt_text = (
-        f"USER HINTS:\n"
-        f"- Vendor: {user_vendor}\n"
-        f"- Category: {user_category}\n"
-        f"- Notes: {user_notes}\n\n"
-        f"EXTRACTED BILL TEXT:\n{extracted_text}"
-    )
-
-    # Try several API keys (if configured) to extract using LLM
-    llm_data = None
-    last_exception = None
-    for i in range(3):
-        try:
-            key_env = os.getenv(f"PERPLEX_API_{i+1}")
-            llm = LLM(api_key=key_env)
-            llm_data = llm.extract_bill_info(combined_prompt_text)
-            print(llm_data)
-            break
-        except Exception as e:
-            last_exception = e
-            current_app.logger.exception(f"LLM call failed for key index {i}")
-            continue
-
-    if llm_data is None:
-        return jsonify({"error": "LLM extraction failed", "details": str(last_exception)}), 500
-
-    # Normalize LLM output with safe defaults
-    item_name = llm_data.get("item_name", "") or "Unknown Item"
-    amount = safe_float(-llm_data.get("amount", 0))
-    category = (llm_data.get("category") or user_category or "Uncategorized")
-    payment_mode = llm_data.get("payment_mode", "") or "Unknown"
-    tx_date_raw = llm_data.get("transaction_date", "")
-    vendor = llm_data.get("vendor") or user_vendor or ""
-    description = llm_data.get("description", "") or ""
-    tags = llm_data.get("tags", "") or ""
-    legitimacy = llm_data.get("legitimacy", "verified")
-    legitimacy_report = llm_data.get("legitimacy_report", "")
-
-    # parse date; fallback to today
-    try:
-        tx_date = datetime.strptime(tx_date_raw, "%Y-%m-%d").date()
-    except Exception:
-        try:
-            # try common alternate formats
-            tx_date = datetime.strptime(tx_date_raw, "%d-%m-%Y").date()
-        except Exception:
-            tx_date = datetime.utcnow().date()
-
-    # GST lookup
-    gst_details = None
-    gstin = (llm_data.get("gst_number") or "").strip()
-    if gstin:
+@document_bp.post("/add_batch")
+@jwt_required()
+def add_documents_batch():
+    """
+    Multi-file /document/add. OCR runs in the process pool across all cores
+    and each file's result is streamed back as one JSON line. Files with
+    cached or receipt_rules output go out as soon as they are OCR'd; every
+    LLM_BATCH_SIZE files that need the LLM share one call and go out with it.
+    """
+    user_id = int(get_jwt_identity())
+
+    files = request.files.getlist("files")
+    if not files:
+        return jsonify({"error": "At least one file is required"}), 400
+    if len(files) > BATCH_MAX_FILES:
+        return jsonify({"error": f"At most {BATCH_MAX_FILES} files per batch"}), 400
+
+    hints = _hints()
+    rejected = []
+    saved = {}  # file_path -> [(index, original name)], identical files are OCR'd once
+    for index, file in enumerate(files):
         try:
-            gst_response = lookup_gstin_using_keys(api_keys, gstin)
-            result_data = gst_response.get("result") or {}
-            # map known fields (adjust keys depending on gst_check response shape)
-            pradr = result_data.get("pradr", {}) or {}
-            addr = (pradr.get("addr") or {}) if isinstance(pradr, dict) else {}
-            gst_details = {
-                "legal_name": result_data.get("lgnm", "") or "",
-                "trade_name": result_data.get("tradeNam", "") or "",
-                "status": result_data.get("sts", "") or "",
-                "address": addr.get("bnm", "") or addr.get("addr1", "") or "",
-                "state": result_data.get("stj", "") or "",
-                "district": result_data.get("dst", "") or "",
-                "pincode": addr.get("pncd", "") or "",
-                "constitution": result_data.get("ctb", "") or "",
-                "pan": result_data.get("pan", "") or "",
-                "registration_date": result_data.get("rgdt", "") or "",
-                "last_updated": result_data.get("lstupdt", "") or "",
-                "raw": result_data
-            }
-        except Exception:
-            current_app.logger.exception("GST lookup failed")
-            gst_details = None
-
-    # create transaction & document in DB
-    try:
-        new_tx = Transaction(
-            user_id=user_id,
-            item_name=item_name,
-            amount=amount,
-            category=category,
-            payment_mode=payment_mode,
-            transaction_date=tx_date,
-            vendor=vendor,
-            description=description,
-            tags=tags
-        )
-        db.session.add(new_tx)
-        db.session.flush()  # get new_tx.id
+            _, file_path = save_upload(file)
+            saved.setdefault(file_path, []).append((index, file.filename))
+        except PipelineError as e:
+            rejected.append({"index": index, "file_name": file.filename, **e.to_dict()})
+
+    def process(file_path, text=None, ocr_seconds=None, error=None, prefetched=None):
+        for index, original_name in saved[file_path]:
+            line = {"index": index, "file_name": original_name}
+            if error is not None:
+                current_app.logger.error(f"OCR failed for {original_name}: {error}")
+                line.update({"error": "OCR failed", "details": str(error)})
+            else:
+                timings = {"ocr": round(ocr_seconds, 3)} if ocr_seconds is not None else {}
+                try:
+                    line.update(process_document(
+                        user_id, os.path.basename(file_path), file_path, hints,
+                        timings=timings, extracted_text=text, prefetched=prefetched,
+                    ))
+                except PipelineError as e:
+                    line.update(e.to_dict())
+                line["timings"] = timings
+            yield line
+
+    def ocr_results():
+        # Files seen before skip the pool entirely
+        to_ocr = []
+        for file_path in saved:
+            text = content_cache.get_ocr(content_cache.content_hash(file_path))
+            if text is None:
+                to_ocr.append(file_path)
+                continue
+            yield file_path, text, None, None
+
+        for file_path, text, ocr_seconds, error in extract_many(to_ocr, stop_when=ocr_stop_when()):
+            if error is None:
+                content_cache.put_ocr(content_cache.content_hash(file_path), text)
+            yield file_path, text, ocr_seconds, error
+
+    def process_group(group):
+        prefetched = prefetch_llm([(os.path.basename(file_path), text, usage)
+                                   for file_path, text, _, (_, usage) in group], hints)
+        for file_path, text, ocr_seconds, _ in group:
+            yield from process(file_path, text, ocr_seconds, None, prefetched[os.path.basename(file_path)])
+
+    def results():
+        group = []  # OCR'd files waiting to share an LLM call
+        for file_path, text, ocr_seconds, error in ocr_results():
+            prefetched = None if error is not None else prefetch_rules(
+                user_id, os.path.basename(file_path), text, hints
+            )
+            if prefetched is None or prefetched[0] is not None:
+                # OCR failed, cached or read by receipt_rules: nothing to wait for
+                yield from process(file_path, text, ocr_seconds, error, prefetched)
+                continue
+            group.append((file_path, text, ocr_seconds, prefetched))
+            if len(group) >= LLM_BATCH_SIZE:
+                yield from process_group(group)
+                group = []
+        yield from process_group(group)
+
+    def generate():
+        start = time.perf_counter()
+        failed = len(rejected)
+        for line in rejected:
+            yield json.dumps(line) + "\n"
+
+        for line in results():
+            failed += "error" in line
+            yield json.dumps(line) + "\n"
+
+        yield json.dumps({
+            "done": True,
+            "total": len(files),
+            "failed": failed,
+            "elapsed": round(time.perf_counter() - start, 3),
+        }) + "\n"
 
-        status = "verified" if str(legitimacy).lower() == "verified" else "rejected"
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
 
+
+@document_bp.post("/upload")
+@jwt_required()
+def upload_document():
+    """
+    Store the file and a pending Document, then hand OCR/LLM/GST to the job
+    workers. Poll /document/jobs/<job_id> for the /document/add payload.
+    """
+    user_id = int(get_jwt_identity())
+
+    if "file" not in request.files:
+        return jsonify({"error": "File is required"}), 400
+
+    try:
+        new_filename, _ = save_upload(request.files["file"])
+    except PipelineError as e:
+        return jsonify(e.to_dict()), e.status
+
+    hints = _hints()
+    try:
         doc = Document(
             user_id=user_id,
-            transaction_id=new_tx.id,
             file_name=new_filename,
             file_url=f"/documents/{new_filename}",
-            vendor_name=vendor,
-            category=category,
-            notes=user_notes,
-            status=status
+            vendor_name=hints["vendor"],
+            category=hints["category"],
+            notes=hints["notes"],
+            status="pending"
         )
-
         db.session.add(doc)
+        db.session.flush()
+        job = jobs.enqueue(user_id, doc, hints)
         db.session.commit()
-
-        response_payload = {
-            "message": "Document processed successfully",
-            "transaction_id": new_tx.id,
-            "document_id": doc.id,
-            "status": status,
-            "llm": {
-                "item_name": item_name,
-                "amount": amount,
-                "category": category,
-                "payment_mode": payment_mode,
-                "transaction_date": tx_date.isoformat(),
-                "vendor": vendor,
-                "description": description,
-                "tags": tags,
-                "legitimacy": legitimacy,
-                "legitimacy_report": legitimacy_report,
-                "gst_number": gstin,
-            },
-            "gst_details": gst_details,
-            "file_url": doc.file_url
-        }
-
-        return jsonify(response_payload), 201
-
     except Exception as e:
-        current_app.logger.exception("Failed to create DB records")
+        current_app.logger.exception("Failed to queue document")
         db.session.rollback()
-        return jsonify({"error": "Failed to persist records", "details": str(e)}), 500
+        return jsonify({"error": "Failed to queue document", "details": str(e)}), 500
+
+    jobs.notify()
+    return jsonify({
+        "message": "Document queued",
+        "job_id": job.id,
+        "document_id": doc.id,
+        "status": job.status,
+        "status_url": f"/document/jobs/{job.id}",
+        "file_url": doc.file_url
+    }), 202
+
+
+@document_bp.get("/jobs/<job_id>")
+@jwt_required()
+def get_job(job_id):
+    user_id = int(get_jwt_identity())
+
+    job = Job.query.filter_by(id=job_id, user_id=user_id).first()
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+
+    timings = json.loads(job.timings) if job.timings else {}
+    if job.started_at:
+        timings["queued"] = round((job.started_at - job.created_at).total_seconds(), 3)
+
+    return jsonify({
+        "job_id": job.id,
+        "document_id": job.document_id,
+        "status": job.status,
+        "stage": job.stage,
+        "attempts": job.attempts,
+        "timings": timings,
+        "result": json.loads(job.result) if job.result else None,
+        "error": json.loads(job.error) if job.error else None,
+        "created_at": job.created_at.isoformat(),
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }), 200
+
+
+@document_bp.get("/cache/stats")
+@jwt_required()
+def cache_stats():
+    stats = content_cache.stats()
+    stats["rules"] = receipt_rules.stats()
+    return jsonify(stats), 200
+
+
+def _hints():
+    return {
+        "vendor": request.form.get("vendor", "") or "",
+        "category": request.form.get("category", "") or "",
+        "notes": request.form.get("notes", "") or "",
+    }
@@ -0,0 +1,127 @@
+# gst_cache.py
+"""
+Persistent GSTIN lookup cache in front of gst_check.lookup_gstin_using_keys.
+
+Registration data rarely changes and the same vendors recur across receipts,
+so answers are kept for GST_CACHE_TTL_DAYS. GSTINs KnowYourGST rejects are
+cached too, for the shorter GST_NEGATIVE_TTL_HOURS. Concurrent lookups of the
+same GSTIN in this process share one upstream call (single-flight).
+"""
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from gst_check import api_keys, lookup_gstin_using_keys, InvalidGSTIN
+from model import db, GstinCache
+
+GST_CACHE_TTL = timedelta(days=int(os.getenv("GST_CACHE_TTL_DAYS", 30)))
+GST_NEGATIVE_TTL = timedelta(hours=int(os.getenv("GST_NEGATIVE_TTL_HOURS", 24)))
+
+_stats = {"hits": 0, "negative_hits": 0, "misses": 0, "collapsed": 0, "store_errors": 0}
+_lock = threading.Lock()
+_inflight = {}  # gstin -> _Flight
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _count(key):
+    with _lock:
+        _stats[key] += 1
+
+
+def _cached(gstin):
+    entry = db.session.get(GstinCache, gstin)
+    if entry is None or entry.expires_at < datetime.utcnow():
+        return None
+    return entry
+
+
+def _store(gstin, valid, result=None):
+    """Cache an upstream answer. Never raises: a failed write only costs a later upstream call."""
+    ttl = GST_CACHE_TTL if valid else GST_NEGATIVE_TTL
+    now = datetime.utcnow()
+    try:
+        entry = db.session.get(GstinCache, gstin) or GstinCache(gstin=gstin)
+        entry.valid = valid
+        entry.result = json.dumps(result) if result is not None else None
+        entry.fetched_at = now
+        entry.expires_at = now + ttl
+        db.session.add(entry)
+        db.session.commit()
+    except IntegrityError:
+        # Another process stored it first
+        db.session.rollback()
+    except Exception:
+        db.session.rollback()
+        _count("store_errors")
+        current_app.logger.exception(f"Failed to cache the GSTIN lookup for {gstin}")
+
+
+def _from_entry(entry):
+    if not entry.valid:
+        raise InvalidGSTIN(f"{entry.gstin} was rejected by KnowYourGST (cached)")
+    return {"used_key_index": None, "used_key_label": "cache", "result": json.loads(entry.result)}
+
+
+def lookup(gstin):
+    """
+    Same contract as lookup_gstin_using_keys(api_keys, gstin): returns
+    {"used_key_index", "used_key_label", "result"} or raises AllKeysExhausted
+    (InvalidGSTIN for unknown GSTINs). Cached answers use key label "cache".
+    """
+    gstin = gstin.strip().upper()
+
+    entry = _cached(gstin)
+    if entry is not None:
+        _count("hits" if entry.valid else "negative_hits")
+        return _from_entry(entry)
+
+    with _lock:
+        flight = _inflight.get(gstin)
+        leader = flight is None
+        if leader:
+            flight = _inflight[gstin] = _Flight()
+
+    if not leader:
+        _count("collapsed")
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    _count("misses")
+    try:
+        flight.result = lookup_gstin_using_keys(api_keys, gstin)
+        _store(gstin, True, flight.result.get("result"))  # never raises, so waiters still get the result
+        return flight.result
+    except InvalidGSTIN as e:
+        flight.error = e
+        _store(gstin, False)
+        raise
+    except Exception as e:
+        # Key/network failures are not cached; the next lookup retries upstream
+        flight.error = e
+        raise
+    finally:
+        with _lock:
+            _inflight.pop(gstin, None)
+        flight.done.set()
+
+
+def stats():
+    with _lock:
+        out = dict(_stats)
+    served = out["hits"] + out["negative_hits"] + out["misses"] + out["collapsed"]
+    out["saved_calls"] = out["hits"] + out["negative_hits"] + out["collapsed"]
+    out["hit_ratio"] = round(out["saved_calls"] / served, 3) if served else None
+    out["entries"] = GstinCache.query.count()
+    return out
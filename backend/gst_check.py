@@ -1,24 +1,298 @@
-import requests
+import threading
 import time
-from typing import List, Dict, Any, Optional
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Any, Optional, Set, Tuple
 import os
-from dotenv import load_dotenv
+import re
+import lazy
+from http_client import get_session, timeout as http_timeout
 
-load_dotenv()
+requests = lazy.module("requests")
 
+# .env is loaded by app.py before any backend module is imported
 api_keys = [os.getenv('API_1'),os.getenv('API_2'),os.getenv('API_3'),os.getenv('API_4'),os.getenv('API_5'),os.getenv('API_6'),os.getenv('API_7'),os.getenv('API_8'),os.getenv('API_9'),os.getenv('API_10')]
-KNOWYOURGST_URL = "https://www.knowyourgst.com/developers/gstincall/"
+KNOWYOURGST_URL = os.getenv("KNOWYOURGST_URL", "https://www.knowyourgst.com/developers/gstincall/")
 
 class AllKeysExhausted(Exception):
+    def __init__(self, message: str = "", retry_after: Optional[float] = None):
+        super().__init__(message)
+        # Seconds until a cooling-down key may be tried again, when that is all that is left
+        self.retry_after = retry_after
+
+class InvalidGSTIN(AllKeysExhausted):
+    """Every key tried got a 400/404/empty answer: the GSTIN itself is unknown, not the keys."""
     pass
 
-def query_gstin_with_key(key: str, gstin: str, timeout: int = 10) -> requests.Response:
+GSTIN_RE = re.compile(r"^[0-9]{2}[A-Z]{5}[0-9]{4}[A-Z][1-9A-Z]Z[0-9A-Z]$")
+GSTIN_CHARSET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+def gstin_checksum(first14: str) -> str:
+    total = 0
+    for i, ch in enumerate(first14):
+        product = GSTIN_CHARSET.index(ch) * (2 if i % 2 else 1)
+        total += product // 36 + product % 36
+    return GSTIN_CHARSET[(36 - total % 36) % 36]
+
+def validate_gstin(gstin: str) -> Optional[str]:
+    """Local format + check-digit validation. Returns an error message, or None if well-formed."""
+    if not GSTIN_RE.match(gstin):
+        return "Malformed GSTIN"
+    if gstin_checksum(gstin[:14]) != gstin[14]:
+        return "GSTIN checksum mismatch"
+    return None
+
+def query_gstin_with_key(key: str, gstin: str, timeout: int = 10) -> "requests.Response":
     headers = {
         "passthrough": key,
         "User-Agent": "lumen-gstin-client/1.0"
     }
     params = {"gstin": gstin}
-    return requests.get(KNOWYOURGST_URL, headers=headers, params=params, timeout=timeout)
+    return get_session("gst").get(KNOWYOURGST_URL, headers=headers, params=params, timeout=http_timeout(timeout))
+
+# Key pool tuning: a key that answers 429 / 401-403 sits out for a while instead
+# of being retried (and slept on) by every lookup. Transient failures (5xx,
+# timeouts, network errors) are counted, and only GST_FAILURE_THRESHOLD of them
+# in a row put a key on an exponential cooldown. Hedging races two keys once
+# p95 latency gets high.
+RATE_LIMIT_COOLDOWN = float(os.getenv("GST_RATE_LIMIT_COOLDOWN", 60))
+FORBIDDEN_COOLDOWN = float(os.getenv("GST_FORBIDDEN_COOLDOWN", 900))
+FAILURE_THRESHOLD = int(os.getenv("GST_FAILURE_THRESHOLD", 3))
+MAX_BACKOFF = float(os.getenv("GST_MAX_BACKOFF", 30))
+RETRY_WAIT = float(os.getenv("GST_RETRY_WAIT", 2))  # longest backoff before re-trying a key within one lookup
+HEDGE = os.getenv("GST_HEDGE", "0") == "1"
+HEDGE_P95 = float(os.getenv("GST_HEDGE_P95", 2.0))
+
+# Outcomes after which a key is not tried again within the same lookup
+_KEY_DONE = {"rejected", "rate_limited", "forbidden", "unexpected", "error"}
+
+
+class KeyState:
+    def __init__(self, index: int, key: str):
+        self.index = index
+        self.key = key
+        self.label = f"key[{index}]"
+        self.inflight = 0
+        self.failures = 0
+        self.cooldown_until = 0.0
+        self.cooldown_reason = None
+        self.last_failure = 0.0
+        self.calls = 0
+        self.latencies = deque(maxlen=100)
+
+
+class KeyPool:
+    """Per-key health shared by every lookup in the process."""
+
+    def __init__(self, api_keys: List[str], initial_backoff: float = 0.5):
+        self.keys = [KeyState(i, k) for i, k in enumerate(api_keys) if k]
+        self.initial_backoff = initial_backoff
+        self._lock = threading.Lock()
+
+    def acquire(self, count: int = 1, exclude: Set[int] = frozenset()) -> List[KeyState]:
+        """Reserve up to `count` healthy keys, least loaded (then fastest) first."""
+        now = time.monotonic()
+        with self._lock:
+            healthy = [k for k in self.keys if k.cooldown_until <= now and k.index not in exclude]
+            healthy.sort(key=lambda k: (k.inflight, k.failures, _mean(k.latencies)))
+            chosen = healthy[:count]
+            for k in chosen:
+                k.inflight += 1
+                k.calls += 1
+            return chosen
+
+    def release(self, state: KeyState, outcome: str, latency: Optional[float] = None) -> None:
+        with self._lock:
+            state.inflight -= 1
+            if outcome == "cancelled":
+                # Abandoned by the caller (lost a hedge race, deadline hit); says nothing about the key
+                return
+            if latency is not None:
+                state.latencies.append(latency)
+            now = time.monotonic()
+            if outcome in ("ok", "rejected"):
+                state.failures = 0
+                state.cooldown_reason = None
+            elif outcome == "rate_limited":
+                state.cooldown_until = now + RATE_LIMIT_COOLDOWN
+                state.cooldown_reason = outcome
+            elif outcome == "forbidden":
+                state.cooldown_until = now + FORBIDDEN_COOLDOWN
+                state.cooldown_reason = outcome
+            else:
+                state.failures += 1
+                state.last_failure = now
+                if state.failures >= FAILURE_THRESHOLD:
+                    backoff = self.initial_backoff * 2 ** (state.failures - FAILURE_THRESHOLD)
+                    state.cooldown_until = now + min(backoff, MAX_BACKOFF)
+                    state.cooldown_reason = "failing"
+
+    def acquire_retry(self, exclude: Set[int] = frozenset()) -> Optional[KeyState]:
+        """
+        Reserve the key whose last transient failure is oldest, even if it is
+        still cooling down; the last resort before a lookup gives up. Keys
+        benched for 429 / 401-403 are never picked.
+        """
+        with self._lock:
+            failing = [k for k in self.keys if k.index not in exclude and k.cooldown_reason == "failing"]
+            if not failing:
+                return None
+            state = min(failing, key=lambda k: k.last_failure)
+            state.inflight += 1
+            state.calls += 1
+            return state
+
+    def retry_delay(self, state: KeyState, attempt: int) -> float:
+        """Seconds to wait before the `attempt`-th try of `state` in one lookup (0 for a healthy key's first)."""
+        delay = min(self.initial_backoff * 2 ** max(attempt - 2, 0), RETRY_WAIT)
+        return min(delay, max(state.cooldown_until - time.monotonic(), 0.0)) if attempt == 1 else delay
+
+    def p95(self) -> float:
+        with self._lock:
+            samples = sorted(x for k in self.keys for x in k.latencies)
+        return samples[int(len(samples) * 0.95)] if samples else 0.0
+
+    def stats(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    "key": k.label,
+                    "healthy": k.cooldown_until <= now,
+                    "cooldown_seconds": round(max(0.0, k.cooldown_until - now), 1),
+                    "inflight": k.inflight,
+                    "failures": k.failures,
+                    "calls": k.calls,
+                    "mean_latency": round(_mean(k.latencies), 3),
+                }
+                for k in self.keys
+            ]
+
+
+def _mean(values) -> float:
+    return sum(values) / len(values) if values else 0.0
+
+
+_pools: Dict[tuple, KeyPool] = {}
+_pools_lock = threading.Lock()
+_hedge_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="gst-hedge")
+
+
+def key_pool(api_keys: List[str], initial_backoff: float = 0.5) -> KeyPool:
+    with _pools_lock:
+        pool = _pools.get(tuple(api_keys))
+        if pool is None:
+            pool = _pools[tuple(api_keys)] = KeyPool(api_keys, initial_backoff)
+        return pool
+
+
+def classify_response(resp) -> Tuple[str, Any]:
+    """Map a KnowYourGST response to (outcome, payload or error text)."""
+    status = resp.status_code
+    if status == 429:
+        return "rate_limited", "429 rate limited"
+    if status in (401, 403):
+        return "forbidden", f"{status} unauthorized/forbidden"
+    if 500 <= status < 600:
+        return "server_error", f"server error {status}"
+    if status in (400, 404):
+        return "rejected", f"{status} response: {resp.text.strip()[:200]}"
+    if status == 200:
+        try:
+            data = resp.json()
+        except ValueError:
+            return "bad_json", "invalid JSON in response"
+        if not data:
+            return "rejected", "empty JSON response"
+        return "ok", data
+    return "unexpected", f"unexpected status {status}"
+
+
+def _attempt(pool: KeyPool, state: KeyState, gstin: str, timeout: int) -> Tuple[KeyState, str, Any]:
+    start = time.monotonic()
+    try:
+        resp = query_gstin_with_key(state.key, gstin, timeout=timeout)
+        outcome, payload = classify_response(resp)
+    except requests.Timeout:
+        outcome, payload = "timeout", "timeout"
+    except requests.RequestException as e:
+        outcome, payload = "network", f"network error: {e}"
+    pool.release(state, outcome, time.monotonic() - start)
+    return state, outcome, payload
+
+
+def _race(pool: KeyPool, states: List[KeyState], gstin: str, timeout: int) -> List[Tuple[KeyState, str, Any]]:
+    """Query several keys at once; stop at the first success. Losers release their key when they finish."""
+    futures = [_hedge_executor.submit(_attempt, pool, s, gstin, timeout) for s in states]
+    results = []
+    for fut in as_completed(futures):
+        result = fut.result()
+        if result[1] == "ok":
+            return [result]
+        results.append(result)
+    return results
+
+
+class Lookup:
+    """
+    Key choice, retry backoff and error bookkeeping for one lookup. Shared by
+    lookup_gstin_using_keys and async_clients, which only run the attempts and
+    decide what to do about a backoff: the coroutine awaits it, the threaded
+    version hands the keys back and raises with retry_after instead of
+    blocking a request thread.
+
+        lookup = Lookup(pool, max_retries_per_key, hedge)
+        while True:
+            states, delay = lookup.next_keys()
+            if not states:
+                raise lookup.exhausted()
+            await asyncio.sleep(delay)  # or: raise lookup.give_up(states, delay)
+            found = lookup.record(<(state, outcome, payload) for the attempts on states>)
+            if found:
+                return found
+    """
+
+    def __init__(self, pool: KeyPool, max_retries_per_key: int = 2, hedge: Optional[bool] = None):
+        self.pool = pool
+        self.max_retries_per_key = max_retries_per_key
+        self.hedge = HEDGE if hedge is None else hedge
+        self.errors = []
+        self.tries: Dict[int, int] = {}
+        self.done: Set[int] = set()
+        self.rejected: Set[int] = set()
+
+    def next_keys(self) -> Tuple[List[KeyState], float]:
+        """The reserved keys to try next (none once every key is used up) and the seconds to wait first."""
+        pool = self.pool
+        exclude = self.done | {i for i, n in self.tries.items() if n >= self.max_retries_per_key}
+        racers = 2 if self.hedge and pool.p95() >= HEDGE_P95 else 1
+        states = pool.acquire(racers, exclude) or [s for s in [pool.acquire_retry(exclude)] if s]
+        for s in states:
+            self.tries[s.index] = self.tries.get(s.index, 0) + 1
+        return states, max((pool.retry_delay(s, self.tries[s.index]) for s in states), default=0.0)
+
+    def record(self, results: List[Tuple[KeyState, str, Any]]) -> Optional[Dict[str, Any]]:
+        """The lookup's return value if an attempt succeeded, else None after noting the failures."""
+        for state, outcome, payload in results:
+            if outcome == "ok":
+                return {"used_key_index": state.index, "used_key_label": state.label, "result": payload}
+            self.errors.append((state.label, f"attempt {self.tries[state.index]}: {payload}"))
+            if outcome in _KEY_DONE:
+                self.done.add(state.index)
+            if outcome == "rejected":
+                self.rejected.add(state.index)
+        return None
+
+    def exhausted(self, retry_after: Optional[float] = None) -> AllKeysExhausted:
+        return exhausted(self.pool, self.errors, self.tries, self.rejected, retry_after)
+
+    def give_up(self, states: List[KeyState], delay: float) -> AllKeysExhausted:
+        """Return keys next_keys reserved, unused, and the error to raise instead of waiting `delay`."""
+        for s in states:
+            self.tries[s.index] -= 1
+            self.pool.release(s, "cancelled")
+        return self.exhausted(retry_after=delay)
+
 
 def lookup_gstin_using_keys(
     api_keys: List[str],
@@ -26,73 +300,142 @@ def lookup_gstin_using_keys(
     max_retries_per_key: int = 2,
     initial_backoff: float = 0.5,
     timeout: int = 10,
+    hedge: Optional[bool] = None,
 ) -> Dict[str, Any]:
-    errors = []
-    for idx, key in enumerate(api_keys):
-        key_label = f"key[{idx}]"
-        backoff = initial_backoff
-        saturated = False
-
-        for attempt in range(1, max_retries_per_key + 1):
-            try:
-                resp = query_gstin_with_key(key, gstin, timeout=timeout)
-            except requests.Timeout:
-                errors.append((key_label, f"attempt {attempt}: timeout"))
-                time.sleep(backoff)
-                backoff *= 2
-                continue
-            except requests.RequestException as e:
-                errors.append((key_label, f"attempt {attempt}: network error: {e}"))
-                time.sleep(backoff)
-                backoff *= 2
-                continue
-
-            status = resp.status_code
-            if status == 429:
-                errors.append((key_label, f"attempt {attempt}: 429 rate limited"))
-                saturated = True
-                break
-            if status in (401, 403):
-                errors.append((key_label, f"attempt {attempt}: {status} unauthorized/forbidden"))
-                saturated = True
-                break
-            if 500 <= status < 600:
-                errors.append((key_label, f"attempt {attempt}: server error {status}"))
-                time.sleep(backoff)
-                backoff *= 2
-                continue
-            if status in (400, 404):
-                body = resp.text.strip()
-                errors.append((key_label, f"attempt {attempt}: {status} response: {body[:200]}"))
-                saturated = True
-                break
-            if status == 200:
-                try:
-                    data = resp.json()
-                except ValueError:
-                    errors.append((key_label, f"attempt {attempt}: invalid JSON in response"))
-                    time.sleep(backoff)
-                    backoff *= 2
-                    continue
-                if not data:
-                    errors.append((key_label, f"attempt {attempt}: empty JSON response"))
-                    saturated = True
-                    break
-                return {"used_key_index": idx, "used_key_label": key_label, "result": data}
-            errors.append((key_label, f"attempt {attempt}: unexpected status {status}"))
-            saturated = True
-            break
-
-        if saturated:
-            continue
+    pool = key_pool(api_keys, initial_backoff)
+    lookup = Lookup(pool, max_retries_per_key, hedge)
+    while True:
+        states, delay = lookup.next_keys()
+        if not states:
+            raise lookup.exhausted()
+        if delay > 0:
+            # only backoffs are left; never sleep on a request thread
+            raise lookup.give_up(states, delay)
+        if len(states) == 1:
+            results = [_attempt(pool, states[0], gstin, timeout)]
+        else:
+            results = _race(pool, states, gstin, timeout)
+        found = lookup.record(results)
+        if found:
+            return found
 
+
+def exhausted(pool: KeyPool, errors, tries: Dict[int, int], rejected: Set[int],
+              retry_after: Optional[float] = None) -> AllKeysExhausted:
+    """The error raised once no key is left to try (InvalidGSTIN if every key rejected the GSTIN)."""
     msg_lines = ["All API keys exhausted or failed. Summary:"]
     for k, v in errors:
         msg_lines.append(f"{k}: {v}")
-    raise AllKeysExhausted("\n".join(msg_lines))
+    if not pool.keys:
+        msg_lines.append("no API keys configured")
+    if retry_after is not None:
+        msg_lines.append(f"a key may be retried in {retry_after:.2f}s")
+    if rejected and rejected == {i for i, n in tries.items() if n}:
+        return InvalidGSTIN("\n".join(msg_lines))
+    return AllKeysExhausted("\n".join(msg_lines), retry_after)
+
+
+def _stub_check():
+    """KeyPool against a local fake KnowYourGST whose answer depends on the key."""
+    import json
+    import sys
+    from collections import Counter
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    global KNOWYOURGST_URL
+    hits = Counter()  # key -> requests served
+
+    class Stub(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            key = self.headers["passthrough"]
+            hits[key] += 1
+            kind = key.split("-")[0]
+            if kind == "slow":
+                time.sleep(0.3)
+            status = {"limited": 429, "forbidden": 403, "failing": 503}.get(kind, 200)
+            body = json.dumps({"gstin": "27AAPFU0939F1ZV", "key": key}).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Stub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    KNOWYOURGST_URL = f"http://127.0.0.1:{server.server_address[1]}/"
+    gstin = "27AAPFU0939F1ZV"
+    failures = []
+
+    def check(name, ok, detail=""):
+        print(f"{'ok  ' if ok else 'FAIL'} {name}{': ' + detail if detail else ''}")
+        if not ok:
+            failures.append(name)
+
+    # 429 / 403 put a key on cooldown that later lookups respect
+    keys = ["limited-1", "forbidden-1", "ok-1"]
+    first = lookup_gstin_using_keys(keys, gstin, hedge=False)
+    second = lookup_gstin_using_keys(keys, gstin, hedge=False)
+    stats = {s["key"]: s for s in key_pool(keys).stats()}
+    check("429 and 403 keys fall through to a healthy one",
+          first["result"]["key"] == second["result"]["key"] == "ok-1")
+    check("cooldown recorded across calls",
+          not stats["key[0]"]["healthy"] and stats["key[0]"]["cooldown_seconds"] > RATE_LIMIT_COOLDOWN - 5
+          and not stats["key[1]"]["healthy"] and stats["key[1]"]["cooldown_seconds"] > FORBIDDEN_COOLDOWN - 5,
+          f"{stats['key[0]']['cooldown_seconds']} s / {stats['key[1]']['cooldown_seconds']} s")
+    check("cooling keys are not called again", hits["limited-1"] == 1 and hits["forbidden-1"] == 1,
+          f"{hits['limited-1']} / {hits['forbidden-1']} calls")
+
+    # a key busy with other lookups is passed over for an idle one
+    keys = ["ok-busy", "ok-idle"]
+    pool = key_pool(keys)
+    busy = pool.acquire(1)
+    out = lookup_gstin_using_keys(keys, gstin, hedge=False)
+    pool.release(busy[0], "cancelled")
+    check("saturated key skipped", out["result"]["key"] == "ok-idle" and hits["ok-busy"] == 0)
+
+    # only backoffs left: raise with retry_after instead of sleeping
+    keys = ["failing-1"]
+    start = time.monotonic()
+    try:
+        lookup_gstin_using_keys(keys, gstin, hedge=False)
+        check("backoff is raised, not slept", False, "lookup succeeded")
+    except AllKeysExhausted as e:
+        elapsed = time.monotonic() - start
+        check("backoff is raised, not slept", e.retry_after is not None and elapsed < 0.25,
+              f"retry_after {e.retry_after}, {elapsed * 1000:.0f} ms")
+
+    # once p95 latency is high, hedged lookups race two keys
+    keys = ["slow-1", "ok-fast"]
+    pool = key_pool(keys)
+    for k in pool.keys:
+        k.latencies.extend([HEDGE_P95 + 1] * 10)
+    start = time.monotonic()
+    out = lookup_gstin_using_keys(keys, gstin, hedge=True)
+    elapsed = time.monotonic() - start
+    time.sleep(0.4)  # let the loser finish and release its key
+    check("hedged mode races two keys", hits["slow-1"] == 1 and hits["ok-fast"] == 1
+          and out["result"]["key"] == "ok-fast" and elapsed < 0.25, f"{elapsed * 1000:.0f} ms")
+    check("race loser releases its key", all(k.inflight == 0 for k in pool.keys))
+
+    server.shutdown()
+    sys.exit(1 if failures else 0)
 
 
 if __name__ == "__main__":
+    import sys
+
+    if sys.argv[1:] == ["--stub"]:
+        _stub_check()  # python gst_check.py --stub: KeyPool self-check against a local fake server
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    api_keys = [os.getenv(f"API_{i}") for i in range(1, 11)]
     # Example usage:
     gstin_to_check=input("Enter the GSTIN Number:- ")
 
@@ -0,0 +1,84 @@
+# http_client.py
+"""
+Shared keep-alive HTTP sessions for the upstream APIs (Perplexity, KnowYourGST).
+
+One requests.Session per service, shared by every thread: urllib3's connection
+pool is thread-safe, and we never put cookies or auth on the session itself
+(headers are passed per call). pool_block keeps the number of open connections
+per host at HTTP_POOL_SIZE; extra callers wait for a free connection.
+
+    python http_client.py    # per-call latency, bare requests vs pooled session
+"""
+import os
+import threading
+
+import lazy
+
+requests = lazy.module("requests")
+adapters = lazy.module("requests.adapters")
+
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 5))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 15))
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 10))
+
+_sessions = {}
+_lock = threading.Lock()
+
+
+def get_session(name):
+    """The shared Session for one upstream service, created on first use."""
+    session = _sessions.get(name)
+    if session is not None:
+        return session
+    with _lock:
+        if name not in _sessions:
+            session = requests.Session()
+            adapter = adapters.HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE, pool_block=True)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[name] = session
+        return _sessions[name]
+
+
+def timeout(read=None):
+    """(connect, read) timeout tuple; `read` overrides HTTP_READ_TIMEOUT for one call."""
+    return (HTTP_CONNECT_TIMEOUT, read if read is not None else HTTP_READ_TIMEOUT)
+
+
+if __name__ == "__main__":
+    import time
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Stub(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive
+        disable_nagle_algorithm = True  # else delayed ACKs add ~40 ms per reused connection
+
+        def do_GET(self):
+            body = b'{"ok": true}'
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Stub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+    calls = 500
+
+    def bench(label, get):
+        get(url, timeout=timeout()).raise_for_status()  # warm-up
+        start = time.perf_counter()
+        for _ in range(calls):
+            get(url, timeout=timeout()).raise_for_status()
+        per_call = (time.perf_counter() - start) / calls * 1000
+        print(f"{label:<16} {per_call:.3f} ms/call")
+        return per_call
+
+    bare = bench("bare requests", requests.get)
+    pooled = bench("pooled session", get_session("bench").get)
+    print(f"speedup          {bare / pooled:.2f}x (loopback; TLS handshakes to real hosts cost far more)")
+    server.shutdown()
@@ -0,0 +1,124 @@
+# income.py
+"""
+ITR income figures computed in SQLite instead of over loaded Transactions.
+
+category_totals() is one GROUP BY (user, category, sign of amount) query, so
+an ITR needs a handful of rows per user however many transactions they
+have. itr_generator.income_details_from_totals turns the rows into the same
+dict compute_income_details returns.
+
+    python income.py    # check the SQL path against compute_income_details on random data
+"""
+import datetime
+from collections import defaultdict
+
+from sqlalchemy import case, func, select
+
+from itr_generator import income_details_from_totals
+from model import db, Transaction
+
+_IN_CHUNK = 500  # ids per IN (...) list, well under SQLite's bound-parameter limit
+
+
+def assessment_year_range(assessment_year):
+    """[start, end) dates of the financial year assessed in AY `assessment_year` (2025 -> AY 2025-26 -> FY 2024-25)."""
+    return datetime.date(assessment_year - 1, 4, 1), datetime.date(assessment_year, 4, 1)
+
+
+def totals_query(user_ids, assessment_year=None):
+    sign = case((Transaction.amount > 0, 1), (Transaction.amount < 0, -1), else_=0)
+    query = (
+        select(Transaction.user_id, Transaction.category, sign, func.sum(Transaction.amount))
+        .where(Transaction.user_id.in_(user_ids))
+        .group_by(Transaction.user_id, Transaction.category, sign)
+    )
+    if assessment_year:
+        start, end = assessment_year_range(assessment_year)
+        query = query.where(Transaction.transaction_date >= start, Transaction.transaction_date < end)
+    return query
+
+
+def category_totals(user_ids, assessment_year=None):
+    """
+    {user_id: {(category, sign): total}} like itr_generator.income_totals; users
+    without transactions (in that assessment year) are missing.
+    """
+    ids = list(dict.fromkeys(user_ids))
+    out = defaultdict(dict)
+    for i in range(0, len(ids), _IN_CHUNK):
+        for user_id, category, sign, total in db.session.execute(totals_query(ids[i:i + _IN_CHUNK], assessment_year)):
+            out[user_id][(category, sign)] = round(total, 2)
+    return dict(out)
+
+
+def income_details(user_id, employment, salary, assessment_year=None):
+    """compute_income_details for a user's stored transactions, or None if there are none."""
+    totals = category_totals([user_id], assessment_year).get(user_id)
+    if totals is None:
+        return None
+    return income_details_from_totals(totals, employment, salary, assessment_year=assessment_year)
+
+
+if __name__ == "__main__":
+    import random
+
+    from flask import Flask
+
+    from itr_generator import compute_income_details
+
+    def legacy(transactions, employment, salary):
+        """compute_income_details before the SQL path: four passes over the dicts."""
+        r = {"electricity_expenditure": abs(sum(
+            t["amount"] for t in transactions if t.get("category") == "electricity" and t["amount"] < 0
+        ))}
+        r["salary_pensioner"] = salary if employment.lower() == "pensioner" else 0
+        r["salary_non_pensioner"] = 0 if employment.lower() == "pensioner" else salary
+        r["income_over_salary"] = sum(t["amount"] for t in transactions if t["amount"] > 0 and t.get("category") != "salary")
+        r["gross_salary_B1"] = salary
+        r["entertainment_income"] = sum(
+            t["amount"] for t in transactions if t.get("category") == "entertainment" and t["amount"] > 0
+        )
+        r["total_income"] = salary + r["income_over_salary"]
+        return r
+
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    db.init_app(app)
+    rng = random.Random(7)
+    categories = ["electricity", "salary", "entertainment", "food", "Electricity", "other"]
+
+    with app.app_context():
+        db.create_all()
+        users = {}
+        for user_id in range(1, 51):
+            users[user_id] = [
+                {
+                    "amount": round(rng.choice([-1, 1, 0]) * rng.uniform(0, 50000), rng.choice([0, 2])),
+                    "category": rng.choice(categories),
+                    "date": datetime.date(2023, 1, 1) + datetime.timedelta(days=rng.randrange(900)),
+                }
+                for _ in range(rng.randrange(0, 300))
+            ]
+            db.session.add_all(
+                Transaction(user_id=user_id, item_name="x", amount=t["amount"], category=t["category"],
+                            payment_mode="cash", transaction_date=t["date"])
+                for t in users[user_id]
+            )
+        db.session.commit()
+
+        mismatches = 0
+        for assessment_year in (None, 2024, 2025):
+            totals = category_totals(list(users), assessment_year)
+            for user_id, transactions in users.items():
+                if assessment_year:
+                    start, end = assessment_year_range(assessment_year)
+                    transactions = [t for t in transactions if start <= t["date"] < end]
+                employment, salary = rng.choice([("Salaried", 600000), ("Pensioner", 250000)])
+                python = compute_income_details(transactions, employment, salary)
+                sql = income_details_from_totals(totals.get(user_id, {}), employment, salary)
+                old = legacy(transactions, employment, salary)
+                if python != sql or any(round(old[k], 2) != sql[k] for k in old):
+                    mismatches += 1
+                    print(f"user {user_id} AY {assessment_year}: python {python} sql {sql} legacy {old}")
+        print(f"{len(users) * 3} users x assessment years compared, {mismatches} mismatches")
+        raise SystemExit(1 if mismatches else 0)
@@ -0,0 +1,291 @@
+# itr_batch.py
+"""
+Bulk ITR PDF generation for firms filing on behalf of many clients.
+
+Every selected user's income figures come from one grouped query (per 500
+ids, see income.py), and the PDFs are rendered in a process pool
+and written one at a time into a ZIP on disk. At most 2 * ITR_WORKERS PDFs are
+in memory at once.
+
+- POST /itr/batch queues an ItrBatch that a background thread runs; poll
+  GET /itr/batch/<id> for progress and fetch GET /itr/batch/<id>/download.
+- python itr_batch.py --out itrs.zip (--organization NAME | USER_ID ...)
+- python itr_batch.py --grant FIRM_ID CLIENT_ID ...    # or --revoke; who /itr/batch lets a firm file for
+"""
+import json
+import os
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+
+from income import category_totals
+from itr_generator import income_details_from_totals, profile_form_data, render_itr_pdf
+from model import db, FirmClient, ItrBatch, User
+
+ITR_WORKERS = int(os.getenv("ITR_WORKERS", os.cpu_count() or 1))
+ITR_BATCH_MAX_USERS = int(os.getenv("ITR_BATCH_MAX_USERS", 5000))
+ITR_PROGRESS_EVERY = int(os.getenv("ITR_PROGRESS_EVERY", 50))
+ITR_PROGRESS_SECONDS = float(os.getenv("ITR_PROGRESS_SECONDS", 2))
+ITR_TEMPLATE = "ITR_TEMPLATE.pdf"
+_IN_CHUNK = 500  # ids per IN (...) list, well under SQLite's bound-parameter limit
+
+
+def batch_folder():
+    folder = os.path.join(os.getcwd(), "itr_batches")
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def load_inputs(user_ids, assessment_year=None):
+    """{user_id: (User, income.category_totals entry or None)} for the ids that exist, in input order."""
+    ids = list(dict.fromkeys(user_ids))
+    users = {}
+    for i in range(0, len(ids), _IN_CHUNK):
+        users.update((u.id, u) for u in User.query.filter(User.id.in_(ids[i:i + _IN_CHUNK])))
+    totals = category_totals([uid for uid in ids if uid in users], assessment_year)
+    return {uid: (users[uid], totals.get(uid)) for uid in ids if uid in users}
+
+
+def prepare(user_ids, assessment_year=None):
+    """
+    [(user_id, data, error)]: the render_itr_pdf input for each user, or why
+    there is none. Built up front so later commits cannot expire the Users
+    and trigger a query per user.
+    """
+    inputs = load_inputs(user_ids, assessment_year)
+    prepared = []
+    for user_id in dict.fromkeys(user_ids):
+        if user_id not in inputs:
+            prepared.append((user_id, None, "User not found"))
+            continue
+        user, totals = inputs[user_id]
+        if not totals:
+            prepared.append((user_id, None, "No transactions found for user"))
+            continue
+        try:
+            form_data = profile_form_data(user)
+        except (IndexError, TypeError):
+            prepared.append((user_id, None, "Incomplete ITR details (date of birth, PAN, Aadhaar or address)"))
+            continue
+        computed = income_details_from_totals(totals, form_data["employment"], form_data["salary"] or 0,
+                                              assessment_year=assessment_year)
+        prepared.append((user_id, form_data | computed, None))
+    return prepared
+
+
+def _render(user_id, data, template_path):
+    start = time.perf_counter()
+    try:
+        pdf = render_itr_pdf(data, template_path).getvalue()
+    except Exception as e:
+        # keep the pool usable if an exception type does not pickle
+        raise RuntimeError(f"{type(e).__name__}: {e}") from None
+    return user_id, pdf, time.perf_counter() - start
+
+
+def generate_zip(user_ids, out_path, template_path=ITR_TEMPLATE, on_progress=None, workers=ITR_WORKERS,
+                 assessment_year=None):
+    """
+    Write ITR_<user_id>.pdf for every user into a ZIP at `out_path`. Needs an
+    app context. on_progress is called once per user, in completion order, with
+    {"user_id", "file", "seconds"} or {"user_id", "error"}. Returns those dicts.
+    """
+    template_path = os.path.abspath(template_path)
+    results = []
+
+    def report(result):
+        results.append(result)
+        if on_progress:
+            on_progress(result)
+
+    with zipfile.ZipFile(out_path, "w", zipfile.ZIP_DEFLATED) as archive, \
+            ProcessPoolExecutor(max_workers=workers) as pool:
+        owners = {}
+
+        def collect(futures):
+            for fut in futures:
+                user_id = owners.pop(fut)
+                try:
+                    _, pdf, seconds = fut.result()
+                except Exception as e:
+                    report({"user_id": user_id, "error": str(e)})
+                    continue
+                name = f"ITR_{user_id}.pdf"
+                archive.writestr(name, pdf)
+                report({"user_id": user_id, "file": name, "seconds": round(seconds, 3)})
+
+        for user_id, data, error in prepare(user_ids, assessment_year):
+            if error:
+                report({"user_id": user_id, "error": error})
+                continue
+            owners[pool.submit(_render, user_id, data, template_path)] = user_id
+            if len(owners) >= 2 * workers:
+                collect(wait(list(owners), return_when=FIRST_COMPLETED).done)
+        collect(list(owners))
+    return results
+
+
+def allowed_user_ids(requester, user_ids):
+    """
+    The requested ids the requester may file for: themselves and the clients
+    an operator linked to them in FirmClient. User.organization is free text
+    every user can set, so it grants nothing.
+    """
+    allowed = {requester.id}
+    others = [uid for uid in dict.fromkeys(user_ids) if uid != requester.id]
+    for i in range(0, len(others), _IN_CHUNK):
+        allowed.update(uid for (uid,) in db.session.query(FirmClient.client_user_id).filter(
+            FirmClient.firm_user_id == requester.id, FirmClient.client_user_id.in_(others[i:i + _IN_CHUNK])
+        ))
+    return [uid for uid in user_ids if uid in allowed]
+
+
+def grant_clients(firm_user_id, client_user_ids):
+    """Let `firm_user_id` file for `client_user_ids` (operator only). Returns how many links were new."""
+    client_user_ids = [uid for uid in dict.fromkeys(client_user_ids) if uid != firm_user_id]
+    existing = set()
+    for i in range(0, len(client_user_ids), _IN_CHUNK):
+        existing.update(uid for (uid,) in db.session.query(FirmClient.client_user_id).filter(
+            FirmClient.firm_user_id == firm_user_id, FirmClient.client_user_id.in_(client_user_ids[i:i + _IN_CHUNK])
+        ))
+    new = [uid for uid in client_user_ids if uid not in existing]
+    db.session.add_all(FirmClient(firm_user_id=firm_user_id, client_user_id=uid) for uid in new)
+    db.session.commit()
+    return len(new)
+
+
+def revoke_clients(firm_user_id, client_user_ids):
+    """Undo grant_clients. Returns how many links were removed."""
+    removed = 0
+    for i in range(0, len(client_user_ids), _IN_CHUNK):
+        removed += db.session.query(FirmClient).filter(
+            FirmClient.firm_user_id == firm_user_id, FirmClient.client_user_id.in_(client_user_ids[i:i + _IN_CHUNK])
+        ).delete(synchronize_session=False)
+    db.session.commit()
+    return removed
+
+
+def start(app, requester_id, user_ids, assessment_year=None):
+    """Create an ItrBatch and run it on a background thread. Caller has checked allowed_user_ids."""
+    user_ids = list(dict.fromkeys(user_ids))
+    batch = ItrBatch(
+        id=str(uuid.uuid4()),
+        user_id=requester_id,
+        status="queued",
+        total=len(user_ids),
+        user_ids=json.dumps(user_ids),
+        assessment_year=assessment_year,
+    )
+    db.session.add(batch)
+    db.session.commit()
+    threading.Thread(target=_run, args=(app, batch.id), name=f"itr-batch-{batch.id[:8]}", daemon=True).start()
+    return batch
+
+
+def _run(app, batch_id):
+    with app.app_context():
+        batch = db.session.get(ItrBatch, batch_id)
+        batch.status = "running"
+        batch.started_at = datetime.utcnow()
+        batch.zip_path = os.path.join(batch_folder(), f"{batch.id}.zip")
+        db.session.commit()
+        results = []
+        last_commit = [time.monotonic()]
+
+        def counts():
+            batch.done = len(results)
+            batch.failed = sum("error" in r for r in results)
+
+        def on_progress(result):
+            # counters only, and at most every ITR_PROGRESS_EVERY results / ITR_PROGRESS_SECONDS:
+            # one commit per user would queue behind request writers on SQLite
+            results.append(result)
+            if len(results) % ITR_PROGRESS_EVERY and time.monotonic() - last_commit[0] < ITR_PROGRESS_SECONDS:
+                return
+            counts()
+            db.session.commit()
+            last_commit[0] = time.monotonic()
+
+        try:
+            generate_zip(json.loads(batch.user_ids), batch.zip_path, on_progress=on_progress,
+                         assessment_year=batch.assessment_year)
+            batch.status = "done"
+        except Exception as e:
+            app.logger.exception(f"ITR batch {batch_id} failed")
+            db.session.rollback()
+            batch.status = "failed"
+            batch.error = str(e)
+        counts()
+        batch.results = json.dumps(results)  # serialised once, when the batch ends
+        batch.finished_at = datetime.utcnow()
+        db.session.commit()
+
+
+def serialize(batch):
+    elapsed = None
+    if batch.started_at:
+        elapsed = round(((batch.finished_at or datetime.utcnow()) - batch.started_at).total_seconds(), 3)
+    return {
+        "batch_id": batch.id,
+        "status": batch.status,
+        "assessment_year": batch.assessment_year,
+        "total": batch.total,
+        "done": batch.done,
+        "failed": batch.failed,
+        "elapsed": elapsed,
+        "results": json.loads(batch.results or "[]"),
+        "error": batch.error,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from app import create_app
+
+    app = create_app()
+
+    parser = argparse.ArgumentParser(description="Generate ITR PDFs for many users into one ZIP.")
+    parser.add_argument("user_ids", nargs="*", type=int)
+    parser.add_argument("--organization", help="every user of this organization")
+    parser.add_argument("--out", default="itrs.zip")
+    parser.add_argument("--workers", type=int, default=ITR_WORKERS)
+    parser.add_argument("--assessment-year", type=int, help="only transactions of this AY's financial year, e.g. 2025")
+    parser.add_argument("--grant", type=int, metavar="FIRM_ID", help="let this user file for the given user ids")
+    parser.add_argument("--revoke", type=int, metavar="FIRM_ID", help="undo --grant for the given user ids")
+    args = parser.parse_args()
+
+    with app.app_context():
+        if args.grant or args.revoke:
+            if not args.user_ids:
+                parser.error("give the client user ids")
+            if args.grant:
+                print(f"{grant_clients(args.grant, args.user_ids)} clients granted to user {args.grant}")
+            else:
+                print(f"{revoke_clients(args.revoke, args.user_ids)} clients revoked from user {args.revoke}")
+            raise SystemExit(0)
+
+        user_ids = list(args.user_ids)
+        if args.organization:
+            user_ids += [uid for (uid,) in db.session.query(User.id).filter_by(organization=args.organization)]
+        user_ids = list(dict.fromkeys(user_ids))
+        if not user_ids:
+            parser.error("give user ids or --organization")
+
+        start_time = time.perf_counter()
+        count = 0
+
+        def progress(result):
+            global count
+            count += 1
+            status = f"{result['seconds']:.3f} s" if "error" not in result else f"failed: {result['error']}"
+            print(f"[{count}/{len(user_ids)}] user {result['user_id']}: {status}")
+
+        results = generate_zip(user_ids, args.out, on_progress=progress, workers=args.workers,
+                               assessment_year=args.assessment_year)
+        elapsed = time.perf_counter() - start_time
+        ok = sum("error" not in r for r in results)
+        print(f"{ok}/{len(results)} PDFs in {args.out}, {elapsed:.2f} s ({ok / elapsed:.1f} PDFs/sec)")
@@ -1,7 +1,12 @@
 import io
-from pypdf import PdfReader, PdfWriter
-from reportlab.pdfgen import canvas
-from reportlab.lib import colors
+import os
+import threading
+import lazy
+from tax_engine import tax_for
+
+pypdf = lazy.module("pypdf")
+canvas = lazy.module("reportlab.pdfgen.canvas")
+colors = lazy.module("reportlab.lib.colors")
 
 def split_name(full_name: str):
     parts = full_name.strip().split()
@@ -13,15 +18,41 @@ def split_name(full_name: str):
         return parts[0], "", parts[1]
     return parts[0], " ".join(parts[1:-1]), parts[-1]
 
-def overlay_page1(data, w, h):
-    buf = io.BytesIO()
-    can = canvas.Canvas(buf, pagesize=(w, h))
-    can.setFont("Helvetica", 9)
-
+def format_form_data(form_data, user):
+    """Fill name / email / mobile / salary from the User and space dob, PAN, Aadhaar and address into the form's boxes."""
+    form_data['name'] = user.first_name+' '+user.last_name
+
+    st = form_data['dob']
+    form_data['dob'] = st[8]+'  '+st[9]+'  '+st[5]+'  '+st[6]+'  '+st[0]+'  '+st[1]+'  '+st[2]+'  '+st[3]
+    st = form_data['pan']
+    form_data['pan'] = st[0]+'  '+st[1]+'  '+st[2]+'    '+st[3]+'  '+st[4]+'  '+st[5]+'  '+st[6]+'   '+st[7]+'   '+st[8]+'   '+st[9]
+    st = form_data['aadhaar']
+    form_data['aadhaar'] = st[0]+'  '+st[1]+'  '+st[2]+'  '+st[3]+'  '+st[4]+'  '+st[5]+'  '+st[6]+'  '+st[7]+'  '+st[8]+'  '+st[9]+'  '+st[10]+'   '+st[11]
+    form_data['email'] = user.email
+    form_data['mobile'] = user.phone_number
+    form_data['salary'] = user.annual_salary
+    st = form_data['address']
+    st = st.split('\n')
+    form_data['address'] = "Address: (A8)"+"         "+st[0]+("\n                               "+st[1] if len(st)>1 else "")
+    return form_data
+
+def profile_form_data(user):
+    """format_form_data for the details saved on the User (as /itr/generate stores them)."""
+    return format_form_data({
+        "dob": user.date_of_birth or "",
+        "pan": user.pan_number or "",
+        "aadhaar": user.aadhar_number or "",
+        "address": user.address or "",
+        "employment": user.employment_type or "",
+    }, user)
+
+def static_page1(can, w, h):
+    """White masks over the template's own page-1 text; the same for every user."""
     can.setFillColor(colors.white)
     can.rect(275, h - 535.53, 290, 25, fill=1, stroke=0)
     can.rect(392, h - 598.8, 180, 50, fill=1, stroke=0)
 
+def overlay_page1(can, data, w, h):
     can.setFillColor(colors.black)
 
     first, middle, last = split_name(data["name"])
@@ -44,14 +75,7 @@ def overlay_page1(data, w, h):
         text.textLine(line)
     can.drawText(text)
 
-    can.save()
-    buf.seek(0)
-    return buf
-
-def overlay_page2(data, w, h):
-    buf = io.BytesIO()
-    can = canvas.Canvas(buf, pagesize=(w, h))
-    can.setFont("Helvetica", 9)
+def overlay_page2(can, data, w, h):
     can.setFillColor(colors.black)
 
     if data["electricity_expenditure"] > 100000:
@@ -71,32 +95,99 @@ def overlay_page2(data, w, h):
     can.drawString(480, h - 600, str(data["total_income"]))
     can.drawString(480, h - 160, str(data["gross_salary_B1"]))
 
-    can.save()
-    buf.seek(0)
-    return buf
+def overlay_page3(can, data, w, h):
+    can.drawString(133, h - 296, str(data["tax_payable"]))
 
-def overlay_page3(data, w, h):
+OVERLAYS = [overlay_page1, overlay_page2, overlay_page3]
+STATIC_OVERLAYS = [static_page1, None, None]
+
+def render(draw_fns, sizes, *args):
+    """One reportlab document with a page per draw function (None leaves the page blank), parsed."""
     buf = io.BytesIO()
-    can = canvas.Canvas(buf, pagesize=(w, h))
-    can.setFont("Helvetica", 9)
-    can.drawString(133, h - 296, str(data["tax_payable"]))
+    can = canvas.Canvas(buf)
+    for fn, (w, h) in zip(draw_fns, sizes):
+        can.setPageSize((w, h))
+        can.setFont("Helvetica", 9)
+        if fn:
+            fn(can, *args, w, h)
+        can.showPage()
     can.save()
     buf.seek(0)
-    return buf
-
-def apply_overlay(base_page, overlay_stream):
-    overlay_reader = PdfReader(overlay_stream)
-    overlay_page = overlay_reader.pages[0]
-    base_page.merge_page(overlay_page)
-    return base_page
+    return pypdf.PdfReader(buf)
+
+class Template:
+    """
+    An ITR template parsed once, cut to the filled pages, with the static
+    overlays already merged in. Pages are cloned into each request's writer,
+    so the cached pages are never modified.
+    """
+    def __init__(self, path):
+        reader = pypdf.PdfReader(path)
+        writer = pypdf.PdfWriter()
+        pages = [writer.add_page(reader.pages[i]) for i in range(len(OVERLAYS))]
+        sizes = [(float(p.mediabox.width), float(p.mediabox.height)) for p in pages]
+        for page, static in zip(pages, render(STATIC_OVERLAYS, sizes).pages):
+            page.merge_page(static)
+
+        buf = io.BytesIO()
+        writer.write(buf)
+        buf.seek(0)
+        self.reader = pypdf.PdfReader(buf)
+        self.sizes = sizes
+        self.lock = threading.Lock()  # the reader resolves objects lazily from one stream
+
+    def new_writer(self):
+        writer = pypdf.PdfWriter()
+        with self.lock:
+            pages = [writer.add_page(p) for p in self.reader.pages]
+        return writer, pages
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+def load_template(path):
+    """The cached Template for `path`, re-parsed only when the file changes."""
+    key = (os.path.abspath(path), os.path.getmtime(path))
+    template = _templates.get(key)
+    if template is None:
+        with _templates_lock:
+            template = _templates.get(key)
+            if template is None:
+                template = Template(path)
+                for old in [k for k in _templates if k[0] == key[0]]:
+                    del _templates[old]
+                _templates[key] = template
+    return template
+
+def _sign(amount):
+    return 1 if amount > 0 else -1 if amount < 0 else 0
+
+def income_totals(transactions):
+    """
+    {(category, sign): total} over transaction dicts, sign being 1 / -1 / 0 for
+    income / expense / zero amounts. income.category_totals computes the same in SQL.
+    """
+    totals = {}
+    for t in transactions:
+        key = (t.get("category"), _sign(t["amount"]))
+        totals[key] = totals.get(key, 0) + t["amount"]
+    return {k: round(v, 2) for k, v in totals.items()}
+
+def compute_income_details(transactions, employment, salary, regime=None, assessment_year=None):
+    return income_details_from_totals(income_totals(transactions), employment, salary, regime, assessment_year)
+
+def income_details_from_totals(totals, employment, salary, regime=None, assessment_year=None):
+    """
+    The ITR figures from income_totals / income.category_totals output; amounts
+    are rounded to paise. tax_payable uses the tax_engine slabs for `regime` and
+    `assessment_year` (the configured defaults when None).
+    """
+    def total(match):
+        return round(sum(v for (category, sign), v in totals.items() if match(category, sign)), 2)
 
-def compute_income_details(transactions, employment, salary):
     r = {}
 
-    r["electricity_expenditure"] = abs(sum(
-        t["amount"] for t in transactions
-        if t.get("category") == "electricity" and t["amount"] < 0
-    ))
+    r["electricity_expenditure"] = abs(total(lambda category, sign: category == "electricity" and sign < 0))
 
     if employment.lower() == "pensioner":
         r["salary_pensioner"] = salary
@@ -105,39 +196,15 @@ def compute_income_details(transactions, employment, salary):
         r["salary_non_pensioner"] = salary
         r["salary_pensioner"] = 0
 
-    r["income_over_salary"] = sum(
-        t["amount"] for t in transactions
-        if t["amount"] > 0 and t.get("category") != "salary"
-    )
+    r["income_over_salary"] = total(lambda category, sign: sign > 0 and category != "salary")
 
     r["gross_salary_B1"] = r["salary_non_pensioner"] + r["salary_pensioner"]
 
-    r["entertainment_income"] = sum(
-        t["amount"] for t in transactions
-        if t.get("category") == "entertainment" and t["amount"] > 0
-    )
+    r["entertainment_income"] = total(lambda category, sign: category == "entertainment" and sign > 0)
 
-    r["total_income"] = r["gross_salary_B1"] + r["income_over_salary"]
-
-    total = r["total_income"]
-    tax = 0
-
-    if total > 1500000:
-        tax += (total - 1500000) * 0.30
-        total = 1500000
-    if total > 1200000:
-        tax += (total - 1200000) * 0.20
-        total = 1200000
-    if total > 900000:
-        tax += (total - 900000) * 0.15
-        total = 900000
-    if total > 600000:
-        tax += (total - 600000) * 0.10
-        total = 600000
-    if total > 300000:
-        tax += (total - 300000) * 0.05
-
-    r["tax_payable"] = round(tax, 2)
+    r["total_income"] = round(r["gross_salary_B1"] + r["income_over_salary"], 2)
+
+    r["tax_payable"] = tax_for(r["total_income"], regime, assessment_year)
     return r
 
 def generate_itr_pdf(form_data, transactions, template_path):
@@ -148,23 +215,52 @@ def generate_itr_pdf(form_data, transactions, template_path):
         form_data["salary"]
     )
 
-    data = form_data | computed
-
-    reader = PdfReader(template_path)
-    writer = PdfWriter()
-
-    overlay_fns = [overlay_page1, overlay_page2, overlay_page3]
-
-    for i, fn in enumerate(overlay_fns):
-        page = reader.pages[i]
-        w = float(page.mediabox.width)
-        h = float(page.mediabox.height)
+    return render_itr_pdf(form_data | computed, template_path)
 
-        overlay_stream = fn(data, w, h)
-        merged_page = apply_overlay(page, overlay_stream)
-        writer.add_page(merged_page)
+def render_itr_pdf(data, template_path):
+    """The filled PDF for form data already merged with compute_income_details output."""
+    template = load_template(template_path)
+    writer, pages = template.new_writer()
+    for page, overlay in zip(pages, render(OVERLAYS, template.sizes, data).pages):
+        page.merge_page(overlay)
 
     out = io.BytesIO()
     writer.write(out)
     out.seek(0)
-    return out
\ No newline at end of file
+    return out
+
+if __name__ == "__main__":
+    import sys
+    import tempfile
+    import time
+
+    # python itr_generator.py [template.pdf] [count]  - PDFs/sec, with and without the template cache
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    template_path = sys.argv[1] if len(sys.argv) > 1 else None
+    if template_path is None:
+        template_path = os.path.join(tempfile.mkdtemp(), "ITR_TEMPLATE.pdf")
+        can = canvas.Canvas(template_path)
+        for n in range(1, 6):
+            for y in range(60, 800, 14):
+                can.drawString(40, y, f"ITR-1 SAHAJ  page {n}  line {y}  " + "." * 60)
+            can.showPage()
+        can.save()
+
+    form_data = {
+        "name": "Asha Kumari Rao", "dob": "0  1  0  1  1  9  9  0", "aadhaar": "1  2  3  4  5  6  7  8  9  0  1   2",
+        "pan": "A  B  C    D  E  1  2   3   4   F", "mobile": "9999999999", "email": "asha@example.com",
+        "employment": "Salaried", "salary": 900000, "address": "Address: (A8)  12 MG Road\n  Pune",
+    }
+    transactions = [{"amount": -2500.0, "category": "electricity"}, {"amount": 40000.0, "category": "other"}] * 50
+
+    def bench(label, clear):
+        start = time.perf_counter()
+        for _ in range(count):
+            if clear:
+                _templates.clear()
+            generate_itr_pdf(form_data, transactions, template_path)
+        elapsed = time.perf_counter() - start
+        print(f"{label:<18} {count / elapsed:7.1f} PDFs/sec  ({elapsed * 1000 / count:.2f} ms per PDF)")
+
+    bench("template per call", clear=True)
+    bench("cached template", clear=False)
@@ -0,0 +1,156 @@
+# jobs.py
+"""
+Local worker pool for /document/upload. The Job table in the app database is
+the queue: workers claim the oldest queued row with a conditional UPDATE, so
+any number of threads (or processes sharing database.db) can poll it safely.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+from model import db, Job, Document
+from pipeline import PipelineError, process_document, upload_folder
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 2.0))
+# A job still "running" after this long is assumed to belong to a dead worker
+JOB_STALE_AFTER = timedelta(minutes=int(os.getenv("JOB_STALE_MINUTES", 10)))
+
+_threads = []
+_start_lock = threading.Lock()
+_wakeup = threading.Event()
+_stopping = threading.Event()
+
+
+def init_app(app):
+    # Workers start with the first request so they run in the serving process
+    # (not the reloader parent) and pick up jobs left over from a restart.
+    @app.before_request
+    def _ensure_job_workers():
+        start_workers(app)
+
+
+def start_workers(app, count=None):
+    if _threads or _stopping.is_set():
+        return
+    with _start_lock:
+        if _threads or _stopping.is_set():
+            return
+        for i in range(count or JOB_WORKERS):
+            t = threading.Thread(target=_worker_loop, args=(app,), name=f"job-worker-{i}", daemon=True)
+            t.start()
+            _threads.append(t)
+
+
+def enqueue(user_id, document, hints):
+    """Queue a pending Document for processing. Caller commits the session."""
+    job = Job(
+        id=str(uuid.uuid4()),
+        user_id=user_id,
+        document_id=document.id,
+        status="queued",
+        hints=json.dumps(hints),
+    )
+    db.session.add(job)
+    return job
+
+
+def notify():
+    _wakeup.set()
+
+
+def stop(timeout=None):
+    """
+    Stop claiming jobs and wait up to `timeout` seconds for the running ones.
+    A job still running after that is requeued by the next process as stale.
+    """
+    _stopping.set()
+    _wakeup.set()
+    deadline = None if timeout is None else time.monotonic() + timeout
+    for t in _threads:
+        t.join(None if deadline is None else max(0, deadline - time.monotonic()))
+    return not any(t.is_alive() for t in _threads)
+
+
+def _requeue_stale():
+    cutoff = datetime.utcnow() - JOB_STALE_AFTER
+    db.session.execute(
+        update(Job)
+        .where(Job.status == "running", Job.started_at < cutoff)
+        .values(status="queued", stage=None)
+    )
+    db.session.commit()
+
+
+def _claim_next():
+    while True:
+        job = Job.query.filter_by(status="queued").order_by(Job.created_at).first()
+        if job is None:
+            return None
+        claimed = db.session.execute(
+            update(Job)
+            .where(Job.id == job.id, Job.status == "queued")
+            .values(status="running", started_at=datetime.utcnow(), attempts=Job.attempts + 1)
+        ).rowcount
+        db.session.commit()
+        if claimed:
+            return job.id
+
+
+def _run(job_id):
+    job = db.session.get(Job, job_id)
+    doc = db.session.get(Document, job.document_id)
+    hints = json.loads(job.hints or "{}")
+    timings = {}
+
+    def on_stage(name):
+        job.stage = name
+        db.session.commit()
+
+    try:
+        file_path = os.path.join(upload_folder(), doc.file_name)
+        payload = process_document(
+            job.user_id, doc.file_name, file_path, hints,
+            document=doc, timings=timings, on_stage=on_stage,
+        )
+        job.status = "done"
+        job.result = json.dumps(payload)
+    except Exception as e:
+        db.session.rollback()
+        err = e.to_dict() if isinstance(e, PipelineError) else {"error": "Processing failed", "details": str(e)}
+        job.status = "failed"
+        job.error = json.dumps(err)
+        doc.status = "failed"
+
+    job.timings = json.dumps(timings)
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+
+
+def _worker_loop(app):
+    with app.app_context():
+        try:
+            _requeue_stale()
+        except Exception:
+            app.logger.exception("Failed to requeue stale jobs")
+            db.session.rollback()
+
+    while not _stopping.is_set():
+        job_id = None
+        with app.app_context():
+            try:
+                job_id = _claim_next()
+                if job_id:
+                    _run(job_id)
+            except Exception:
+                app.logger.exception(f"Job worker error (job {job_id})")
+                db.session.rollback()
+        if job_id:
+            continue
+        _wakeup.wait(JOB_POLL_INTERVAL)
+        _wakeup.clear()
@@ -0,0 +1,114 @@
+# lazy.py
+"""
+Heavy third-party modules imported on first use instead of at `import app`.
+
+pypdf/reportlab (ITR PDFs), numpy (tax arrays), pytesseract/PIL/pdf2image
+(OCR) and requests (LLM and GST calls) used to load with the app, so every
+worker spawn and every /auth/login process paid for them. Modules now take a
+LazyModule from module() and use it like the real one; the first attribute
+access imports it. Names in type annotations must stay strings, or defining
+the function imports the module.
+
+serve.py calls preload() in its master, so forked workers still start with
+everything loaded.
+
+    python lazy.py [budget_ms]    # `import app` cold-start check; exits 1 over budget or if a registered module loads
+"""
+import importlib
+import threading
+
+IMPORT_BUDGET_MS = 450
+
+_registry = {}
+_lock = threading.RLock()  # an on_load hook may load another module
+
+
+class LazyModule:
+    def __init__(self, name, on_load=None):
+        self._name = name
+        self._on_load = on_load
+        self._module = None
+
+    def load(self):
+        if self._module is None:
+            with _lock:
+                if self._module is None:
+                    module = importlib.import_module(self._name)
+                    if self._on_load:
+                        self._on_load(module)
+                    self._module = module
+        return self._module
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+    def __repr__(self):
+        return f"<lazy module {self._name!r} ({'loaded' if self.loaded else 'not loaded'})>"
+
+
+def module(name, on_load=None):
+    """The registry's LazyModule for `name`; `on_load(module)` runs once, right after the import."""
+    with _lock:
+        if name not in _registry:
+            _registry[name] = LazyModule(name, on_load)
+        return _registry[name]
+
+
+def registered():
+    return sorted(_registry)
+
+
+def loaded():
+    return sorted(name for name, lazy in _registry.items() if lazy.loaded)
+
+
+def preload():
+    """Import every registered module now (serve.py, before forking workers)."""
+    for lazy in list(_registry.values()):
+        lazy.load()
+
+
+def _import_times(code):
+    """{module: (self_us, cumulative_us)} from `python -X importtime -c code`, plus the registry after it."""
+    import json
+    import os
+    import subprocess
+    import sys
+
+    probe = f"{code}\nimport lazy, sys\nprint(__import__('json').dumps([n for n in lazy.registered() if n in sys.modules]))"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", probe], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode:
+        raise RuntimeError(result.stderr)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times, json.loads(result.stdout.splitlines()[-1])
+
+
+if __name__ == "__main__":
+    import statistics
+    import sys
+
+    budget_ms = float(sys.argv[1]) if len(sys.argv) > 1 else IMPORT_BUDGET_MS
+    runs = [_import_times("import app") for _ in range(5)]
+    total_ms = statistics.median(times["app"][1] for times, _ in runs) / 1000
+    eager = runs[-1][1]
+
+    times = runs[-1][0]
+    top = sorted(((cumulative, name) for name, (_, cumulative) in times.items() if "." not in name), reverse=True)
+    print("slowest top-level packages under `import app` (cumulative ms):")
+    for cumulative, name in top[:10]:
+        print(f"  {cumulative / 1000:8.1f}  {name}")
+    print(f"import app: {total_ms:.1f} ms (median of {len(runs)}), budget {budget_ms:g} ms")
+    if eager:
+        print(f"registered lazy modules loaded at import: {', '.join(eager)}")
+    if eager or total_ms > budget_ms:
+        raise SystemExit(1)
@@ -1,7 +1,60 @@
 import os
-import json
-import re
-import requests
+import time
+from http_client import get_session, timeout
+from partial_json import IncrementalParser
+
+PERPLEXITY_URL = os.getenv("PERPLEXITY_URL", "https://api.perplexity.ai/chat/completions")
+# Ask for schema-constrained output (Perplexity structured outputs); the prompt still spells out the keys
+LLM_JSON_SCHEMA = os.getenv("LLM_JSON_SCHEMA", "1") == "1"
+
+BILL_FIELDS = {
+    "item_name": "string", "amount": "number", "category": "string", "payment_mode": "string",
+    "transaction_date": "string", "vendor": "string", "description": "string", "tags": "string",
+    "legitimacy": "string", "legitimacy_report": "string", "gst_number": "string",
+}
+BILL_SCHEMA = {
+    "type": "object",
+    "properties": {k: {"type": t} for k, t in BILL_FIELDS.items()},
+    "required": list(BILL_FIELDS),
+}
+
+BATCH_SCHEMA = {
+    "type": "object",
+    "properties": {"bills": {"type": "array", "items": {
+        "type": "object",
+        "properties": {"bill": {"type": "integer"}, **BILL_SCHEMA["properties"]},
+        "required": ["bill", *BILL_SCHEMA["required"]],
+    }}},
+    "required": ["bills"],
+}
+
+BILL_KEYS = (
+    "{\n"
+    "  \"item_name\": \"\",\n"
+    "  \"amount\": 0,\n"
+    "  \"category\": \"\",\n"
+    "  \"payment_mode\": \"\",\n"
+    "  \"transaction_date\": \"\",\n"
+    "  \"vendor\": \"\",\n"
+    "  \"description\": \"\",\n"
+    "  \"tags\": \"\",\n"
+    "  \"legitimacy\": \"\",\n"
+    "  \"legitimacy_report\": \"\",\n"
+    "  \"gst_number\": \"\"\n"
+    "}"
+)
+BILL_RULES = (
+    "STRICT RULES:\n"
+    "- The JSON MUST be complete and MUST end with a closing brace '}'.\n"
+    "- NEVER cut off fields or values. If space is low, reduce description, not structure.\n"
+    "- category MUST be one of: [\"food\",\"groceries\",\"travel\",\"bills\",\"entertainment\",\"health\",\"education\",\"other\"]. If unclear use \"other\".\n"
+    "- payment_mode MUST be one of: [\"cash\", \"card\", \"upi\", \"netbanking\", \"wallet\"]. If unclear use \"cash\".\n"
+    "- legitimacy MUST be exactly \"verified\" or \"rejected\".\n"
+    "- legitimacy_report MUST include a confidence percentage + short reason.\n"
+    "- amount > 0 for payments, < 0 for refunds.\n"
+    "- Missing fields default to \"\" or 0.\n"
+    "- Output ONLY raw JSON.\n\n"
+)
 
 
 class LLM:
@@ -12,72 +65,124 @@ class LLM:
         self.api_key = api_key
         self.model = model
         self.max_tokens = max_tokens
-        self.endpoint = "https://api.perplexity.ai/chat/completions"
+        self.endpoint = PERPLEXITY_URL
+
+    def _call(self, prompt: str, **options):
+        """Returns (content, usage); `options` are passed to _payload."""
+        resp = get_session("llm").post(
+            self.endpoint, json=self._payload(prompt, **options), headers=self._headers(), timeout=timeout()
+        )
+        resp.raise_for_status()
+        return self._content(resp.json())
 
-    def _call(self, prompt: str) -> str:
+    def _content(self, data: dict):
+        choice = data["choices"][0]
+        usage = data.get("usage") or {}
+        return choice["message"]["content"].strip(), {
+            "prompt_tokens": usage.get("prompt_tokens"),
+            "completion_tokens": usage.get("completion_tokens"),
+            "total_tokens": usage.get("total_tokens"),
+            "finish_reason": choice.get("finish_reason"),
+        }
+
+    def _force_json(self, text: str) -> dict:
+        return IncrementalParser().feed(text).value()
+
+    def _payload(self, prompt: str, schema: dict = BILL_SCHEMA, max_tokens: int = None) -> dict:
         payload = {
             "model": self.model,
             "messages": [{"role": "user", "content": prompt}],
             "temperature": 0.1,
-            "max_tokens": self.max_tokens,
+            "max_tokens": max_tokens or self.max_tokens,
             "return_citations": False
         }
+        if LLM_JSON_SCHEMA:
+            payload["response_format"] = {"type": "json_schema", "json_schema": {"schema": schema}}
+        return payload
 
-        headers = {
+    def _headers(self) -> dict:
+        return {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
 
-        resp = requests.post(self.endpoint, json=payload, headers=headers, timeout=15)
-        resp.raise_for_status()
-        content = resp.json()["choices"][0]["message"]["content"]
-        return content.strip()
+    def extract_bill_info(self, bill_text: str, usage: dict = None) -> dict:
+        """
+        `usage`, if given, is filled with the call's token counts, latency and
+        whether the reply was cut off and recovered (truncated).
+        """
+        start = time.perf_counter()
+        raw, call_usage = self._call(self._bill_prompt(bill_text))
+        print(raw)
+        return self._finish(raw, call_usage, start, usage)
 
-    def _force_json(self, text: str) -> dict:
-        text = text.replace("```json", "").replace("```", "")
-        blocks = re.findall(r"\{[\s\S]*?\}", text)
+    def _finish(self, raw: str, call_usage: dict, start: float, usage: dict = None) -> dict:
+        parser = IncrementalParser().feed(raw)
+        parsed = parser.value()
+        if usage is not None:
+            usage.update(call_usage)
+            usage["seconds"] = round(time.perf_counter() - start, 3)
+            usage["truncated"] = parser.truncated
+        return self._normalise_bill(parsed)
 
-        for block in blocks:
-            try:
-                return json.loads(block)
-            except:
-                continue
-        return {}
+    def extract_bills_info(self, bill_texts, usage: dict = None) -> list:
+        """
+        Several bills in one call. Returns one normalised dict per bill, in
+        order, or None for a bill missing from the reply (including the last
+        one of a truncated reply). Raises ValueError if there is no "bills"
+        array at all. `usage` is filled as in extract_bill_info, for the whole call.
+        """
+        start = time.perf_counter()
+        raw, call_usage = self._call(
+            self._bills_prompt(bill_texts), schema=BATCH_SCHEMA, max_tokens=self.max_tokens * len(bill_texts)
+        )
+        return self._finish_bills(raw, call_usage, start, len(bill_texts), usage)
+
+    def _finish_bills(self, raw: str, call_usage: dict, start: float, count: int, usage: dict = None) -> list:
+        parser = IncrementalParser().feed(raw)
+        bills = parser.value().get("bills")
+        if not isinstance(bills, list):
+            raise ValueError("LLM batch reply has no bills array")
+        if parser.truncated:
+            bills = bills[:-1]
+        if usage is not None:
+            usage.update(call_usage)
+            usage["seconds"] = round(time.perf_counter() - start, 3)
+            usage["truncated"] = parser.truncated
 
+        results = [None] * count
+        for position, bill in enumerate(bills):
+            if not isinstance(bill, dict):
+                continue
+            number = bill.get("bill")
+            index = number - 1 if isinstance(number, int) and 0 < number <= len(results) else position
+            if index < len(results) and results[index] is None:
+                try:
+                    results[index] = self._normalise_bill(bill)
+                except (TypeError, ValueError):
+                    pass  # e.g. a non-numeric amount; that bill is retried on its own
+        return results
 
-    def extract_bill_info(self, bill_text: str) -> dict:
-        prompt = (
+    def _bill_prompt(self, bill_text: str) -> str:
+        return (
             "Extract structured data from the bill text and return ONLY a compact JSON with EXACTLY these keys:\n"
-            "{\n"
-            "  \"item_name\": \"\",\n"
-            "  \"amount\": 0,\n"
-            "  \"category\": \"\",\n"
-            "  \"payment_mode\": \"\",\n"
-            "  \"transaction_date\": \"\",\n"
-            "  \"vendor\": \"\",\n"
-            "  \"description\": \"\",\n"
-            "  \"tags\": \"\",\n"
-            "  \"legitimacy\": \"\",\n"
-            "  \"legitimacy_report\": \"\",\n"
-            "  \"gst_number\": \"\"\n"
-            "}\n\n"
-            "STRICT RULES:\n"
-            "- The JSON MUST be complete and MUST end with a closing brace '}'.\n"
-            "- NEVER cut off fields or values. If space is low, reduce description, not structure.\n"
-            "- category MUST be one of: [\"food\",\"groceries\",\"travel\",\"bills\",\"entertainment\",\"health\",\"education\",\"other\"]. If unclear use \"other\".\n"
-            "- payment_mode MUST be one of: [\"cash\", \"card\", \"upi\", \"netbanking\", \"wallet\"]. If unclear use \"cash\".\n"
-            "- legitimacy MUST be exactly \"verified\" or \"rejected\".\n"
-            "- legitimacy_report MUST include a confidence percentage + short reason.\n"
-            "- amount > 0 for payments, < 0 for refunds.\n"
-            "- Missing fields default to \"\" or 0.\n"
-            "- Output ONLY raw JSON.\n\n"
+            f"{BILL_KEYS}\n\n"
+            f"{BILL_RULES}"
             f"BILL TEXT:\n{bill_text}"
         )
 
-        raw = self._call(prompt)
-        print(raw)
-        parsed = self._force_json(raw)
+    def _bills_prompt(self, bill_texts) -> str:
+        bills = "\n\n".join(f"BILL {n}:\n{text}" for n, text in enumerate(bill_texts, start=1))
+        return (
+            f"Extract structured data from each of the {len(bill_texts)} bills below and return ONLY a compact JSON "
+            "{\"bills\": [...]} with one object per bill, in bill order. Each object has \"bill\" (the bill number) "
+            "and EXACTLY these keys:\n"
+            f"{BILL_KEYS}\n\n"
+            f"{BILL_RULES}"
+            f"{bills}"
+        )
 
+    def _normalise_bill(self, parsed: dict) -> dict:
         def get(k, default=""):
             return parsed[k] if k in parsed and parsed[k] not in [None, "null"] else default
 
@@ -0,0 +1,112 @@
+# llm_batch.py
+"""
+Batching of LLM bill extraction.
+
+Every extract_bill_info call re-sends the same ~1 KB of instructions. Here
+several bills share one extract_bills_info call that asks for a {"bills": [...]}
+array, and each caller gets its own bill back. A bill the reply does not cover
+(malformed or truncated reply, failed keys) comes back as None and the caller
+falls back to a single-bill call.
+
+Only bills from one /document/add_batch request share a call, so one
+user's bills and hints never end up in another user's prompt, and a single
+upload is sent straight away instead of waiting for company.
+
+    python llm_batch.py    # upstream calls and tokens per bill, single vs batched, against a stub
+"""
+import os
+
+LLM_BATCH_SIZE = int(os.getenv("LLM_BATCH_SIZE", 4))  # 1 disables batching
+
+_TOKEN_KEYS = ("prompt_tokens", "completion_tokens", "total_tokens")
+
+
+def extract_batch(client_for, prompt_texts, usages=None, keys=3):
+    """
+    One extract_bills_info call for every prompt text, trying clients
+    client_for(0..keys-1) in turn. Returns one normalised dict or None per bill.
+    Each answered bill's dict in `usages` gets its share of the call's tokens,
+    the batch size and the call's latency.
+    """
+    usage, results, errors = {}, [None] * len(prompt_texts), []
+    for i in range(keys):
+        try:
+            results = client_for(i).extract_bills_info(prompt_texts, usage=usage)
+            break
+        except Exception as e:
+            errors.append(f"key index {i}: {e}")
+            usage = {}
+
+    size = len(prompt_texts)
+    for bill_usage, result in zip(usages or [], results):
+        if bill_usage is None:
+            continue
+        if result is None:
+            if errors:
+                bill_usage["batch_errors"] = errors
+            continue
+        bill_usage.update({k: v for k, v in usage.items() if k not in _TOKEN_KEYS})
+        for key in _TOKEN_KEYS:
+            if usage.get(key) is not None:
+                bill_usage[key] = round(usage[key] / size, 1)
+        bill_usage["batch_size"] = size
+    return results
+
+
+if __name__ == "__main__":
+    import json
+    import threading
+    import time
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    from llm import LLM
+
+    DELAY = 0.2  # simulated upstream latency per call
+    calls = []
+
+    class Stub(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            prompt = json.loads(self.rfile.read(int(self.headers["Content-Length"])))["messages"][0]["content"]
+            calls.append(len(prompt))
+            time.sleep(DELAY)
+            bill = {"item_name": "Tea", "amount": 120, "category": "food", "gst_number": ""}
+            count = prompt.count("\nBILL ") if '{"bills"' in prompt else 0
+            content = {"bills": [{"bill": n, **bill} for n in range(1, count + 1)]} if count else bill
+            body = json.dumps({
+                "choices": [{"message": {"content": json.dumps(content)}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": 60 * max(count, 1)},
+            }).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Stub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = LLM(api_key="stub")
+    client.endpoint = f"http://127.0.0.1:{server.server_address[1]}/"
+    bills = [f"USER HINTS:\n- Vendor: Cafe {n}\n\nEXTRACTED BILL TEXT:\nTea 120.00\nTotal 120.00" for n in range(16)]
+
+    def report(name, run):
+        calls.clear()
+        usages = [{} for _ in bills]
+        start = time.perf_counter()
+        results = run(usages)
+        elapsed = time.perf_counter() - start
+        tokens = sum(u.get("prompt_tokens") or 0 for u in usages) / len(bills)
+        print(f"{name:<10} {len(calls):>3} calls  {sum(calls) / len(bills):>7.0f} prompt chars/bill  "
+              f"{tokens:>6.1f} prompt tokens/bill  {elapsed:.2f} s  {sum(r is None for r in results)} unanswered")
+
+    def batched(usages):
+        return [result for n in range(0, len(bills), LLM_BATCH_SIZE)
+                for result in extract_batch(lambda i: client, bills[n:n + LLM_BATCH_SIZE], usages[n:n + LLM_BATCH_SIZE])]
+
+    report("single", lambda usages: [client.extract_bill_info(b, usage=u) for b, u in zip(bills, usages)])
+    report("batched", batched)
+    server.shutdown()
@@ -0,0 +1,155 @@
+# migrations.py
+"""
+In-place upgrades for existing database.db files.
+
+db.create_all() only creates missing tables, so columns and indexes added to
+existing tables are applied here. The applied version lives in SQLite's
+PRAGMA user_version. Every step is idempotent, because a fresh database
+already has the current schema from create_all() but still starts at version 0.
+
+    python migrations.py     # upgrade database.db and check the hot query plans
+"""
+import datetime
+
+from sqlalchemy import MetaData, inspect, select, desc, tuple_
+from sqlalchemy.schema import CreateTable
+
+import income
+import rollups
+from model import db, Transaction, Document, Job
+
+
+def _document_transaction_nullable(conn):
+    """Document.transaction_id became nullable for queued uploads (SQLite needs a table rebuild)."""
+    cols = {c["name"]: c for c in inspect(conn).get_columns("document")}
+    if cols["transaction_id"]["nullable"]:
+        return
+
+    md = MetaData()
+    for table in db.metadata.sorted_tables:
+        table.to_metadata(md)
+    new_table = Document.__table__.to_metadata(md, name="document_new")
+    names = ", ".join(f'"{c}"' for c in cols)
+
+    conn.execute(CreateTable(new_table))
+    conn.exec_driver_sql(f"INSERT INTO document_new ({names}) SELECT {names} FROM document")
+    conn.exec_driver_sql("DROP TABLE document")
+    conn.exec_driver_sql("ALTER TABLE document_new RENAME TO document")
+
+
+def _transaction_category_normalised(conn):
+    cols = {c["name"] for c in inspect(conn).get_columns("transaction")}
+    if "category_normalised" not in cols:
+        conn.exec_driver_sql('ALTER TABLE "transaction" ADD COLUMN category_normalised VARCHAR(50)')
+    conn.exec_driver_sql(
+        'UPDATE "transaction" SET category_normalised = lower(category) WHERE category_normalised IS NULL'
+    )
+
+
+def _create_indexes(conn):
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+def _backfill_rollups(conn):
+    rollups.rebuild(conn)
+
+
+def _itr_batch_assessment_year(conn):
+    if not inspect(conn).has_table("itr_batch"):
+        return  # created by create_all with the column
+    cols = {c["name"] for c in inspect(conn).get_columns("itr_batch")}
+    if "assessment_year" not in cols:
+        conn.exec_driver_sql("ALTER TABLE itr_batch ADD COLUMN assessment_year INTEGER")
+
+
+def _content_cache_hint_blind_llm(conn):
+    """LLM output used to be cached per file, whoever uploaded it with whatever hints; drop it."""
+    if inspect(conn).has_table("content_cache"):
+        conn.exec_driver_sql("UPDATE content_cache SET llm_json = NULL, llm_hits = 0")
+
+
+# (version, step) in order; append new steps, never renumber applied ones
+MIGRATIONS = [
+    (1, _document_transaction_nullable),
+    (2, _transaction_category_normalised),
+    (3, _create_indexes),
+    (4, _backfill_rollups),
+    (5, _itr_batch_assessment_year),
+    (6, _content_cache_hint_blind_llm),
+]
+
+
+def current_version(conn):
+    return conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def upgrade():
+    """
+    Bring the bound database up to the latest version. Call after db.create_all().
+    Returns None on a server database: create_all() builds it with the current
+    schema and these steps only patch old SQLite files.
+    """
+    if db.engine.dialect.name != "sqlite":
+        return None
+    with db.engine.begin() as conn:
+        version = current_version(conn)
+        for target, step in MIGRATIONS:
+            if target <= version:
+                continue
+            step(conn)
+            conn.exec_driver_sql(f"PRAGMA user_version = {int(target)}")
+            version = target
+    return version
+
+
+def hot_queries(user_id=1):
+    """The listing/worker queries that must stay index-backed as tables grow."""
+    by_user = select(Transaction).where(Transaction.user_id == user_id)
+    return {
+        "transactions by created_at": by_user.order_by(desc(Transaction.created_at)),
+        "transactions by transaction_date": by_user.order_by(desc(Transaction.transaction_date)),
+        "transactions by category": by_user.where(Transaction.category_normalised == "food"),
+        "transactions after a cursor": (
+            by_user.where(tuple_(Transaction.created_at, Transaction.id) < tuple_(datetime.datetime(2024, 1, 1), 100))
+            .order_by(desc(Transaction.created_at), desc(Transaction.id))
+        ),
+        "documents for a page": select(Document).where(Document.transaction_id.in_([1, 2, 3])),
+        "documents by uploaded_at": (
+            select(Document).where(Document.user_id == user_id).order_by(desc(Document.uploaded_at))
+        ),
+        "document download owner check": (
+            select(Document.id).where(Document.user_id == user_id, Document.file_name == "x.pdf")
+        ),
+        "ITR income totals": income.totals_query([user_id], assessment_year=2025),
+        "next queued job": select(Job).where(Job.status == "queued").order_by(Job.created_at),
+    }
+
+
+def full_scans():
+    """EXPLAIN QUERY PLAN each hot query; returns {name: plan} for those that scan a table."""
+    bad = {}
+    with db.engine.connect() as conn:
+        for name, query in hot_queries().items():
+            compiled = query.compile(conn, compile_kwargs={"literal_binds": True})
+            plan = [row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}")]
+            if any(step.startswith("SCAN") and "USING" not in step for step in plan):
+                bad[name] = plan
+    return bad
+
+
+if __name__ == "__main__":
+    from app import create_app
+
+    app = create_app()
+
+    with app.app_context():
+        db.create_all()
+        print(f"database at version {upgrade()}")
+        scans = full_scans()
+        for name, plan in scans.items():
+            print(f"FULL SCAN in {name}: {plan}")
+        if scans:
+            raise SystemExit(1)
+        print("all hot queries use an index")
@@ -1,4 +1,5 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.orm import validates
 import datetime
 
 db = SQLAlchemy()
@@ -42,14 +43,29 @@ class Transaction(db.Model):
     description = db.Column(db.Text, nullable=True)
     tags = db.Column(db.String(255), nullable=True)
 
+    # lower(category), kept in sync below so the category filter can use an index
+    category_normalised = db.Column(db.String(50), nullable=True)
+
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
 
+    __table_args__ = (
+        db.Index("ix_transaction_user_created", "user_id", "created_at"),
+        db.Index("ix_transaction_user_date", "user_id", "transaction_date"),
+        db.Index("ix_transaction_user_category", "user_id", "category_normalised"),
+    )
+
+    @validates("category")
+    def _normalise_category(self, key, value):
+        self.category_normalised = value.lower() if value else value
+        return value
+
 class Document(db.Model):
     id = db.Column(db.Integer, primary_key=True)
 
     # Required links
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    transaction_id = db.Column(db.Integer, db.ForeignKey('transaction.id'), nullable=False)
+    # Empty while an uploaded document is still queued for processing
+    transaction_id = db.Column(db.Integer, db.ForeignKey('transaction.id'), nullable=True)
 
     # File info
     file_name = db.Column(db.String(255), nullable=False)   
@@ -60,7 +76,111 @@ class Document(db.Model):
     category = db.Column(db.String(80), nullable=True)
     notes = db.Column(db.Text, nullable=True)
 
-    # Status: pending, verified, rejected
+    # Status: pending, verified, rejected, failed
     status = db.Column(db.String(20), nullable=False, default="pending")
     
     uploaded_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        db.Index("ix_document_transaction", "transaction_id"),
+        db.Index("ix_document_user_uploaded", "user_id", "uploaded_at"),
+    )
+
+class Job(db.Model):
+    # Background processing of an uploaded Document (see jobs.py)
+    id = db.Column(db.String(36), primary_key=True)
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    document_id = db.Column(db.Integer, db.ForeignKey('document.id'), nullable=False)
+
+    # Status: queued, running, done, failed
+    status = db.Column(db.String(20), nullable=False, default="queued")
+    stage = db.Column(db.String(20), nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+
+    # JSON blobs: user hints in, response payload / error out, seconds per stage
+    hints = db.Column(db.Text, nullable=True)
+    result = db.Column(db.Text, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    timings = db.Column(db.Text, nullable=True)
+
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index("ix_job_status_created", "status", "created_at"),
+    )
+
+class ContentCache(db.Model):
+    # OCR text keyed by the SHA-256 of the uploaded file, LLM output by content_cache.llm_key
+    sha256 = db.Column(db.String(64), primary_key=True)
+
+    ocr_text = db.Column(db.Text, nullable=True)
+    llm_json = db.Column(db.Text, nullable=True)
+    llm_hits = db.Column(db.Integer, nullable=False, default=0)
+
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)  # last write; CONTENT_CACHE_TTL_DAYS counts from it
+    last_used_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        db.Index("ix_content_cache_last_used", "last_used_at"),
+    )
+
+class TransactionRollup(db.Model):
+    # Per user/month/category/payment-mode running totals, maintained on write (see rollups.py)
+    id = db.Column(db.Integer, primary_key=True)
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    month = db.Column(db.String(7), nullable=False)  # YYYY-MM of transaction_date
+    category = db.Column(db.String(50), nullable=False)  # category_normalised
+    payment_mode = db.Column(db.String(50), nullable=False)
+
+    income = db.Column(db.Float, nullable=False, default=0)   # sum of amounts > 0
+    expense = db.Column(db.Float, nullable=False, default=0)  # sum of amounts < 0
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index("ux_rollup_key", "user_id", "month", "category", "payment_mode", unique=True),
+    )
+
+class GstinCache(db.Model):
+    # KnowYourGST answers per GSTIN, including "invalid" ones (see gst_cache.py)
+    gstin = db.Column(db.String(15), primary_key=True)
+
+    valid = db.Column(db.Boolean, nullable=False)
+    result = db.Column(db.Text, nullable=True)  # JSON returned by KnowYourGST
+
+    fetched_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+class FirmClient(db.Model):
+    # Users a firm may file ITRs for (itr_batch.allowed_user_ids). Granted by an
+    # operator with `python itr_batch.py --grant FIRM_ID ...`; no API route writes it.
+    firm_user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    client_user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+class ItrBatch(db.Model):
+    # Bulk ITR generation for many users into one ZIP (see itr_batch.py)
+    id = db.Column(db.String(36), primary_key=True)
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # who requested it
+
+    # Status: queued, running, done, failed
+    status = db.Column(db.String(20), nullable=False, default="queued")
+    total = db.Column(db.Integer, nullable=False, default=0)
+    done = db.Column(db.Integer, nullable=False, default=0)
+    failed = db.Column(db.Integer, nullable=False, default=0)
+
+    # JSON blobs: user ids in, one {user_id, file, seconds} / {user_id, error} per finished user out
+    user_ids = db.Column(db.Text, nullable=False)
+    assessment_year = db.Column(db.Integer, nullable=True)  # None: every transaction
+    results = db.Column(db.Text, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    zip_path = db.Column(db.String(500), nullable=True)
+
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
@@ -1,29 +1,133 @@
-import pytesseract
-from PIL import Image
-from pdf2image import convert_from_path
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
+import lazy
+
+
+def _tesseract_cmd(module):
+    module.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
+
+
+pytesseract = lazy.module("pytesseract", on_load=_tesseract_cmd)
+Image = lazy.module("PIL.Image")
+pdf2image = lazy.module("pdf2image")
 
 POPPLER_PATH = r"C:\Program Files\poppler\Library\bin"
 
+# Tesseract is CPU-bound, so batch OCR fans out over processes, not threads
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", os.cpu_count() or 1))
+
+# PDFs are rasterised this many pages at a time, so memory no longer grows with page count
+PDF_CHUNK_PAGES = int(os.getenv("PDF_CHUNK_PAGES", 4))
+PDF_DPI = 300
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
 def ocr_image(path):
     img = Image.open(path)
     text = pytesseract.image_to_string(img)
     return text
 
 
-def ocr_pdf(path):
-    pages = convert_from_path(path, dpi=300, poppler_path=POPPLER_PATH)
-    text_output = ""
-    for p in pages:
-        text_output += pytesseract.image_to_string(p) + "\n"
-    return text_output
+def ocr_pdf_pages(path, first_page, last_page):
+    pages = pdf2image.convert_from_path(
+        path, dpi=PDF_DPI, first_page=first_page, last_page=last_page, poppler_path=POPPLER_PATH
+    )
+    return [pytesseract.image_to_string(p) for p in pages]
+
+
+def ocr_pdf(path, chunk_pages=PDF_CHUNK_PAGES, parallel=None, stop_when=None):
+    """
+    OCR a PDF `chunk_pages` pages at a time and return the text in page order.
+
+    With `parallel`, chunks are rasterised and OCR'd inside the pool workers and
+    at most OCR_WORKERS chunks are in flight, so resident memory is capped at
+    roughly OCR_WORKERS * chunk_pages page images. It defaults to on, except
+    inside a pool worker (batch uploads) where it would nest pools.
+    `stop_when(text_so_far)` returning True skips the remaining pages.
+    """
+    page_count = pdf2image.pdfinfo_from_path(path, poppler_path=POPPLER_PATH)["Pages"]
+    chunks = deque(
+        (first, min(first + chunk_pages - 1, page_count))
+        for first in range(1, page_count + 1, chunk_pages)
+    )
+    if parallel is None:
+        parallel = len(chunks) > 1 and multiprocessing.parent_process() is None
+
+    texts = []
+    if not parallel:
+        while chunks:
+            texts.extend(ocr_pdf_pages(path, *chunks.popleft()))
+            if stop_when and stop_when(_join_pages(texts)):
+                break
+        return _join_pages(texts)
 
+    pool = get_pool()
+    in_flight = deque()
+    while chunks and len(in_flight) < OCR_WORKERS:
+        in_flight.append(pool.submit(_pool_call, ocr_pdf_pages, path, *chunks.popleft()))
+    while in_flight:
+        texts.extend(in_flight.popleft().result())
+        if stop_when and stop_when(_join_pages(texts)):
+            for fut in in_flight:
+                fut.cancel()
+            break
+        if chunks:
+            in_flight.append(pool.submit(_pool_call, ocr_pdf_pages, path, *chunks.popleft()))
+    return _join_pages(texts)
 
-def extract(file_path):
+
+def _join_pages(texts):
+    return "".join(t + "\n" for t in texts)
+
+
+def extract(file_path, stop_when=None):
     if file_path.lower().endswith(".pdf"):
-        text = ocr_pdf(file_path)
+        text = ocr_pdf(file_path, stop_when=stop_when)
     else:
         text = ocr_image(file_path)
 
-    return text
\ No newline at end of file
+    return text
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=OCR_WORKERS)
+    return _pool
+
+
+def _pool_call(fn, *args):
+    try:
+        return fn(*args)
+    except Exception as e:
+        # pytesseract's exceptions don't survive pickling and would break the pool
+        raise RuntimeError(f"{type(e).__name__}: {e}") from None
+
+
+def _timed_extract(file_path, stop_when=None):
+    start = time.perf_counter()
+    text = _pool_call(extract, file_path, stop_when)
+    return text, time.perf_counter() - start
+
+
+def extract_many(file_paths, stop_when=None):
+    """
+    OCR several files in the process pool. Yields (file_path, text, seconds, error)
+    in completion order, so callers can act on fast files without waiting for slow ones.
+    `stop_when` is passed to ocr_pdf, so it must be a picklable module-level function.
+    """
+    futures = {get_pool().submit(_timed_extract, p, stop_when): p for p in file_paths}
+    for fut in as_completed(futures):
+        try:
+            text, seconds = fut.result()
+            yield futures[fut], text, seconds, None
+        except Exception as e:
+            yield futures[fut], None, None, e
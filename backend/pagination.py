@@ -0,0 +1,55 @@
+# pagination.py
+"""
+Keyset ("cursor") pagination. The cursor is an opaque token holding the sort
+value and id of the last row returned; the next page continues strictly after
+that pair, so every page costs one indexed range scan instead of OFFSET + COUNT.
+"""
+import base64
+import datetime
+import json
+
+from sqlalchemy import asc, desc, tuple_
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(value, row_id):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        value = value.isoformat()
+    raw = json.dumps([value, row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor, sort_col):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        value, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        python_type = sort_col.type.python_type
+        if python_type in (datetime.date, datetime.datetime):
+            value = python_type.fromisoformat(value)
+        return value, int(row_id)
+    except Exception:
+        raise InvalidCursor("Invalid cursor")
+
+
+def keyset_page(query, sort_col, id_col, descending, cursor, limit):
+    """
+    Return (rows, next_cursor) for the page after `cursor` ("" or None for the
+    first page). next_cursor is None on the last page.
+    """
+    if cursor:
+        value, row_id = decode_cursor(cursor, sort_col)
+        after = tuple_(sort_col, id_col) < tuple_(value, row_id) if descending \
+            else tuple_(sort_col, id_col) > tuple_(value, row_id)
+        query = query.filter(after)
+
+    direction = desc if descending else asc
+    rows = query.order_by(direction(sort_col), direction(id_col)).limit(limit + 1).all()
+
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(getattr(last, sort_col.key), getattr(last, id_col.key))
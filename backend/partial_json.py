@@ -0,0 +1,144 @@
+# partial_json.py
+"""
+Tolerant JSON-object recovery for LLM output.
+
+The model is asked for raw JSON but may wrap it in ```json fences or prose,
+nest objects, or stop mid-value when it hits max_tokens. IncrementalParser
+scans text as it arrives (feed() any number of chunks) and tracks the last
+point where the outermost object was still well-formed, so value() can close
+whatever is open and return every complete field seen so far.
+
+    parse('```json {"a": {"b": 1}, "c": "trunc')  ->  {"a": {"b": 1}}
+"""
+import json
+
+_CLOSERS = {"{": "}", "[": "]"}
+_SCALAR_END = set(",}] \t\r\n")
+
+
+class IncrementalParser:
+    def __init__(self):
+        self.buf = []         # characters of the current candidate object
+        self.stack = []       # open containers: "{" or "["
+        self.expect = []      # per open container: "key" / "colon" / "value" / "comma"
+        self.in_string = False
+        self.escape = False
+        self.scalar = False   # inside a number / true / false / null
+        self.safe = None      # (length of buf, closers) at the last well-formed point
+        self.complete = None  # first complete object parsed
+        self.truncated = False
+
+    def feed(self, chunk):
+        for ch in chunk:
+            if self.complete is not None:
+                return self
+            self._step(ch)
+        return self
+
+    def _mark_safe(self):
+        closers = "".join(_CLOSERS[c] for c in reversed(self.stack))
+        self.safe = (len(self.buf), closers)
+
+    def _value_done(self):
+        if self.expect:
+            self.expect[-1] = "comma"
+        self._mark_safe()
+
+    def _reset(self):
+        self.buf, self.stack, self.expect = [], [], []
+        self.in_string = self.escape = self.scalar = False
+        self.safe = None
+
+    def _step(self, ch):
+        if not self.stack:
+            if ch == "{":
+                self.buf, self.stack, self.expect = ["{"], ["{"], ["key"]
+                self._mark_safe()
+            return
+
+        if self.in_string:
+            self.buf.append(ch)
+            if self.escape:
+                self.escape = False
+            elif ch == "\\":
+                self.escape = True
+            elif ch == '"':
+                self.in_string = False
+                if self.expect[-1] == "key":
+                    self.expect[-1] = "colon"
+                else:
+                    self._value_done()
+            return
+
+        if self.scalar:
+            if ch not in _SCALAR_END:
+                self.buf.append(ch)
+                return
+            self.scalar = False
+            self._value_done()
+
+        if ch in " \t\r\n":
+            self.buf.append(ch)
+            return
+
+        state = self.expect[-1]
+        if ch == '"' and state in ("key", "value"):
+            self.in_string = True
+            self.buf.append(ch)
+        elif ch == ":" and state == "colon":
+            self.expect[-1] = "value"
+            self.buf.append(ch)
+        elif ch == "," and state == "comma":
+            self.expect[-1] = "key" if self.stack[-1] == "{" else "value"
+            self.buf.append(ch)
+        elif ch in "{[" and state == "value":
+            self.buf.append(ch)
+            self.stack.append(ch)
+            self.expect.append("key" if ch == "{" else "value")
+            self._mark_safe()
+        elif ch in "}]" and _CLOSERS[self.stack[-1]] == ch and state in ("comma", "key", "value"):
+            if state != "comma":
+                # empty container, or a trailing comma the model left in: drop it
+                while self.buf[-1] in " \t\r\n,":
+                    self.buf.pop()
+            self.buf.append(ch)
+            self.stack.pop()
+            self.expect.pop()
+            if not self.stack:
+                self._finish()
+            else:
+                self._value_done()
+        elif state == "value" and (ch.isdigit() or ch in "-tfn"):
+            self.scalar = True
+            self.buf.append(ch)
+        else:
+            # not JSON after all (prose with a stray brace); look for the next object
+            self._reset()
+            if ch == "{":
+                self._step(ch)
+
+    def _finish(self):
+        try:
+            self.complete = json.loads("".join(self.buf), strict=False)
+        except ValueError:
+            self._reset()
+
+    def value(self):
+        """The first complete object, else everything well-formed so far closed off (truncated=True), else {}."""
+        if self.complete is not None:
+            return self.complete if isinstance(self.complete, dict) else {}
+        if self.safe is None:
+            return {}
+        length, closers = self.safe
+        text = "".join(self.buf[:length]).rstrip().rstrip(",") + closers
+        try:
+            recovered = json.loads(text, strict=False)
+        except ValueError:
+            return {}
+        self.truncated = True
+        return recovered if isinstance(recovered, dict) else {}
+
+
+def parse(text):
+    """Best-effort dict from LLM output; see IncrementalParser.value()."""
+    return IncrementalParser().feed(text).value()
@@ -0,0 +1,390 @@
+# pipeline.py
+"""
+Bill processing stages shared by the synchronous /document/add route and the
+background job workers: save -> OCR -> LLM extraction -> GST lookup -> persist.
+"""
+import functools
+import hashlib
+import os
+import re
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask import current_app
+
+import content_cache
+import llm_batch
+import receipt_rules
+import rollups
+from bill_text import trim_ocr
+from model import db, Document, Transaction
+from llm import LLM
+from ocr import extract
+import gst_cache
+
+ALLOWED_EXTENSIONS = {"pdf", "png", "jpg", "jpeg", "webp"}
+# stop OCR'ing a PDF once the pages so far hold a labelled total, a date and a GSTIN
+OCR_STOP_EARLY = os.getenv("OCR_STOP_EARLY", "1") == "1"
+_SHA256_NAME = re.compile(r"[0-9a-f]{64}")
+
+
+class PipelineError(Exception):
+    def __init__(self, error, details="", status=500):
+        super().__init__(error)
+        self.error = error
+        self.details = details
+        self.status = status
+
+    def to_dict(self):
+        return {"error": self.error, "details": self.details}
+
+
+def safe_float(v, default=0.0):
+    try:
+        return float(v)
+    except Exception:
+        return default
+
+
+def upload_folder():
+    folder = os.path.join(os.getcwd(), "documents")
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def file_extension(filename):
+    ext = filename.rsplit(".", 1)[-1].lower()
+    if ext not in ALLOWED_EXTENSIONS:
+        raise PipelineError("Unsupported file format", status=400)
+    return ext
+
+
+def save_upload(file):
+    """
+    Store an uploaded werkzeug FileStorage as documents/<sha256>.<ext>.
+    Identical uploads share one file on disk. Returns (new_filename, file_path).
+    """
+    if file.filename == "":
+        raise PipelineError("Invalid file name", status=400)
+    ext = file_extension(file.filename)
+
+    folder = upload_folder()
+    tmp_path = os.path.join(folder, f".upload-{os.getpid()}-{id(file)}.{ext}")
+    try:
+        sha = hashlib.sha256()
+        with open(tmp_path, "wb") as out:
+            for chunk in iter(lambda: file.stream.read(64 * 1024), b""):
+                sha.update(chunk)
+                out.write(chunk)
+        new_filename = f"{sha.hexdigest()}.{ext}"
+        file_path = os.path.join(folder, new_filename)
+        if os.path.exists(file_path):
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, file_path)
+    except Exception as e:
+        current_app.logger.exception("Failed to save uploaded file")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise PipelineError("Failed to save file", str(e))
+    return new_filename, file_path
+
+
+def content_etag(file_path):
+    """
+    sha256 hex of a stored document. save_upload names files by it; files kept
+    from before that are hashed once per (path, mtime, size).
+    """
+    stem = os.path.basename(file_path).rsplit(".", 1)[0]
+    if _SHA256_NAME.fullmatch(stem):
+        return stem
+    st = os.stat(file_path)
+    return _file_sha256(file_path, st.st_mtime_ns, st.st_size)
+
+
+@functools.lru_cache(maxsize=4096)
+def _file_sha256(file_path, mtime_ns, size):
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+@contextmanager
+def timed(timings, stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[stage] = round(time.perf_counter() - start, 3)
+
+
+def ocr_stop_when():
+    """ocr.ocr_pdf's stop_when for bills: receipt_rules.fields_found, unless OCR_STOP_EARLY=0."""
+    return receipt_rules.fields_found if OCR_STOP_EARLY else None
+
+
+def run_ocr(file_path):
+    try:
+        return extract(file_path, stop_when=ocr_stop_when())
+    except Exception as e:
+        current_app.logger.exception("OCR failed")
+        raise PipelineError("OCR failed", str(e))
+
+
+_llm_clients = {}
+
+
+def llm_client(index):
+    """One LLM client per PERPLEX_API_<n> key, reused across requests."""
+    client = _llm_clients.get(index)
+    if client is None:
+        client = _llm_clients.setdefault(index, LLM(api_key=os.getenv(f"PERPLEX_API_{index+1}")))
+    return client
+
+
+def hinted_text(extracted_text, hints):
+    """OCR text, trimmed to OCR_TOKEN_BUDGET, prefixed with the user's upload hints, as sent to the LLM."""
+    return (
+        f"USER HINTS:\n"
+        f"- Vendor: {hints.get('vendor', '')}\n"
+        f"- Category: {hints.get('category', '')}\n"
+        f"- Notes: {hints.get('notes', '')}\n\n"
+        f"EXTRACTED BILL TEXT:\n{trim_ocr(extracted_text)}"
+    )
+
+
+def _prompt_sizes(extracted_text, prompt_text, usage):
+    if usage is not None:
+        usage["ocr_chars"] = len(extracted_text or "")
+        usage["sent_chars"] = len(prompt_text)
+
+
+def run_llm(extracted_text, hints, usage=None):
+    """`usage` is filled as in LLM.extract_bill_info, plus the OCR / prompt sizes."""
+    combined_prompt_text = hinted_text(extracted_text, hints)
+    _prompt_sizes(extracted_text, combined_prompt_text, usage)
+
+    # Try several API keys (if configured) to extract using LLM
+    last_exception = None
+    for i in range(3):
+        try:
+            llm_data = llm_client(i).extract_bill_info(combined_prompt_text, usage=usage)
+            print(llm_data)
+            current_app.logger.info(f"LLM usage (key index {i}): {usage}")
+            return llm_data
+        except Exception as e:
+            last_exception = e
+            current_app.logger.exception(f"LLM call failed for key index {i}")
+            continue
+
+    raise PipelineError("LLM extraction failed", str(last_exception))
+
+
+def prefetch_rules(user_id, new_filename, extracted_text, hints):
+    """
+    The llm stage of one batch-upload file, short of calling the LLM. Returns
+    None when content_cache already has the output, else (llm_data, llm_usage)
+    to pass to process_document as `prefetched`; llm_data is None when
+    receipt_rules could not read the bill and it needs the LLM (prefetch_llm).
+    """
+    if content_cache.has_llm(content_cache.llm_key(content_cache.content_hash(new_filename), user_id, hints)):
+        return None
+    usage = {"cached": False}
+    return receipt_rules.confident_bill(extracted_text, hints, usage=usage), usage
+
+
+def prefetch_llm(items, hints):
+    """
+    One batched LLM call for the (new_filename, extracted_text, llm_usage)
+    bills prefetch_rules left to the LLM, all from one request. Returns
+    {new_filename: (llm_data, llm_usage)} to pass to process_document as
+    `prefetched`; llm_data is None for bills the batch reply missed (or a lone
+    bill), which then get a call of their own.
+    """
+    found = {name: (None, usage) for name, _, usage in items}
+    if len(items) > 1:
+        prompt_texts = []
+        for _, text, usage in items:
+            prompt_texts.append(hinted_text(text, hints))
+            _prompt_sizes(text, prompt_texts[-1], usage)
+        results = llm_batch.extract_batch(llm_client, prompt_texts, [usage for _, _, usage in items])
+        for (name, _, usage), llm_data in zip(items, results):
+            found[name] = (llm_data, usage)
+    return found
+
+
+def normalise(llm_data, hints):
+    """Apply safe defaults to the LLM output and parse the transaction date."""
+    tx_date_raw = llm_data.get("transaction_date", "")
+    try:
+        tx_date = datetime.strptime(tx_date_raw, "%Y-%m-%d").date()
+    except Exception:
+        try:
+            # try common alternate formats
+            tx_date = datetime.strptime(tx_date_raw, "%d-%m-%Y").date()
+        except Exception:
+            tx_date = datetime.utcnow().date()
+
+    return {
+        "item_name": llm_data.get("item_name", "") or "Unknown Item",
+        "amount": safe_float(-llm_data.get("amount", 0)),
+        "category": (llm_data.get("category") or hints.get("category") or "Uncategorized"),
+        "payment_mode": llm_data.get("payment_mode", "") or "Unknown",
+        "transaction_date": tx_date,
+        "vendor": llm_data.get("vendor") or hints.get("vendor") or "",
+        "description": llm_data.get("description", "") or "",
+        "tags": llm_data.get("tags", "") or "",
+        "legitimacy": llm_data.get("legitimacy", "verified"),
+        "legitimacy_report": llm_data.get("legitimacy_report", ""),
+        "gst_number": (llm_data.get("gst_number") or "").strip(),
+    }
+
+
+def lookup_gst(gstin):
+    if not gstin:
+        return None
+    try:
+        gst_response = gst_cache.lookup(gstin)
+    except Exception:
+        current_app.logger.exception("GST lookup failed")
+        return None
+    return gst_details(gst_response)
+
+
+def gst_details(gst_response):
+    """Flatten a GST lookup response into the gst_details payload."""
+    result_data = gst_response.get("result") or {}
+    # map known fields (adjust keys depending on gst_check response shape)
+    pradr = result_data.get("pradr", {}) or {}
+    addr = (pradr.get("addr") or {}) if isinstance(pradr, dict) else {}
+    return {
+        "legal_name": result_data.get("lgnm", "") or "",
+        "trade_name": result_data.get("tradeNam", "") or "",
+        "status": result_data.get("sts", "") or "",
+        "address": addr.get("bnm", "") or addr.get("addr1", "") or "",
+        "state": result_data.get("stj", "") or "",
+        "district": result_data.get("dst", "") or "",
+        "pincode": addr.get("pncd", "") or "",
+        "constitution": result_data.get("ctb", "") or "",
+        "pan": result_data.get("pan", "") or "",
+        "registration_date": result_data.get("rgdt", "") or "",
+        "last_updated": result_data.get("lstupdt", "") or "",
+        "raw": result_data
+    }
+
+
+def persist(user_id, new_filename, fields, hints, document=None):
+    """
+    Create the Transaction and link the Document to it. A pending Document
+    created by /document/upload is updated in place instead of duplicated.
+    """
+    try:
+        new_tx = Transaction(
+            user_id=user_id,
+            item_name=fields["item_name"],
+            amount=fields["amount"],
+            category=fields["category"],
+            payment_mode=fields["payment_mode"],
+            transaction_date=fields["transaction_date"],
+            vendor=fields["vendor"],
+            description=fields["description"],
+            tags=fields["tags"]
+        )
+        db.session.add(new_tx)
+        db.session.flush()  # get new_tx.id
+        rollups.apply([new_tx])
+
+        # "unverified" (receipt_rules) stays pending until someone checks it
+        legitimacy = str(fields["legitimacy"]).lower()
+        status = legitimacy if legitimacy in ("verified", "rejected") else "pending"
+
+        doc = document or Document(
+            user_id=user_id,
+            file_name=new_filename,
+            file_url=f"/documents/{new_filename}",
+            notes=hints.get("notes", ""),
+        )
+        doc.transaction_id = new_tx.id
+        doc.vendor_name = fields["vendor"]
+        doc.category = fields["category"]
+        doc.status = status
+
+        db.session.add(doc)
+        db.session.commit()
+        return new_tx, doc
+    except Exception as e:
+        current_app.logger.exception("Failed to create DB records")
+        db.session.rollback()
+        raise PipelineError("Failed to persist records", str(e))
+
+
+def process_document(user_id, new_filename, file_path, hints, document=None,
+                     timings=None, on_stage=None, extracted_text=None, prefetched=None):
+    """
+    Run every stage for one stored upload and return the /document/add payload.
+    `timings` collects seconds spent per stage; `on_stage` is called with the
+    stage name before it starts (used by the job workers for progress).
+    Pass `extracted_text` when OCR already ran elsewhere (batch uploads).
+    OCR text and LLM output are reused from content_cache for repeat uploads;
+    receipts receipt_rules reads confidently skip the LLM (llm_usage["rules"]).
+    `prefetched` is this file's entry from prefetch_rules / prefetch_llm;
+    without it the bill gets an LLM call of its own.
+    The payload's `llm_usage` has the token counts and latency of the LLM call.
+    """
+    def stage(name):
+        if on_stage:
+            on_stage(name)
+        return timed(timings, name)
+
+    digest = content_cache.content_hash(new_filename)
+
+    if extracted_text is None:
+        with stage("ocr"):
+            extracted_text = content_cache.get_ocr(digest)
+            if extracted_text is None:
+                extracted_text = run_ocr(file_path)
+                content_cache.put_ocr(digest, extracted_text)
+    llm_usage = {"cached": True}
+    cache_key = content_cache.llm_key(digest, user_id, hints)
+    with stage("llm"):
+        llm_data = content_cache.get_llm(cache_key)
+        if llm_data is None:
+            llm_data, llm_usage = prefetched or (None, {"cached": False})
+            if llm_data is None and "rules" not in llm_usage:
+                llm_data = receipt_rules.confident_bill(extracted_text, hints, usage=llm_usage)
+            if llm_data is None:
+                llm_data = run_llm(extracted_text, hints, usage=llm_usage)
+            if not llm_usage.get("rules"):
+                content_cache.put_llm(cache_key, llm_data)
+    fields = normalise(llm_data, hints)
+    with stage("gst"):
+        gst_details = lookup_gst(fields["gst_number"])
+    with stage("persist"):
+        tx, doc = persist(user_id, new_filename, fields, hints, document=document)
+
+    return {
+        "message": "Document processed successfully",
+        "transaction_id": tx.id,
+        "document_id": doc.id,
+        "status": doc.status,
+        "llm": {
+            "item_name": fields["item_name"],
+            "amount": fields["amount"],
+            "category": fields["category"],
+            "payment_mode": fields["payment_mode"],
+            "transaction_date": fields["transaction_date"].isoformat(),
+            "vendor": fields["vendor"],
+            "description": fields["description"],
+            "tags": fields["tags"],
+            "legitimacy": fields["legitimacy"],
+            "legitimacy_report": fields["legitimacy_report"],
+            "gst_number": fields["gst_number"],
+        },
+        "gst_details": gst_details,
+        "llm_usage": llm_usage,
+        "file_url": doc.file_url
+    }
@@ -0,0 +1,70 @@
+# query_counts.py
+"""
+N+1 check for /transactions/all: a page must cost the same number of SQL
+statements whatever its size, for offset pages, cursor pages and cursor pages
+with include_total. Runs against a scratch SQLite database with 150
+transactions (each with a Document) and counts only the request thread's
+statements, so the job workers polling their queue do not show up.
+
+    python query_counts.py    # exits 1 if per_page=10 and per_page=100 differ
+"""
+import os
+import tempfile
+import threading
+from datetime import date, timedelta
+
+PAGE_SIZES = (10, 100)
+MODES = ("page=1", "cursor=", "cursor=&include_total=1")
+
+
+def main():
+    os.environ["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "n_plus_one.db")
+    os.environ.setdefault("JWT_SECRET_KEY", "n-plus-one-check-" * 3)
+
+    from flask_jwt_extended import create_access_token
+    from sqlalchemy import event
+
+    from app import create_app, init_db
+    from model import db, Document, Transaction, User
+
+    app = create_app()
+    init_db(app)
+    with app.app_context():
+        db.session.add(User(id=1, first_name="Query", last_name="Count", email="q@example.com",
+                            phone_number="0", password_hash="x"))
+        for i in range(150):
+            t = Transaction(user_id=1, item_name=f"Item {i}", amount=-10.0 - i, category="food",
+                            payment_mode="upi", transaction_date=date(2025, 1, 1) + timedelta(days=i))
+            db.session.add(t)
+            db.session.flush()
+            db.session.add(Document(user_id=1, transaction_id=t.id, file_name=f"{i}.pdf", file_url=f"/documents/{i}.pdf"))
+        db.session.commit()
+        with app.test_request_context():
+            headers = {"Authorization": f"Bearer {create_access_token(identity='1')}"}
+
+        statements = []
+        this_thread = threading.get_ident()
+
+        @event.listens_for(db.engine, "before_cursor_execute")
+        def count_statement(conn, cursor, statement, *args):
+            if threading.get_ident() == this_thread:
+                statements.append(statement)
+
+    client = app.test_client()
+    client.get("/transactions/all", headers=headers)  # first request starts the job workers
+    failed = False
+    for mode in MODES:
+        counts = {}
+        for per_page in PAGE_SIZES:
+            statements.clear()
+            response = client.get(f"/transactions/all?{mode}&per_page={per_page}", headers=headers)
+            assert response.status_code == 200, response.get_data(as_text=True)
+            assert len(response.get_json()["transactions"]) == per_page
+            counts[per_page] = len(statements)
+        failed |= len(set(counts.values())) > 1
+        print(f"{mode:<26} queries: " + ", ".join(f"per_page={n} -> {c}" for n, c in counts.items()))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
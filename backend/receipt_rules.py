@@ -0,0 +1,336 @@
+# receipt_rules.py
+"""
+Rule-based bill extraction that runs before the LLM.
+
+Utility bills, fuel slips and e-commerce invoices print the total, date and
+GSTIN in a predictable way, so they can be read straight from the OCR text.
+extract() returns the same dict as LLM.extract_bill_info plus a confidence in
+[0, 1]; the pipeline skips the paid LLM call when it reaches
+RULES_MIN_CONFIDENCE. The rules read fields but do not judge the bill, so
+legitimacy is "unverified" and the Document is stored as pending.
+
+    python receipt_rules.py [file.txt | folder ...]
+
+prints how much of a corpus of OCR text files (the built-in samples if none
+are given) would be handled without the LLM.
+"""
+import os
+import re
+import threading
+from datetime import datetime, timedelta
+
+from bill_text import _DATE, _clean
+from gst_check import validate_gstin
+
+RULES_ENABLED = os.getenv("RULES_ENABLED", "1") == "1"
+RULES_MIN_CONFIDENCE = float(os.getenv("RULES_MIN_CONFIDENCE", 0.85))
+
+_GSTIN = re.compile(r"\b\d{2}[A-Z]{5}\d{4}[A-Z][A-Z\d]Z[A-Z\d]\b")
+# 1,23,456.00 / 1,234.50 / 1234.5 / 1234
+_MONEY = re.compile(r"(?<![\d.])(\d{1,3}(?:,\d{2,3})+(?:\.\d{1,2})?|\d+\.\d{1,2}|\d+)(?![\d.,]*\d)")
+_PRICE = re.compile(r"\d[\d,]*\.\d{2}\b")
+_STRONG_TOTAL = re.compile(
+    r"grand\s*total|net\s*(amount|payable|total)|amount\s*(payable|due)|total\s*(amount|due|payable)|"
+    r"bill\s*amount|invoice\s*(total|value|amount)|amount\s*paid",
+    re.I,
+)
+_WEAK_TOTAL = re.compile(r"\btotal\b", re.I)
+_NOT_TOTAL = re.compile(r"sub\s*-?\s*total|total\s*(qty|quantity|items?|tax|gst|savings?|discount|weight)", re.I)
+_DATE_LABEL = re.compile(r"date|dt\b|dated", re.I)
+_DUE_DATE = re.compile(r"due\s*date|valid|expiry|next", re.I)
+_REFUND = re.compile(r"refund|credit\s*note|reversal", re.I)
+
+_MONTHS = {m: i for i, m in enumerate(
+    ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"], start=1)}
+
+# (pattern, category, item_name); first match wins
+_CATEGORIES = [
+    (re.compile(r"petrol|diesel|fuel|\bhpcl\b|\bbpcl\b|indian\s*oil|\bcng\b", re.I), "travel", "Fuel"),
+    (re.compile(r"uber|\bola\b|rapido|irctc|railway|airlines?|indigo|boarding|\bpnr\b", re.I), "travel", "Travel fare"),
+    (re.compile(r"electricity|\bkwh\b|power\s*(corp|distribution)|discom", re.I), "bills", "Electricity bill"),
+    (re.compile(r"broadband|internet|postpaid|prepaid|recharge|airtel|jio\b|vodafone|\bbsnl\b", re.I), "bills", "Telecom bill"),
+    (re.compile(r"water\s*(supply|board|charges)|gas\s*(bill|cylinder|agency)|\blpg\b", re.I), "bills", "Utility bill"),
+    (re.compile(r"pharma|chemist|medical|hospital|clinic|diagnostic", re.I), "health", "Medical"),
+    (re.compile(r"restaurant|cafe|café|dine|swiggy|zomato|kitchen|bakery|food|coffee|brew|pizza|burger", re.I), "food", "Food"),
+    (re.compile(r"grocer|supermarket|mart\b|bigbasket|blinkit|zepto|kirana|fresh", re.I), "groceries", "Groceries"),
+    (re.compile(r"cinema|movie|pvr|inox|bookmyshow|tickets?", re.I), "entertainment", "Entertainment"),
+    (re.compile(r"school|college|tuition|university|course\s*fee", re.I), "education", "Education fees"),
+]
+_PAYMENT_MODES = [
+    (re.compile(r"\bupi\b|gpay|google\s*pay|phonepe|paytm\s*upi|bhim", re.I), "upi"),
+    (re.compile(r"credit\s*card|debit\s*card|\bcard\b|visa|master\s*card|rupay|amex|\bpos\b", re.I), "card"),
+    (re.compile(r"net\s*banking|neft|imps|rtgs", re.I), "netbanking"),
+    (re.compile(r"wallet|amazon\s*pay|paytm|mobikwik", re.I), "wallet"),
+    (re.compile(r"\bcash\b", re.I), "cash"),
+]
+
+# confidence contributions; RULES_MIN_CONFIDENCE 0.85 needs a labelled
+# total, a date and a checksum-valid GSTIN (or a labelled date and vendor)
+_W_TOTAL_STRONG, _W_TOTAL_WEAK, _W_TOTAL_IS_MAX = 0.4, 0.25, 0.05
+_W_DATE_LABELLED, _W_DATE = 0.25, 0.15
+_W_GSTIN_VALID, _W_GSTIN = 0.2, 0.05
+_W_VENDOR = 0.1
+
+_stats = {"attempts": 0, "accepted": 0}
+_stats_lock = threading.Lock()
+
+
+def _money(token):
+    return float(token.replace(",", ""))
+
+
+def _amounts(line):
+    return [_money(m) for m in _MONEY.findall(line)]
+
+
+def _find_total(lines):
+    """(amount, strong) from the best-labelled total line, preferring the last one printed."""
+    best = None
+    for i, line in enumerate(lines):
+        if _NOT_TOTAL.search(line) and not _STRONG_TOTAL.search(line):
+            continue
+        strong = bool(_STRONG_TOTAL.search(line))
+        if not strong and not _WEAK_TOTAL.search(line):
+            continue
+        amounts = [a for a in _amounts(line) if a > 0]
+        if not amounts and i + 1 < len(lines):
+            amounts = [a for a in _amounts(lines[i + 1]) if a > 0]  # value printed under its label
+        if amounts and (best is None or strong >= best[1]):
+            best = (amounts[-1], strong)
+    return best
+
+
+def _parse_date(text):
+    """YYYY-MM-DD for one matched date (day-first, as printed on Indian bills), else None."""
+    parts = re.split(r"[-/.,\s]+", text.strip().lower())
+    if len(parts) != 3:
+        return None
+    try:
+        if parts[1][:3] in _MONTHS:
+            day, month, year = int(parts[0]), _MONTHS[parts[1][:3]], int(parts[2])
+        elif len(parts[0]) == 4:
+            year, month, day = (int(p) for p in parts)
+        else:
+            day, month, year = (int(p) for p in parts)
+        if year < 100:
+            year += 2000
+        parsed = datetime(year, month, day)
+    except ValueError:
+        return None
+    if not (datetime(2000, 1, 1) <= parsed <= datetime.utcnow() + timedelta(days=1)):
+        return None
+    return parsed.strftime("%Y-%m-%d")
+
+
+def _find_date(lines):
+    """(YYYY-MM-DD, labelled): a date on a "date" line wins over the first date in the text."""
+    first = None
+    for line in lines:
+        if _DUE_DATE.search(line):
+            continue
+        for match in _DATE.finditer(line):
+            iso = _parse_date(match.group(0))
+            if iso is None:
+                continue
+            if _DATE_LABEL.search(line):
+                return iso, True
+            first = first or iso
+    return (first, False) if first else None
+
+
+def _find_gstin(text):
+    """(GSTIN, checksum_ok) for the first GSTIN-shaped token, preferring one that validates."""
+    found = [m.group(0) for m in _GSTIN.finditer(text.upper())]
+    for gstin in found:
+        if validate_gstin(gstin) is None:
+            return gstin, True
+    return (found[0], False) if found else None
+
+
+def _find_vendor(lines):
+    for line in lines[:5]:
+        if sum(ch.isalpha() for ch in line) < 3 or _GSTIN.search(line.upper()):
+            continue
+        if _DATE.search(line) or _STRONG_TOTAL.search(line) or re.search(r"invoice|receipt|bill\b", line, re.I):
+            continue
+        return line[:80]
+    return ""
+
+
+def fields_found(text):
+    """
+    True once OCR text has a strongly labelled total, a date and a GSTIN, the
+    fields a bill needs; ocr.ocr_pdf's stop_when, so long PDFs skip the rest.
+    """
+    lines = [l for l in (_clean(l) for l in (text or "").splitlines()) if l]
+    total = _find_total(lines)
+    return bool(total and total[1] and _find_date(lines) and _find_gstin(text or ""))
+
+
+def extract(text, hints=None):
+    """
+    (bill, confidence) read from OCR text without the LLM. `bill` has the keys
+    of LLM.extract_bill_info; it is None when no total was found.
+    """
+    hints = hints or {}
+    lines = [l for l in (_clean(l) for l in (text or "").splitlines()) if l]
+    total = _find_total(lines)
+    if total is None:
+        return None, 0.0
+    amount, strong = total
+    date = _find_date(lines)
+    gstin = _find_gstin(text or "")
+    vendor = hints.get("vendor") or _find_vendor(lines)
+
+    confidence = _W_TOTAL_STRONG if strong else _W_TOTAL_WEAK
+    prices = [_money(p) for p in _PRICE.findall(text)]  # ids and phone numbers have no paise
+    if prices and amount >= max(prices):
+        confidence += _W_TOTAL_IS_MAX
+    if date:
+        confidence += _W_DATE_LABELLED if date[1] else _W_DATE
+    if gstin:
+        confidence += _W_GSTIN_VALID if gstin[1] else _W_GSTIN
+    if vendor:
+        confidence += _W_VENDOR
+    confidence = round(min(confidence, 1.0), 2)
+
+    category, item_name = "other", vendor or "Bill"
+    for pattern, cat, name in _CATEGORIES:
+        if pattern.search(text):
+            category, item_name = cat, name
+            break
+    if hints.get("category", "").lower() in {c for _, c, _ in _CATEGORIES} | {"other"}:
+        category = hints["category"].lower()
+
+    payment_mode = "cash"
+    for pattern, mode in _PAYMENT_MODES:
+        if pattern.search(text):
+            payment_mode = mode
+            break
+
+    if _REFUND.search(text):
+        amount = -amount
+    found = [name for name, ok in (("total", True), ("date", date), ("GSTIN", gstin and gstin[1])) if ok]
+    bill = {
+        "item_name": item_name,
+        "amount": amount,
+        "category": category,
+        "payment_mode": payment_mode,
+        "transaction_date": date[0] if date else "",
+        "vendor": vendor,
+        "description": f"{item_name} - {vendor}" if vendor and vendor != item_name else item_name,
+        "tags": category,
+        # the rules only read fields; nobody has judged the bill, so it is left for review
+        "legitimacy": "unverified",
+        "legitimacy_report": (f"Not assessed: rule-based extraction ({round(confidence * 100)}% confidence) "
+                              f"found {', '.join(found)}"),
+        "gst_number": gstin[0] if gstin else "",
+    }
+    return bill, confidence
+
+
+def confident_bill(text, hints=None, usage=None):
+    """
+    The rule-based bill when RULES_ENABLED and its confidence reaches
+    RULES_MIN_CONFIDENCE, else None. `usage`, if given, records the confidence.
+    """
+    if not RULES_ENABLED:
+        return None
+    bill, confidence = extract(text, hints)
+    accepted = bill is not None and confidence >= RULES_MIN_CONFIDENCE
+    with _stats_lock:
+        _stats["attempts"] += 1
+        _stats["accepted"] += accepted
+    if usage is not None:
+        usage["rules_confidence"] = confidence
+        usage["rules"] = accepted
+    return bill if accepted else None
+
+
+def stats():
+    with _stats_lock:
+        out = dict(_stats)
+    out["llm_calls_skipped"] = out["accepted"]
+    out["min_confidence"] = RULES_MIN_CONFIDENCE
+    return out
+
+
+SAMPLES = {
+    "fuel": """INDIAN OIL CORPORATION
+COCO Petrol Pump, MG Road, Pune
+GSTIN: 27AAACI1681G1ZP
+Bill No: 88213   Date: 14/08/2025 18:22
+Product: PETROL   Rate: 104.21
+Volume(L): 9.60
+Amount (Rs): 1000.43
+Mode: UPI
+Net Amount: 1000.43""",
+    "electricity": """MAHARASHTRA STATE ELECTRICITY DISTRIBUTION CO. LTD
+Consumer No: 170019283746
+Bill Date: 05-Sep-2025
+Due Date: 25-Sep-2025
+Units Consumed (kWh): 212
+Energy Charges 1,642.00
+Fixed Charges 120.00
+Electricity Duty 264.30
+Total Amount Payable 2,026.30
+GSTIN 27AAECM2933K1ZB""",
+    "ecommerce": """Tax Invoice
+Cloudtail India Pvt Ltd
+Invoice Date: 2025-07-02
+Order No: 403-1289932-1123
+GSTIN: 29AAACC7781G1ZE
+1 x USB-C Charger 899.00
+Shipping 40.00
+Grand Total: 939.00
+Paid by Credit Card""",
+    "restaurant": """THE BREW ROOM
+Koramangala, Bengaluru
+GSTIN 29ABCPD1234E1ZA
+Date : 12.10.2025  Table 6
+Cappuccino 2 360.00
+Veg Sandwich 1 240.00
+Sub Total 600.00
+CGST 2.5% 15.00
+SGST 2.5% 15.00
+Grand Total 630.00
+Paid: Card""",
+    "handwritten": """shree ganesh traders
+rice 5kg 350
+dal 2kg 260
+total 610""",
+    "noisy": """~~~ ||| ^^^
+r3ce1pt
+T0tal 4S0
+thank you visit again""",
+}
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    paths = []
+    for arg in sys.argv[1:]:
+        if os.path.isdir(arg):
+            paths += [os.path.join(arg, f) for f in sorted(os.listdir(arg)) if f.endswith(".txt")]
+        else:
+            paths.append(arg)
+    corpus = {}
+    for path in paths:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            corpus[os.path.basename(path)] = f.read()
+    corpus = corpus or SAMPLES
+
+    start = time.perf_counter()
+    skipped = 0
+    for name, text in corpus.items():
+        bill, confidence = extract(text)
+        if confidence < RULES_MIN_CONFIDENCE:
+            bill = None
+        skipped += bill is not None
+        summary = f"{bill['amount']:>10.2f} {bill['transaction_date']:<10} {bill['gst_number']}" if bill else "-> LLM"
+        print(f"{name:<24} {confidence:>4.2f}  {summary}")
+    elapsed = time.perf_counter() - start
+    print(f"{skipped}/{len(corpus)} bills ({skipped / len(corpus):.0%}) handled without the LLM "
+          f"at confidence >= {RULES_MIN_CONFIDENCE}, {elapsed * 1000 / len(corpus):.2f} ms per bill")
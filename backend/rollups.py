@@ -0,0 +1,133 @@
+# rollups.py
+"""
+Incremental dashboard aggregates. Every write path that creates Transactions
+calls apply() in the same DB transaction, so /transactions/summary reads
+O(categories x payment modes x months) rollup rows instead of every transaction.
+"""
+from collections import defaultdict
+
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from model import db, Transaction, TransactionRollup
+
+
+def _key(user_id, tx_date, category, payment_mode):
+    return (user_id, tx_date.strftime("%Y-%m"), (category or "").lower(), payment_mode or "")
+
+
+def _deltas(rows):
+    """rows: (user_id, transaction_date, category, payment_mode, amount, count)"""
+    out = defaultdict(lambda: [0.0, 0.0, 0])
+    for user_id, tx_date, category, payment_mode, amount, count in rows:
+        d = out[_key(user_id, tx_date, category, payment_mode)]
+        amount = float(amount or 0)
+        if amount > 0:
+            d[0] += amount
+        else:
+            d[1] += amount
+        d[2] += count
+    return out
+
+
+def _add(conn, key, income, expense, count):
+    user_id, month, category, payment_mode = key
+    match = (
+        (TransactionRollup.user_id == user_id)
+        & (TransactionRollup.month == month)
+        & (TransactionRollup.category == category)
+        & (TransactionRollup.payment_mode == payment_mode)
+    )
+    # In-place increments, so concurrent writers never lose each other's updates
+    bump = update(TransactionRollup).where(match).values(
+        income=TransactionRollup.income + income,
+        expense=TransactionRollup.expense + expense,
+        count=TransactionRollup.count + count,
+    )
+    if conn.execute(bump).rowcount:
+        return
+    try:
+        with conn.begin_nested():
+            conn.execute(insert(TransactionRollup).values(
+                user_id=user_id, month=month, category=category, payment_mode=payment_mode,
+                income=income, expense=expense, count=count,
+            ))
+    except IntegrityError:
+        # Another writer created the row first
+        conn.execute(bump)
+
+
+def apply(transactions, session=None):
+    """Add new Transaction objects to the rollups. Call before the session commits."""
+    session = session or db.session
+    rows = [
+        (t.user_id, t.transaction_date, t.category, t.payment_mode, t.amount, 1)
+        for t in transactions
+    ]
+    for key, (income, expense, count) in _deltas(rows).items():
+        _add(session, key, income, expense, count)
+
+
+def rebuild(conn, user_id=None):
+    """Recompute rollups from the transaction table (backfill / repair)."""
+    stmt = delete(TransactionRollup)
+    if user_id is not None:
+        stmt = stmt.where(TransactionRollup.user_id == user_id)
+    conn.execute(stmt)
+
+    grouped = select(
+        Transaction.user_id, Transaction.transaction_date, Transaction.category,
+        Transaction.payment_mode, Transaction.amount > 0,
+        func.sum(Transaction.amount), func.count(),
+    ).group_by(
+        Transaction.user_id, Transaction.transaction_date, Transaction.category,
+        Transaction.payment_mode, Transaction.amount > 0,
+    )
+    if user_id is not None:
+        grouped = grouped.where(Transaction.user_id == user_id)
+
+    rows = (
+        (uid, tx_date, category, payment_mode, total, count)
+        for uid, tx_date, category, payment_mode, _, total, count in conn.execute(grouped)
+    )
+    for key, (income, expense, count) in _deltas(rows).items():
+        _add(conn, key, income, expense, count)
+
+
+def summary(user_id, month_from=None, month_to=None):
+    query = TransactionRollup.query.filter_by(user_id=user_id)
+    if month_from:
+        query = query.filter(TransactionRollup.month >= month_from)
+    if month_to:
+        query = query.filter(TransactionRollup.month <= month_to)
+
+    groups = {"category": {}, "payment_mode": {}, "month": {}}
+    totals = {"income": 0.0, "expense": 0.0, "count": 0}
+    for r in query.all():
+        for field, bucket in groups.items():
+            name = getattr(r, field)
+            b = bucket.setdefault(name, {field: name, "income": 0.0, "expense": 0.0, "count": 0})
+            b["income"] += r.income
+            b["expense"] += r.expense
+            b["count"] += r.count
+        totals["income"] += r.income
+        totals["expense"] += r.expense
+        totals["count"] += r.count
+
+    def rows(bucket):
+        out = sorted(bucket.values(), key=lambda b: b["income"] - b["expense"], reverse=True)
+        for b in out:
+            b["net"] = round(b["income"] + b["expense"], 2)
+            b["income"] = round(b["income"], 2)
+            b["expense"] = round(b["expense"], 2)
+        return out
+
+    totals["net"] = round(totals["income"] + totals["expense"], 2)
+    totals["income"] = round(totals["income"], 2)
+    totals["expense"] = round(totals["expense"], 2)
+    return {
+        "totals": totals,
+        "by_category": rows(groups["category"]),
+        "by_payment_mode": rows(groups["payment_mode"]),
+        "by_month": sorted(rows(groups["month"]), key=lambda b: b["month"]),
+    }
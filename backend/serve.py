@@ -0,0 +1,221 @@
+# serve.py
+"""
+Production entry point: python serve.py [--host H] [--port P]
+
+`python app.py` is the single-process Werkzeug dev server with the reloader
+and debugger. Here the master process builds the app with create_app(),
+creates/migrates the schema once (init_db), imports the heavy libraries and
+warms the slab/template caches, then forks WEB_WORKERS gunicorn workers with
+WEB_THREADS threads each, so workers share all of that copy-on-write and
+start serving at once. SIGTERM drains in-flight requests for up to
+WEB_GRACEFUL_TIMEOUT seconds and lets running document jobs finish.
+
+gunicorn does not run on Windows; there waitress serves the same app with
+WEB_THREADS threads in one process.
+
+    python serve.py --compare [seconds]    # startup time and requests/sec, dev server vs this
+"""
+import argparse
+import os
+
+from app import create_app, init_db
+from model import db
+import itr_generator
+import jobs
+import lazy
+import tax_engine
+
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", 5000))
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", min(os.cpu_count() or 1, 4)))
+WEB_THREADS = int(os.getenv("WEB_THREADS", 8))
+# /document/add and /itr/generate run OCR, LLM and PDF work inside the request
+WEB_TIMEOUT = int(os.getenv("WEB_TIMEOUT", 180))
+WEB_GRACEFUL_TIMEOUT = int(os.getenv("WEB_GRACEFUL_TIMEOUT", 30))
+
+ITR_TEMPLATE = "ITR_TEMPLATE.pdf"
+
+
+def preload():
+    """Load the lazily imported libraries in the master so forked workers never pay for them."""
+    lazy.preload()
+    tax_engine.slab_config()
+    if os.path.exists(ITR_TEMPLATE):
+        itr_generator.load_template(ITR_TEMPLATE)
+
+
+def prepare():
+    """The app, with the schema current and nothing left open for workers to inherit."""
+    app = create_app()
+    init_db(app)
+    preload()
+    with app.app_context():
+        db.engine.dispose()  # forked workers must open their own SQLite/server connections
+    return app
+
+
+def _worker_exit(server, worker):
+    # requests have drained by now; give document jobs the rest of the budget
+    if not jobs.stop(timeout=WEB_GRACEFUL_TIMEOUT / 2):
+        worker.log.warning("Document jobs still running at shutdown; they will be requeued")
+
+
+def serve_gunicorn(app, host, port):
+    from gunicorn.app.base import BaseApplication
+
+    class Server(BaseApplication):
+        def load_config(self):
+            for key, value in {
+                "bind": f"{host}:{port}",
+                "workers": WEB_WORKERS,
+                "worker_class": "gthread",
+                "threads": WEB_THREADS,
+                "timeout": WEB_TIMEOUT,
+                "graceful_timeout": WEB_GRACEFUL_TIMEOUT,
+                "preload_app": True,
+                "accesslog": "-",
+                # path without the query string: /documents/<file> may carry a ?token= download link
+                "access_log_format": '%(h)s %(l)s %(u)s %(t)s "%(m)s %(U)s %(H)s" %(s)s %(b)s "%(f)s" "%(a)s"',
+                "worker_exit": _worker_exit,
+            }.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    Server().run()
+
+
+def serve_waitress(app, host, port):
+    from waitress import serve
+
+    try:
+        serve(app, host=host, port=port, threads=WEB_THREADS, channel_timeout=WEB_TIMEOUT)
+    finally:
+        jobs.stop(timeout=WEB_GRACEFUL_TIMEOUT)
+
+
+def main(host=HOST, port=PORT):
+    app = prepare()
+    if os.name == "nt":
+        serve_waitress(app, host, port)
+    else:
+        serve_gunicorn(app, host, port)
+
+
+def compare(seconds=5, clients=32):
+    """Start `python app.py`, then this server, on a scratch database and load each."""
+    import datetime
+    import signal
+    import socket
+    import statistics
+    import subprocess
+    import sys
+    import tempfile
+    import threading
+    import time
+
+    import requests
+    from flask_jwt_extended import create_access_token
+
+    from model import User
+    from pipeline import persist
+
+    folder = tempfile.mkdtemp(prefix="serve-compare-")
+    env = dict(os.environ, JWT_SECRET_KEY="serve-compare-" * 4, PYTHONUNBUFFERED="1",
+               SQLALCHEMY_DATABASE_URI="sqlite:///" + os.path.join(folder, "compare.db"))
+    os.environ.update(env)
+
+    app = create_app()
+    init_db(app)
+    with app.app_context():
+        db.session.add(User(id=1, first_name="Bench", last_name="User", email="bench@example.com",
+                            phone_number="0", password_hash="x"))
+        db.session.commit()
+        for i in range(500):
+            persist(1, "bench.pdf", {
+                "item_name": "Bench", "amount": -(i % 97) - 1.5, "category": ("food", "travel", "bills")[i % 3],
+                "payment_mode": "upi", "transaction_date": datetime.date(2025, i % 12 + 1, i % 28 + 1),
+                "vendor": "Shop", "description": "", "tags": "", "legitimacy": "verified",
+            }, {})
+        with app.test_request_context():
+            headers = {"Authorization": f"Bearer {create_access_token(identity='1')}"}
+        db.engine.dispose()
+
+    def free_port():
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            return s.getsockname()[1]
+
+    def run(name, command):
+        port = free_port()
+        url = f"http://127.0.0.1:{port}/transactions/summary"
+        log = open(os.path.join(folder, f"{name.split()[0]}.log"), "w")
+        start = time.perf_counter()
+        proc = subprocess.Popen(command + ([] if "app.py" in command else ["--port", str(port)]),
+                                env=dict(env, PORT=str(port)), stdout=log, stderr=subprocess.STDOUT,
+                                start_new_session=True)
+        while True:
+            try:
+                if requests.get(url, headers=headers, timeout=5).status_code == 200:
+                    break
+            except requests.RequestException:
+                pass
+            if proc.poll() is not None or time.perf_counter() - start > 60:
+                raise SystemExit(f"{name} did not start, see {log.name}")
+            time.sleep(0.02)
+        startup = time.perf_counter() - start
+
+        latencies, errors = [], [0]
+        lock = threading.Lock()
+        deadline = time.perf_counter() + seconds
+
+        def client():
+            session = requests.Session()
+            while time.perf_counter() < deadline:
+                t = time.perf_counter()
+                try:
+                    ok = session.get(url, headers=headers, timeout=30).status_code == 200
+                except requests.RequestException:
+                    ok = False
+                with lock:
+                    if ok:
+                        latencies.append(time.perf_counter() - t)
+                    else:
+                        errors[0] += 1
+
+        threads = [threading.Thread(target=client) for _ in range(clients)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        stop_start = time.perf_counter()
+        os.killpg(proc.pid, signal.SIGTERM)  # the dev server's reloader child is in the same group
+        proc.wait()
+        stopped = time.perf_counter() - stop_start
+        log.close()
+
+        p95 = statistics.quantiles(latencies, n=20)[-1] if len(latencies) > 1 else 0
+        print(f"{name:<22} startup {startup:5.2f} s  {len(latencies) / seconds:7.0f} req/s  "
+              f"p50 {statistics.median(latencies or [0]) * 1000:6.1f} ms  p95 {p95 * 1000:6.1f} ms  "
+              f"{errors[0]} errors  stop {stopped:4.2f} s")
+
+    print(f"GET /transactions/summary, {clients} clients for {seconds:g} s each")
+    here = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(here)
+    run("python app.py (dev)", [sys.executable, "app.py"])
+    run(f"serve.py ({WEB_WORKERS}x{WEB_THREADS})", [sys.executable, "serve.py"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the Lumen API with multiple workers.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--compare", nargs="?", type=float, const=5, metavar="SECONDS",
+                        help="benchmark the dev server against this one instead of serving")
+    args = parser.parse_args()
+    if args.compare:
+        compare(args.compare)
+    else:
+        main(args.host, args.port)
@@ -0,0 +1,203 @@
+# storage.py
+"""
+Database engine settings for the Flask-SQLAlchemy `db`.
+
+SQLALCHEMY_DATABASE_URI in the environment (or .env) picks the database; the
+default is database.db next to app.py. The models only use portable SQL, so a
+server database (e.g. postgresql+psycopg://...) works with its driver installed.
+
+For a SQLite file every pooled connection is set up with:
+
+- journal_mode=WAL: readers no longer block the writer and the writer no
+  longer blocks readers; only writers queue behind each other.
+- synchronous=NORMAL (SQLITE_SYNCHRONOUS): with WAL a commit no longer waits
+  for an fsync; a power cut can lose the last commits but never corrupts.
+- busy_timeout (SQLITE_BUSY_TIMEOUT_MS): a writer waits this long for the
+  write lock instead of failing with "database is locked".
+- cache_size (SQLITE_CACHE_KB) per connection.
+
+pysqlite only opens a transaction right before the first INSERT/UPDATE/DELETE,
+so a session never sits on a read snapshot it then has to upgrade; that is
+what keeps busy_timeout effective for read-then-write requests.
+
+    python storage.py [seconds] [writers] [readers]    # concurrent load, default vs tuned; exits 1 on a lock error
+"""
+import os
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+from model import db
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))  # server databases only
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 15000))
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").upper()
+SQLITE_CACHE_KB = int(os.getenv("SQLITE_CACHE_KB", 16384))
+
+_SYNCHRONOUS_MODES = {"OFF", "NORMAL", "FULL", "EXTRA"}
+
+
+def database_uri(basedir):
+    return os.getenv("SQLALCHEMY_DATABASE_URI") or "sqlite:///" + os.path.join(basedir, "database.db")
+
+
+def is_sqlite_file(uri):
+    url = make_url(uri)
+    return url.get_backend_name() == "sqlite" and url.database not in (None, "", ":memory:")
+
+
+def engine_options(uri):
+    """SQLALCHEMY_ENGINE_OPTIONS for `uri`."""
+    url = make_url(uri)
+    if url.get_backend_name() == "sqlite":
+        if not is_sqlite_file(uri):
+            return {}  # in-memory: SQLAlchemy's single-connection pool is the only one that works
+        return {
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_timeout": DB_POOL_TIMEOUT,
+            # pooled connections move between request, job and batch threads
+            "connect_args": {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+        }
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA cache_size={-SQLITE_CACHE_KB}")  # negative = KiB, not pages
+    finally:
+        cursor.close()
+
+
+def init_app(app, uri=None):
+    """Configure and bind `db` to `app`; use instead of db.init_app(app)."""
+    if SQLITE_SYNCHRONOUS not in _SYNCHRONOUS_MODES:
+        raise ValueError(f"SQLITE_SYNCHRONOUS must be one of {sorted(_SYNCHRONOUS_MODES)}")
+    uri = uri or app.config.get("SQLALCHEMY_DATABASE_URI") or database_uri(app.root_path)
+    app.config["SQLALCHEMY_DATABASE_URI"] = uri
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(uri) | app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {})
+    db.init_app(app)
+    if is_sqlite_file(uri):
+        # the engine exists now but has not connected yet, so every connection gets the pragmas
+        with app.app_context():
+            event.listen(db.engine, "connect", _sqlite_pragmas)
+
+
+def describe():
+    """The pool and SQLite pragmas actually in effect on the bound engine."""
+    info = {"backend": db.engine.dialect.name, "pool": type(db.engine.pool).__name__}
+    if db.engine.dialect.name == "sqlite":
+        with db.engine.connect() as conn:
+            for pragma in ("journal_mode", "synchronous", "busy_timeout", "cache_size"):
+                info[pragma] = conn.exec_driver_sql(f"PRAGMA {pragma}").scalar()
+    return info
+
+
+if __name__ == "__main__":
+    import datetime
+    import random
+    import sys
+    import tempfile
+    import threading
+    import time
+
+    from flask import Flask
+    from sqlalchemy.exc import OperationalError
+
+    import rollups
+    from model import User
+    from pipeline import persist
+
+    SECONDS = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    WRITERS = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    READERS = int(sys.argv[3]) if len(sys.argv) > 3 else 16
+    USERS = 20
+
+    def load(name, tuned):
+        folder = tempfile.mkdtemp(prefix="storage-load-")
+        app = Flask(name)
+        uri = "sqlite:///" + os.path.join(folder, "load.db")
+        if tuned:
+            init_app(app, uri)
+        else:
+            app.config["SQLALCHEMY_DATABASE_URI"] = uri
+            db.init_app(app)
+        with app.app_context():
+            db.create_all()
+            db.session.add_all(
+                User(id=i, first_name="Load", last_name="Test", email=f"load{i}@example.com",
+                     phone_number="0", password_hash="x")
+                for i in range(1, USERS + 1)
+            )
+            db.session.commit()
+            settings = describe()
+
+        counts = {"writes": 0, "reads": 0, "lock errors": 0, "other errors": 0}
+        counts_lock = threading.Lock()
+        deadline = time.perf_counter() + SECONDS
+
+        def count(key):
+            with counts_lock:
+                counts[key] += 1
+
+        def writer(seed):
+            rng = random.Random(seed)
+            with app.app_context():
+                while time.perf_counter() < deadline:
+                    fields = {
+                        "item_name": "Load test", "amount": -round(rng.uniform(1, 5000), 2),
+                        "category": rng.choice(["food", "travel", "electricity"]), "payment_mode": "upi",
+                        "transaction_date": datetime.date(2025, rng.randint(1, 12), rng.randint(1, 28)),
+                        "vendor": "Shop", "description": "", "tags": "", "legitimacy": "verified",
+                    }
+                    try:
+                        persist(rng.randint(1, USERS), "load.pdf", fields, {})
+                        count("writes")
+                    except Exception as e:
+                        count("lock errors" if "locked" in str(getattr(e, "details", e)) else "other errors")
+                    finally:
+                        db.session.remove()
+
+        def reader(seed):
+            rng = random.Random(seed)
+            with app.app_context():
+                while time.perf_counter() < deadline:
+                    try:
+                        rollups.summary(rng.randint(1, USERS))
+                        count("reads")
+                    except OperationalError as e:
+                        count("lock errors" if "locked" in str(e) else "other errors")
+                    finally:
+                        db.session.remove()
+
+        threads = [threading.Thread(target=writer, args=(i,)) for i in range(WRITERS)]
+        threads += [threading.Thread(target=reader, args=(100 + i,)) for i in range(READERS)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        with app.app_context():
+            db.engine.dispose()
+
+        print(f"{name:<8} {counts['writes'] / SECONDS:>7.0f} writes/s  {counts['reads'] / SECONDS:>7.0f} reads/s  "
+              f"{counts['lock errors']} lock errors  {counts['other errors']} other errors  {settings}")
+        return counts
+
+    print(f"{WRITERS} writer and {READERS} reader threads for {SECONDS:g} s each")
+    load("default", tuned=False)
+    tuned = load("tuned", tuned=True)
+    if tuned["lock errors"] or tuned["other errors"] or not tuned["writes"]:
+        raise SystemExit(1)
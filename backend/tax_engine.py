@@ -0,0 +1,153 @@
+# tax_engine.py
+"""
+Table-driven income tax slabs, for one income or NumPy arrays of them.
+
+Slab tables live in tax_slabs.json (TAX_SLABS_PATH overrides it) as
+regime -> assessment year -> [[lower bound, rate], ...]. A year without its
+own table uses the latest earlier one, since slabs stay in force until
+changed. The default regime/year reproduces the ladder compute_income_details
+always used.
+
+    python tax_engine.py [count]    # benchmark over `count` (1M) synthetic incomes
+"""
+import bisect
+import json
+import os
+import threading
+
+import lazy
+
+np = lazy.module("numpy")
+
+TAX_SLABS_PATH = os.getenv("TAX_SLABS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "tax_slabs.json"))
+
+
+class SlabTable:
+    """One slab ladder with the tax accumulated at each lower bound precomputed."""
+
+    def __init__(self, slabs):
+        slabs = sorted((float(lower), float(rate)) for lower, rate in slabs)
+        if not slabs or slabs[0][0] != 0:
+            raise ValueError("A slab table must start at 0")
+        self.lowers = [lower for lower, _ in slabs]
+        self.rates = [rate for _, rate in slabs]
+        self.bases = [0.0]
+        for i in range(1, len(slabs)):
+            self.bases.append(self.bases[-1] + (self.lowers[i] - self.lowers[i - 1]) * self.rates[i - 1])
+        self._arrays = None  # numpy copies, built by the first tax_many
+
+    def tax(self, income):
+        """Tax on one income, rounded to paise."""
+        if income <= 0:
+            return 0
+        i = bisect.bisect_right(self.lowers, income) - 1
+        return round(self.bases[i] + (income - self.lowers[i]) * self.rates[i], 2)
+
+    def tax_many(self, incomes):
+        """
+        Tax on every income of an array (float64 out, rounded to paise). NumPy
+        rounds half-paisa ties differently from round(), so a result can be
+        one paisa off tax().
+        """
+        if self._arrays is None:
+            self._arrays = np.array(self.lowers), np.array(self.rates), np.array(self.bases)
+        lowers, rates, bases = self._arrays
+        incomes = np.maximum(np.asarray(incomes, dtype=np.float64), 0)
+        i = np.searchsorted(lowers, incomes, side="right") - 1
+        return np.round(bases[i] + (incomes - lowers[i]) * rates[i], 2)
+
+
+class SlabConfig:
+    def __init__(self, config):
+        self.default_regime = config["default"]["regime"]
+        self.default_year = int(config["default"]["assessment_year"])
+        self.tables = {
+            regime: {int(year): SlabTable(slabs) for year, slabs in years.items()}
+            for regime, years in config["regimes"].items()
+        }
+
+    def table(self, regime=None, assessment_year=None):
+        regime = regime or self.default_regime
+        if regime not in self.tables:
+            raise ValueError(f"Unknown tax regime {regime!r}; known: {sorted(self.tables)}")
+        years = sorted(self.tables[regime])
+        year = assessment_year or self.default_year
+        in_force = [y for y in years if y <= year]
+        return self.tables[regime][in_force[-1] if in_force else years[0]]
+
+    def regimes(self):
+        return sorted(self.tables)
+
+
+_config = None
+_config_lock = threading.Lock()
+
+
+def slab_config():
+    """The parsed TAX_SLABS_PATH, loaded once per process."""
+    global _config
+    if _config is None:
+        with _config_lock:
+            if _config is None:
+                with open(TAX_SLABS_PATH) as f:
+                    _config = SlabConfig(json.load(f))
+    return _config
+
+
+def tax_for(income, regime=None, assessment_year=None):
+    """Tax on one income under `regime` (default from the config) in `assessment_year`."""
+    return slab_config().table(regime, assessment_year).tax(income)
+
+
+def tax_many(incomes, regime=None, assessment_year=None):
+    """tax_for over a whole array of incomes at once."""
+    return slab_config().table(regime, assessment_year).tax_many(incomes)
+
+
+def compare(incomes, scenarios):
+    """
+    What-if tax for the same incomes under several (regime, assessment_year)
+    scenarios: {scenario: array}, e.g. compare(incomes, [("old", 2026), ("new", 2026)]).
+    """
+    incomes = np.asarray(incomes, dtype=np.float64)
+    return {scenario: tax_many(incomes, *scenario) for scenario in scenarios}
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    def ladder(total):
+        """The hard-coded ladder compute_income_details used before the slab tables."""
+        tax = 0
+        for lower, rate in ((1500000, 0.30), (1200000, 0.20), (900000, 0.15), (600000, 0.10), (300000, 0.05)):
+            if total > lower:
+                tax += (total - lower) * rate
+                total = lower
+        return round(tax, 2)
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    rng = np.random.default_rng(7)
+    incomes = np.round(rng.lognormal(mean=13.5, sigma=0.8, size=count), 2)
+
+    start = time.perf_counter()
+    scalar = [ladder(x) for x in incomes.tolist()]
+    scalar_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vector = tax_many(incomes)
+    vector_seconds = time.perf_counter() - start
+
+    mismatches = int(np.count_nonzero(np.abs(vector - np.array(scalar)) > 0.011))
+    print(f"{count:,} incomes, default slabs ({slab_config().default_regime}, AY {slab_config().default_year})")
+    print(f"scalar if-ladder  {scalar_seconds:7.3f} s")
+    print(f"tax_many          {vector_seconds:7.3f} s ({scalar_seconds / vector_seconds:.0f}x), "
+          f"{mismatches} differ by more than a paisa")
+
+    scenarios = [(regime, year) for regime in slab_config().regimes() for year in (2024, 2025, 2026)]
+    start = time.perf_counter()
+    results = compare(incomes, scenarios)
+    elapsed = time.perf_counter() - start
+    print(f"compare, {len(scenarios)} scenarios {elapsed:7.3f} s")
+    for scenario, taxes in results.items():
+        print(f"  {scenario[0]:<4} AY {scenario[1]}  mean tax {taxes.mean():>12,.2f}")
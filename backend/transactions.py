@@ -1,36 +1,94 @@
-from flask import Blueprint, request, jsonify
+import csv
+import io
+import json
+import os
+import time
+from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from model import db, Transaction,Document
 from datetime import datetime
-from sqlalchemy import func, desc, asc
+from sqlalchemy import desc, asc
+from pagination import InvalidCursor, keyset_page
+import rollups
 
 transactions_bp = Blueprint("transactions", __name__, url_prefix="/transactions")
 
+# sort param -> (column, descending); anything unknown falls back to created_desc
+SORTS = {
+    "asc": (Transaction.transaction_date, False),
+    "desc": (Transaction.transaction_date, True),
+    "created_asc": (Transaction.created_at, False),
+    "created_desc": (Transaction.created_at, True),
+}
+
+
+def _serialize(t, doc):
+    return {
+        "id": t.id,
+        "item_name": t.item_name,
+        "amount": t.amount,
+        "category": t.category,
+        "payment_mode": t.payment_mode,
+        "transaction_date": t.transaction_date.isoformat(),
+        "vendor": t.vendor,
+        "description": t.description,
+        "tags": t.tags,
+        "created_at": t.created_at.isoformat(),
+        "file_url": doc.file_url if doc else None,
+        "status": doc.status if doc else "verified"
+    }
+
+
+def _documents_by_transaction(transaction_ids):
+    """One IN query for a whole page; keeps the first document per transaction."""
+    if not transaction_ids:
+        return {}
+    docs = (
+        Document.query
+        .filter(Document.transaction_id.in_(transaction_ids))
+        .order_by(Document.id)
+        .all()
+    )
+    by_tx = {}
+    for d in docs:
+        by_tx.setdefault(d.transaction_id, d)
+    return by_tx
+
+
 @transactions_bp.get("/<int:transaction_id>")
 @jwt_required()
 def get_transaction(transaction_id):
     user_id = int(get_jwt_identity())
 
-    tx = Transaction.query.filter_by(id=transaction_id, user_id=user_id).first()
-    if not tx:
+    row = (
+        db.session.query(Transaction, Document)
+        .outerjoin(Document, Document.transaction_id == Transaction.id)
+        .filter(Transaction.id == transaction_id, Transaction.user_id == user_id)
+        .order_by(Document.id)
+        .first()
+    )
+    if not row:
         return jsonify({"error": "Transaction not found"}), 404
 
-    doc = Document.query.filter_by(transaction_id=transaction_id).first()
+    tx, doc = row
+    return jsonify(_serialize(tx, doc)), 200
 
-    return jsonify({
-        "id": tx.id,
-        "item_name": tx.item_name,
-        "amount": tx.amount,
-        "category": tx.category,
-        "payment_mode": tx.payment_mode,
-        "transaction_date": tx.transaction_date.isoformat(),
-        "vendor": tx.vendor,
-        "description": tx.description,
-        "tags": tx.tags,
-        "created_at": tx.created_at.isoformat(),
-        "file_url": doc.file_url if doc else None,
-        "status": doc.status if doc else "verified"
-    }), 200
+@transactions_bp.get("/summary")
+@jwt_required()
+def get_summary():
+    """Dashboard totals by category, payment mode and month, read from the rollups."""
+    user_id = int(get_jwt_identity())
+    month_from = (request.args.get("from") or "").strip() or None
+    month_to = (request.args.get("to") or "").strip() or None
+
+    for m in (month_from, month_to):
+        if m:
+            try:
+                datetime.strptime(m, "%Y-%m")
+            except ValueError:
+                return jsonify({"error": "Invalid month format. Use YYYY-MM"}), 400
+
+    return jsonify(rollups.summary(user_id, month_from, month_to)), 200
 
 @transactions_bp.get("/all")
 @jwt_required()
@@ -44,36 +102,37 @@ def get_transactions():
     query = Transaction.query.filter_by(user_id=user_id)
 
     if category_filter:
-        query = query.filter(func.lower(Transaction.category) == category_filter.lower())
+        query = query.filter(Transaction.category_normalised == category_filter.lower())
 
-    if sort == "asc":
-        query = query.order_by(asc(Transaction.transaction_date))
-    elif sort == "desc":
-        query = query.order_by(desc(Transaction.transaction_date))
-    elif sort == "created_asc":
-        query = query.order_by(asc(Transaction.created_at))
-    else:
-        query = query.order_by(desc(Transaction.created_at))
+    sort_col, descending = SORTS.get(sort, SORTS["created_desc"])
 
+    if "cursor" in request.args:
+        try:
+            items, next_cursor = keyset_page(
+                query, sort_col, Transaction.id, descending,
+                request.args.get("cursor"), per_page,
+            )
+        except InvalidCursor as e:
+            return jsonify({"error": str(e)}), 400
+
+        docs = _documents_by_transaction([t.id for t in items])
+        payload = {
+            "transactions": [_serialize(t, docs.get(t.id)) for t in items],
+            "next_cursor": next_cursor,
+            "category_filter": category_filter or None,
+            "sort": sort,
+            "per_page": per_page
+        }
+        # COUNT(*) is the expensive part of a page on big accounts; only on request
+        if request.args.get("include_total") in ("1", "true"):
+            payload["total"] = query.count()
+        return jsonify(payload), 200
+
+    query = query.order_by(desc(sort_col) if descending else asc(sort_col))
     paginated = query.paginate(page=page, per_page=per_page, error_out=False)
 
-    transactions = []
-    for t in paginated.items:
-        doc = Document.query.filter_by(transaction_id=t.id).first()
-        transactions.append({
-            "id": t.id,
-            "item_name": t.item_name,
-            "amount": t.amount,
-            "category": t.category,
-            "payment_mode": t.payment_mode,
-            "transaction_date": t.transaction_date.isoformat(),
-            "vendor": t.vendor,
-            "description": t.description,
-            "tags": t.tags,
-            "created_at": t.created_at.isoformat(),
-            "file_url": doc.file_url if doc else None,
-            "status": doc.status if doc else "verified"
-        })
+    docs = _documents_by_transaction([t.id for t in paginated.items])
+    transactions = [_serialize(t, docs.get(t.id)) for t in paginated.items]
 
     return jsonify({
         "transactions": transactions,
@@ -85,23 +144,23 @@ def get_transactions():
         "per_page": per_page
     }), 200
 
-@transactions_bp.post("/add")
-@jwt_required()
-def add_transaction():
-    user_id = int(get_jwt_identity())
-    data = request.get_json() or {}
+REQUIRED_FIELDS = ["item_name", "amount", "category", "payment_mode", "transaction_date"]
+IMPORT_CHUNK_ROWS = int(os.getenv("IMPORT_CHUNK_ROWS", 500))
+IMPORT_MAX_ERRORS = 1000
+
 
-    required_fields = ["item_name", "amount", "category", "payment_mode", "transaction_date"]
-    if not all(field in data and data[field] for field in required_fields):
-        return jsonify({"error": "Missing required fields"}), 400
+def _build_transaction(user_id, data):
+    """Validate one add/import row. Returns (Transaction, None) or (None, error message)."""
+    if not all(field in data and data[field] for field in REQUIRED_FIELDS):
+        return None, "Missing required fields"
     try:
         transaction_date = datetime.fromisoformat(data["transaction_date"]).date()
     except Exception:
-        return jsonify({"error": "Invalid date format. Use YYYY-MM-DD"}), 400
+        return None, "Invalid date format. Use YYYY-MM-DD"
     today = datetime.utcnow().date()
     if transaction_date > today:
-        return jsonify({"error": "Transaction date cannot be in the future"}), 400
-    t = Transaction(
+        return None, "Transaction date cannot be in the future"
+    return Transaction(
         user_id=user_id,
         item_name=data["item_name"],
         amount=data["amount"],
@@ -111,9 +170,110 @@ def add_transaction():
         vendor=data.get("vendor"),
         description=data.get("description"),
         tags=data.get("tags"),
-    )
+    ), None
+
+
+@transactions_bp.post("/add")
+@jwt_required()
+def add_transaction():
+    user_id = int(get_jwt_identity())
+    data = request.get_json() or {}
+
+    t, error = _build_transaction(user_id, data)
+    if error:
+        return jsonify({"error": error}), 400
 
     db.session.add(t)
+    rollups.apply([t])
     db.session.commit()
 
     return jsonify({"message": "Transaction added", "id": t.id}), 201
+
+
+def _import_rows(stream, content_type):
+    """Yield (row_number, dict or None, parse error) from a CSV or JSON-lines body."""
+    text = io.TextIOWrapper(io.BufferedReader(stream), encoding="utf-8-sig", newline="")
+    if "csv" in content_type:
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, {k.strip(): (v or "").strip() for k, v in row.items() if k}, None
+        return
+    for line_num, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield line_num, None, "Invalid JSON"
+            continue
+        if not isinstance(row, dict):
+            yield line_num, None, "Each line must be a JSON object"
+            continue
+        yield line_num, row, None
+
+
+@transactions_bp.post("/import")
+@jwt_required()
+def import_transactions():
+    """
+    Bulk import from a CSV (text/csv, header row with add_transaction's fields)
+    or JSON-lines (application/x-ndjson) body. Rows are validated like /add and
+    inserted IMPORT_CHUNK_ROWS at a time, one DB transaction per chunk; invalid
+    rows are reported and skipped without aborting the import.
+    """
+    user_id = int(get_jwt_identity())
+    content_type = (request.content_type or "").lower()
+    if not any(t in content_type for t in ("csv", "ndjson", "jsonl", "json-lines")):
+        return jsonify({"error": "Send text/csv or application/x-ndjson"}), 415
+
+    start = time.perf_counter()
+    imported = 0
+    errors = []
+    error_count = 0
+    chunk = []
+
+    def flush():
+        nonlocal imported, error_count
+        if not chunk:
+            return
+        try:
+            db.session.add_all(t for _, t in chunk)
+            rollups.apply([t for _, t in chunk])
+            db.session.commit()
+            imported += len(chunk)
+        except Exception as e:
+            current_app.logger.exception("Import chunk failed")
+            db.session.rollback()
+            for row_num, _ in chunk:
+                error_count += 1
+                if len(errors) < IMPORT_MAX_ERRORS:
+                    errors.append({"row": row_num, "error": f"Insert failed: {e}"})
+        chunk.clear()
+
+    for row_num, data, error in _import_rows(request.stream, content_type):
+        if not error:
+            try:
+                data["amount"] = float(data.get("amount") or "")
+            except (TypeError, ValueError):
+                error = "Missing required fields" if not data.get("amount") else "Invalid amount"
+        if not error:
+            t, error = _build_transaction(user_id, data)
+        if error:
+            error_count += 1
+            if len(errors) < IMPORT_MAX_ERRORS:
+                errors.append({"row": row_num, "error": error})
+            continue
+        chunk.append((row_num, t))
+        if len(chunk) >= IMPORT_CHUNK_ROWS:
+            flush()
+    flush()
+
+    elapsed = time.perf_counter() - start
+    return jsonify({
+        "imported": imported,
+        "failed": error_count,
+        "errors": errors,
+        "elapsed": round(elapsed, 3),
+        "rows_per_sec": round((imported + error_count) / elapsed, 1) if elapsed else None,
+    }), 200
+
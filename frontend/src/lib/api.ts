@@ -26,4 +26,23 @@ api.interceptors.response.use(
   }
 );
 
+// <img> and window.open can't send the Authorization header, so they get a
+// short-lived link the backend signs for that one file
+export const documentUrl = async (fileUrl: string) => {
+  const res = await api.post(`${fileUrl}/token`);
+  return `${api.defaults.baseURL}${res.data.url}`;
+};
+
+// the tab is opened before the link is fetched so popup blockers still see the click
+export const openDocument = async (fileUrl: string) => {
+  const tab = window.open("", "_blank");
+  try {
+    const url = await documentUrl(fileUrl);
+    if (tab) tab.location.href = url;
+  } catch (err) {
+    tab?.close();
+    throw err;
+  }
+};
+
 export default api;
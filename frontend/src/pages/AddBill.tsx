@@ -13,7 +13,7 @@ import {
 } from "@/components/ui/select";
 import { Upload, FileText, Loader2, CheckCircle2, X, AlertTriangle } from "lucide-react";
 import { toast } from "sonner";
-import api from "@/lib/api";
+import api, { openDocument } from "@/lib/api";
 
 const AddBill = () => {
   const [isProcessing, setIsProcessing] = useState(false);
@@ -250,7 +250,7 @@ const AddBill = () => {
               <Button
                 className="w-full py-6 text-lg"
                 onClick={() =>
-                  window.open(`http://localhost:5000${result.file_url}`, "_blank")
+                  openDocument(result.file_url)
                 }
               >
                 <Upload className="mr-2 h-5 w-5" />
@@ -1,5 +1,5 @@
 import { useEffect, useState } from "react";
-import api from "@/lib/api";
+import api, { documentUrl, openDocument } from "@/lib/api";
 import { DashboardLayout } from "@/components/layout/DashboardLayout";
 import { Card } from "@/components/ui/card";
 import { Button } from "@/components/ui/button";
@@ -14,6 +14,7 @@ const Bills = () => {
   const [page, setPage] = useState(1);
   const [totalPages, setTotalPages] = useState(1);
   const [selected, setSelected] = useState<any>(null);
+  const [previewUrl, setPreviewUrl] = useState("");
   const [loadingDetails, setLoadingDetails] = useState(false);
 
   const [category, setCategory] = useState("");
@@ -37,6 +38,20 @@ const Bills = () => {
     fetchTransactions(page, category, sortOrder);
   }, [page, category, sortOrder]);
 
+  // image previews need a signed link; PDFs are not previewed
+  useEffect(() => {
+    setPreviewUrl("");
+    const fileUrl = selected?.file_url;
+    if (!fileUrl || fileUrl.endsWith(".pdf")) return;
+    let current = true;
+    documentUrl(fileUrl)
+      .then((url) => current && setPreviewUrl(url))
+      .catch((err) => console.error("Failed to load preview", err));
+    return () => {
+      current = false;
+    };
+  }, [selected?.file_url]);
+
   // Single fetch
   const fetchTransactionDetails = async (id: number) => {
     setLoadingDetails(true);
@@ -259,7 +274,7 @@ const Bills = () => {
                     </div>
                   ) : (
                     <img
-                      src={"http://localhost:5000" + selected.file_url}
+                      src={previewUrl}
                       alt="Bill Preview"
                       className="w-full h-48 object-contain rounded-lg border"
                     />
@@ -275,7 +290,7 @@ const Bills = () => {
             <Button
               className="w-full mt-5 bg-blue-600 text-white"
               onClick={() =>
-                selected.file_url && window.open("http://localhost:5000" + selected.file_url, "_blank")
+                selected.file_url && openDocument(selected.file_url)
               }
             >
               Download Bill
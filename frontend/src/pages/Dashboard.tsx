@@ -29,39 +29,37 @@ import {
 
 const Dashboard = () => {
   const [transactions, setTransactions] = useState<any[]>([]);
+  const [yearSummary, setYearSummary] = useState<any>(null);
+  const [monthSummary, setMonthSummary] = useState<any>(null);
   const [loading, setLoading] = useState(true);
   const [activeIndex, setActiveIndex] = useState<number | null>(null);
-  
-  // Fetch all transactions
+
+  const now = new Date();
+  const currentMonth = now.getMonth();
+  const currentYear = now.getFullYear();
+  const monthKey = `${currentYear}-${String(currentMonth + 1).padStart(2, "0")}`;
+
+  // Recent transactions for the insights + server-side totals for the stat cards
   useEffect(() => {
     (async () => {
       try {
-        const res = await api.get("/transactions/all?page=1");
-        setTransactions(res.data.transactions || []);
+        const [txRes, yearRes, monthRes] = await Promise.all([
+          api.get("/transactions/all?page=1"),
+          api.get(`/transactions/summary?from=${currentYear}-01&to=${currentYear}-12`),
+          api.get(`/transactions/summary?from=${monthKey}&to=${monthKey}`),
+        ]);
+        setTransactions(txRes.data.transactions || []);
+        setYearSummary(yearRes.data);
+        setMonthSummary(monthRes.data);
       } catch (err) {
         console.error("Dashboard load error:", err);
       }
       setLoading(false);
     })();
-  }, []);
-
-  const now = new Date();
-  const currentMonth = now.getMonth();
-  const currentYear = now.getFullYear();
-
-  // THIS MONTH TRANSACTIONS
-  const monthlyTxns = useMemo(() => {
-    return transactions.filter((t) => {
-      const d = new Date(t.transaction_date);
-      return d.getMonth() === currentMonth && d.getFullYear() === currentYear;
-    });
-  }, [transactions, currentMonth, currentYear]);
+  }, [currentYear, monthKey]);
 
   // TOTAL SPENT THIS MONTH
-  const totalSpent = monthlyTxns.reduce(
-    (sum, t) => sum + Number(t.amount),
-    0
-  );
+  const totalSpent = Number(monthSummary?.totals?.net || 0);
 
   // AVERAGE PER DAY
   const avgSpendPerDay = totalSpent / now.getDate();
@@ -71,9 +69,9 @@ const Dashboard = () => {
 
   // CATEGORY BREAKDOWN
   const categoryTotals: Record<string, number> = {};
-  monthlyTxns.forEach((t) => {
-    const cat = t.category || "other";
-    categoryTotals[cat] = (categoryTotals[cat] || 0) + Math.abs(Number(t.amount));
+  (monthSummary?.by_category || []).forEach((c: any) => {
+    const cat = c.category || "other";
+    categoryTotals[cat] = (categoryTotals[cat] || 0) + Number(c.income) - Number(c.expense);
   });
 
   const categoryColors: any = {
@@ -107,12 +105,10 @@ const Dashboard = () => {
   ];
 
   const monthTotals: Record<string, number> = {};
-  transactions.forEach((t) => {
-    const d = new Date(t.transaction_date);
-    const m = monthsOrder[d.getMonth()];
+  (yearSummary?.by_month || []).forEach((row: any) => {
+    const m = monthsOrder[Number(row.month.slice(5, 7)) - 1];
     // use signed amount: positive = income, negative = expense
-    const amt = Number(t.amount) || 0;
-    monthTotals[m] = (monthTotals[m] || 0) + amt;
+    monthTotals[m] = (monthTotals[m] || 0) + (Number(row.net) || 0);
   });
 
 
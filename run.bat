@@ -1 +1 @@
-powershell -ExecutionPolicy Bypass -File "%~dp0run.ps1"
\ No newline at end of file
+powershell -ExecutionPolicy Bypass -File "%~dp0run.ps1" %*
\ No newline at end of file
@@ -1,7 +1,15 @@
+# .\run.ps1        backend on serve.py (waitress on Windows), then the frontend
+# .\run.ps1 -Dev   backend on python app.py (reloader and debugger) instead
+param([switch]$Dev)
+
 Write-Output "Running Backend"
 cd backend
 .\.venv\Scripts\Activate.ps1
-python app.py &
+if ($Dev) {
+    python app.py &
+} else {
+    python serve.py &
+}
 
 Write-Output "Running Frontend"
 cd ../frontend